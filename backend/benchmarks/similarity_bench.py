@@ -0,0 +1,78 @@
+"""
+Recall / latency benchmark: grid similarity index vs. the exact vectorized scan,
+both over the standardized columns used by the default "scaled" metric.
+
+Usage (from backend/):
+    uv run python -m benchmarks.similarity_bench --records 1000000 --queries 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.metric_stats import NormalizedColumns
+from utils.metrics_store import MetricsStore
+from utils.vector_index import ExactIndex, GridIndex
+from utils.vector_utils import DEFAULT_FIELD_SCALES
+
+
+def _fill(store: MetricsStore, n: int, rng: np.random.Generator):
+    """Synthetic history in the same ranges as the /stream simulator."""
+    store.values[0, :n] = rng.uniform(90, 120, n).round(2)
+    store.values[1, :n] = rng.uniform(60, 85, n).round(2)
+    store.values[2, :n] = rng.uniform(12000, 15000, n).round(2)
+    store.timestamps[:n] = np.arange(n, dtype=np.int64) * 5_000_000_000
+    store.time_index[:n] = store.timestamps[:n]
+    store.size = store.written = n
+
+
+def _time_queries(index, queries: np.ndarray, k: int):
+    latencies, answers = [], []
+    for q in queries:
+        start = time.perf_counter()
+        slots, _ = index.query_batch(q[None, :], k)[0]
+        latencies.append(time.perf_counter() - start)
+        answers.append(set(slots.tolist()))
+    return np.asarray(latencies) * 1000.0, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--cell-size", type=float, nargs="+", default=[0.1, 0.25, 0.5])
+    parser.add_argument("--max-probe", type=int, nargs="+", default=[0, 8, 32])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    store = MetricsStore(args.records)
+    _fill(store, args.records, rng)
+    normalized = NormalizedColumns(store, DEFAULT_FIELD_SCALES)
+    normalized.refit()
+    queries = normalized.transform(np.column_stack([
+        rng.uniform(90, 120, args.queries),
+        rng.uniform(60, 85, args.queries),
+        rng.uniform(12000, 15000, args.queries),
+    ]))
+
+    exact_ms, truth = _time_queries(ExactIndex(store, points=normalized.values), queries, args.top_k)
+    print(f"{args.records:,} records, {args.queries} queries, top_k={args.top_k}")
+    print(f"{'index':<28}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'recall':>9}")
+    print(f"{'exact':<28}{0.0:>9.2f}{np.percentile(exact_ms, 50):>9.3f}{np.percentile(exact_ms, 95):>9.3f}{1.0:>9.3f}")
+
+    for cell_size in args.cell_size:
+        for max_probe in args.max_probe:
+            index = GridIndex(store, cell_size=cell_size, max_probe=max_probe, points=normalized.values)
+            start = time.perf_counter()
+            index.rebuild()
+            build_s = time.perf_counter() - start
+            grid_ms, found = _time_queries(index, queries, args.top_k)
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            label = f"grid cell={cell_size:g} probe={max_probe or 'all'}"
+            print(f"{label:<28}{build_s:>9.2f}{np.percentile(grid_ms, 50):>9.3f}{np.percentile(grid_ms, 95):>9.3f}{recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
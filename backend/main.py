@@ -1,17 +1,33 @@
 import asyncio
 import datetime
+from contextlib import asynccontextmanager
 import json
 import os
 import random
 from typing import Optional
-import time
-import requests
-from utils.orchestrate_agent import get_ibm_access_token
-from fastapi import FastAPI,HTTPException
+from utils.orchestrate_agent import (
+    close_http_client,
+    get_http_client,
+    get_ibm_access_token_async,
+    init_http_client,
+    analyze_environmental_data,
+    token_manager,
+    trigger_workflow_async,
+)
+from fastapi import FastAPI,HTTPException,Query,Request
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse,JSONResponse
+from fastapi.responses import PlainTextResponse,StreamingResponse,JSONResponse
 import httpx
-from utils.watsonx_agent import analyze_with_watsonx, forecast_with_watsonx
+from utils.watsonx_agent import (
+    analyze_with_watsonx,
+    cache_stats,
+    check_readings,
+    forecast_with_watsonx,
+    stream_analysis,
+    stream_forecast,
+    warm_watsonx,
+)
 
 
 # Import in-memory vector utils
@@ -20,12 +36,50 @@ from utils.vector_utils import (
     store_metrics_vector,
     get_recent_metrics,
     find_similar_metrics,
+    find_similar_metrics_batch,
+    get_forecast,
+    get_history,
+    get_metrics_since,
+    get_write_position,
+    get_recent_values,
+    get_alert_position,
+    get_alerts_since,
+    get_recent_alerts,
+    get_store_stats,
 )
+from utils.broadcast import Broadcaster, ProcessElection
+from utils.metrics_util import ingest_readings
+from utils.run_tracker import RunFailed, RunTracker
+from utils.jobs import Job, JobRunner, QueueFull
+from utils.single_flight import AsyncSingleFlight
+from utils.sse import iter_events
+from utils.rules import analysis_rules
+from utils.workflow_dispatch import WorkflowDispatcher
+from utils.instrumentation import CONTENT_TYPE, TimingMiddleware, registry, upstream_timer
 
 # -----------------------
 #  SETUP FASTAPI + CORS
 # -----------------------
-app = FastAPI(title="GreenForce Backend", version="2.1 (In-Memory Edition)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run one shared ingestion + broadcast pipeline for all /stream clients."""
+    init_http_client()
+    job_runner.start()
+    tasks = [
+        asyncio.create_task(sensor_data_simulator()),
+        asyncio.create_task(metrics_publisher()),
+        asyncio.create_task(alerts_publisher()),
+        asyncio.create_task(run_in_threadpool(warm_watsonx)),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await job_runner.stop()
+    await close_http_client()
+
+
+app = FastAPI(title="GreenForce Backend", version="2.1 (In-Memory Edition)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,41 +88,125 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+app.add_middleware(
+    TimingMiddleware,
+    duration=registry.histogram(
+        "greenforce_http_request_seconds",
+        "HTTP request duration by route template (streaming responses: until the stream ends).",
+        ("method", "route", "status"),
+    ),
+    first_byte=registry.histogram(
+        "greenforce_http_response_start_seconds",
+        "Time until the response headers were sent, by route template.",
+        ("method", "route"),
+    ),
+    header=METRICS_TIMING_HEADER,
+)
+
 
 THREAD_ENDPOINT =  os.getenv("THREAD_ENDPOINT")
 RUN_RESULT_URL = THREAD_ENDPOINT + "/"
+MAX_SIMILAR_TOP_K = 100
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "0.25"))  # seconds between store tails
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "100"))  # per-client buffer before dropping
+INGEST_MAX_INFLIGHT = int(os.getenv("INGEST_MAX_INFLIGHT", "4"))  # concurrent /ingest batches per worker
+INGEST_MAX_READINGS = int(os.getenv("INGEST_MAX_READINGS", "100000"))  # readings per request
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(32 * 1024 * 1024)))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))  # agent runs in flight per worker process
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "256"))
+JOB_TTL_S = float(os.getenv("JOB_TTL_S", "600"))  # finished jobs stay queryable this long
+WORKFLOW_MAX_PARALLEL = int(os.getenv("WORKFLOW_MAX_PARALLEL", "8"))  # concurrent orchestrate triggers
+WORKFLOW_COOLDOWN_S = float(os.getenv("WORKFLOW_COOLDOWN_S", "300"))  # repeat triggers within this collapse
+WORKFLOW_RETRIES = int(os.getenv("WORKFLOW_RETRIES", "3"))
+WORKFLOW_MAX_TRIGGERS = 500  # per /workflows/trigger request
+
+metrics_hub = Broadcaster(max_queue=STREAM_QUEUE_SIZE)
+alerts_hub = Broadcaster(max_queue=STREAM_QUEUE_SIZE)
+ingest_slots = asyncio.Semaphore(INGEST_MAX_INFLIGHT)
+simulator_election = ProcessElection("greenforce-simulator")
+run_tracker = RunTracker(RUN_RESULT_URL)
+chat_flight = AsyncSingleFlight()
+workflow_dispatcher = WorkflowDispatcher(
+    trigger_workflow_async,
+    max_parallel=WORKFLOW_MAX_PARALLEL,
+    cooldown_s=WORKFLOW_COOLDOWN_S,
+    retries=WORKFLOW_RETRIES,
+    on_auth_error=token_manager.invalidate,
+)
 
 
 # -----------------------
 #  HELPER FUNCTIONS
 # -----------------------
-def generate_embedding(metric):
-    """Convert metrics to a simple normalized embedding vector."""
-    return [
-        metric["co2_emissions"] / 150.0,
-        metric["waste_level"] / 100.0,
-        metric["energy_usage"] / 20000.0,
-    ]
+async def sensor_data_simulator():
+    """Store simulated metrics every 5 seconds (in one elected worker only)."""
+    while True:
+        if simulator_election.try_acquire():
+            metrics = {
+                "timestamp": datetime.datetime.utcnow().isoformat(),
+                "co2_emissions": round(random.uniform(90, 120), 2),
+                "waste_level": round(random.uniform(60, 85), 2),
+                "energy_usage": round(random.uniform(12000, 15000), 2),
+            }
 
+            # Store data in in-memory DB, off the event loop: the write waits for the
+            # store and derived-state locks, which /ingest and /similar also take
+            try:
+                await run_in_threadpool(store_metrics_vector, metrics)
+            except Exception as e:
+                print(f"⚠️ In-memory insert error: {e}")
 
-async def sensor_data_stream():
-    """Stream simulated metrics every 5 seconds."""
+        await asyncio.sleep(5)
+
+
+def _metrics_messages(position: int):
+    """
+    SSE messages for the records stored after `position` and the new position. Only
+    the newest STREAM_QUEUE_SIZE are encoded: a subscriber's queue could not hold more.
+    """
+    records, position = get_metrics_since(position, limit=STREAM_QUEUE_SIZE)
+    return [f"data: {json.dumps(record)}\n\n" for record in records], position
+
+
+async def metrics_publisher():
+    """Publish newly stored records, whichever worker wrote them, to /stream subscribers."""
+    position = get_write_position()
     while True:
-        metrics = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "co2_emissions": round(random.uniform(90, 120), 2),
-            "waste_level": round(random.uniform(60, 85), 2),
-            "energy_usage": round(random.uniform(12000, 15000), 2),
-        }
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+        try:
+            if not metrics_hub.subscriber_count:
+                position = get_write_position()
+                continue
+            # fetching and encoding a burst (e.g. after a bulk /ingest) stays off the event loop
+            messages, position = await run_in_threadpool(_metrics_messages, position)
+            for message in messages:
+                metrics_hub.publish(message)
+        except Exception as e:
+            print(f"⚠️ Stream publish error: {e}")
 
-        # Store data in in-memory DB
+
+async def alerts_publisher():
+    """Publish anomaly alerts raised by the ingest-time detectors to /alerts/stream subscribers."""
+    position = await run_in_threadpool(get_alert_position)
+    while True:
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
         try:
-            store_metrics_vector(metrics)
+            alerts, position = await run_in_threadpool(get_alerts_since, position)
+            for alert in alerts:
+                alerts_hub.publish(f"event: alert\ndata: {json.dumps(alert)}\n\n")
         except Exception as e:
-            print(f"⚠️ In-memory insert error: {e}")
+            print(f"⚠️ Alert publish error: {e}")
 
-        yield f"data: {json.dumps(metrics)}\n\n"
-        await asyncio.sleep(5)
+
+async def sensor_data_stream():
+    """SSE events for one client: the latest record right away, then the shared feed."""
+    latest = get_recent_metrics(1)
+    if latest:
+        yield f"data: {json.dumps(latest[0])}\n\n"
+    async for message in metrics_hub.stream():
+        yield message
 
 
 def get_recent_data(limit=100):
@@ -80,27 +218,6 @@ def get_recent_data(limit=100):
         return []
     
 
-async def get_or_create_thread(
-    query: str, token: str, thread_id: Optional[str] = None
-) -> str:
-    """Creates a thread when needed and returns its id."""
-    if thread_id:
-        return thread_id
-    headers = {"Authorization": f"Bearer {token}"}
-    body = {"message": {"role": "user", "content": query}}
-    r = requests.post(THREAD_ENDPOINT, headers=headers, json=body)
-    r.raise_for_status()
-
-    data = r.json()
-    tid = data.get("thread_id")
-
-    if not tid:
-        raise HTTPException(
-            status_code=502, detail="Upstream did not return thread_id."
-        )
-    return tid
-
-
 def _extract_final_text(payload: dict) -> str:
     """Looks in common locations for final text."""
     if not isinstance(payload, dict):
@@ -132,28 +249,139 @@ def _extract_final_text(payload: dict) -> str:
             return "\n".join(dedup).strip()
     return ""
 
-async def _poll_run_result(
-    run_id: str, headers: dict, timeout_s: int = 60, interval_s: float = 0.7
-):
-    """Polls <RUN_RESULT_URL>/<run_id> until completed or failed or timeout."""
-    url = f"{RUN_RESULT_URL.rstrip('/')}/{run_id}"
-    start = time.time()
-    while True:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        data = r.json()
-        status = (
-            data.get("status") or data.get("state") or data.get("run_status") or ""
-        ).lower()
-        if status in {"completed", "succeeded", "success", "done"}:
-            return data
-        if status in {"failed", "error", "cancelled"}:
-            raise HTTPException(
-                status_code=400, detail=f"Run failed: {json.dumps(data)}"
-            )
-        if time.time() - start > timeout_s:
-            raise HTTPException(status_code=408, detail="Polling timed out.")
-        await asyncio.sleep(interval_s)
+async def _wait_run_result(run_id: str, headers: dict, timeout_s: float = 60):
+    """Waits for <RUN_RESULT_URL>/<run_id> through the shared run tracker."""
+    try:
+        return await run_tracker.wait(run_id, headers, timeout_s)
+    except RunFailed as e:
+        raise HTTPException(
+            status_code=400, detail=f"Run failed: {json.dumps(e.data)}"
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail="Polling timed out.")
+
+async def _orchestrate_chat(query: str, agent_id: str, thread_id: Optional[str] = None):
+    """Runs one non-streaming agent turn. Returns (response body, raw upstream payload)."""
+    token = await get_ibm_access_token_async()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+    }
+    body = {"message": {"role": "user", "content": query}, "agent_id": agent_id}
+    if thread_id:
+        body["thread_id"] = thread_id
+    params = {"stream": "false", "multiple_content": "true"}
+
+    with upstream_timer("orchestrate", "chat"):
+        trig = await get_http_client().post(
+            THREAD_ENDPOINT, headers=headers, params=params, json=body
+        )
+        trig.raise_for_status()
+    trig_data = trig.json()
+
+    inline_text = _extract_final_text(trig_data)
+    returned_thread = trig_data.get("thread_id") or thread_id
+    if inline_text:
+        out = {
+            "error_message": False,
+            "status": "completed",
+            "response": inline_text,
+            "thread_id": returned_thread,
+        }
+        return out, trig_data
+
+    run_id = trig_data.get("run_id")
+    if not run_id:
+        out = {
+            "error_message": False,
+            "status": trig_data.get("status") or "unknown",
+            "response": "",
+            "thread_id": returned_thread,
+        }
+        return out, trig_data
+
+    final_data = await _wait_run_result(run_id, headers)
+    final_text = _extract_final_text(final_data) or ""
+    returned_thread = final_data.get("thread_id") or returned_thread
+    status = final_data.get("status") or "completed"
+
+    out = {
+        "error_message": False,
+        "status": str(status),
+        "response": final_text,
+        "thread_id": returned_thread,
+    }
+    return out, final_data
+
+
+async def _coalesced_chat(query: str, agent_id: str, thread_id: Optional[str] = None):
+    """
+    _orchestrate_chat, shared by identical concurrent requests on the same thread;
+    returns a private copy. Calls without a thread_id create a new thread, so they
+    are never shared: unrelated callers sending the same text would otherwise get
+    one run and one thread between them.
+    """
+    if not thread_id:
+        return await _orchestrate_chat(query, agent_id)
+    out, raw = await chat_flight.do(
+        (query, agent_id, thread_id), lambda: _orchestrate_chat(query, agent_id, thread_id)
+    )
+    return dict(out), raw
+
+
+async def _run_job(job: Job):
+    """JobRunner handler for POST /runs."""
+    out, _ = await _coalesced_chat(**job.params)
+    return out
+
+
+job_runner = JobRunner(_run_job, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl_s=JOB_TTL_S)
+
+
+# -----------------------
+#  /metrics COLLECTORS (read at scrape time)
+# -----------------------
+registry.collect(
+    "greenforce_store_records", "Records held by the metrics store, by kind.",
+    lambda: {(key,): value for key, value in get_store_stats().items() if key != "max_lag_s"}, ("kind",),
+)
+registry.collect(
+    "greenforce_store_max_lag_seconds", "Largest lateness of an out-of-order record seen by the store.",
+    lambda: get_store_stats()["max_lag_s"],
+)
+registry.collect(
+    "greenforce_sse_subscribers", "Connected SSE clients per broadcast hub.",
+    lambda: {("stream",): metrics_hub.subscriber_count, ("alerts",): alerts_hub.subscriber_count}, ("hub",),
+)
+registry.collect(
+    "greenforce_response_cache_lookups_total", "Response cache lookups by outcome.",
+    lambda: {
+        (name, outcome): stats[key]
+        for name, stats in cache_stats().items()
+        for outcome, key in (("hit", "hits"), ("similar_hit", "similar_hits"), ("miss", "misses"))
+    },
+    ("cache", "outcome"), kind="counter",
+)
+registry.collect(
+    "greenforce_response_cache_hit_ratio", "Share of response cache lookups answered from the cache.",
+    lambda: {(name,): stats["hit_rate"] for name, stats in cache_stats().items()}, ("cache",),
+)
+registry.collect(
+    "greenforce_response_cache_entries", "Entries held by each response cache.",
+    lambda: {(name,): stats["entries"] for name, stats in cache_stats().items()}, ("cache",),
+)
+registry.collect(
+    "greenforce_analyze_verdicts_total", "/analyze pre-screen verdicts.",
+    lambda: {("local",): analysis_rules.answered_locally, ("escalated",): analysis_rules.escalated},
+    ("verdict",), kind="counter",
+)
+registry.collect(
+    "greenforce_workflow_triggers_total", "Workflow dispatcher activity.",
+    lambda: {(key,): value for key, value in workflow_dispatcher.stats().items() if key in ("sent", "retried", "deduplicated")},
+    ("kind",), kind="counter",
+)
+registry.collect("greenforce_jobs_pending", "Agent runs queued for a worker.", lambda: job_runner.pending)
+
 
 # -----------------------
 #  ENDPOINTS
@@ -167,15 +395,67 @@ def root():
 
 @app.get("/stream")
 async def stream_metrics():
-    """SSE stream for live simulated metrics."""
+    """SSE stream for live metrics, fanned out from the shared publisher."""
     return StreamingResponse(sensor_data_stream(), media_type="text/event-stream")
 
 
+@app.get("/alerts")
+def alerts(limit: int = 50):
+    """Recent anomaly alerts and the detectors' current baselines."""
+    return get_recent_alerts(limit)
+
+
+@app.get("/alerts/stream")
+async def alerts_stream():
+    """SSE feed of anomaly alerts ("alert" events) as records are ingested."""
+    return StreamingResponse(alerts_hub.stream(), media_type="text/event-stream")
+
+
 @app.get("/history")
-def history():
-    """Return most recent metrics."""
-    data = get_recent_data()
-    return {"history": data}
+def history(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    resolution: Optional[str] = None,
+    points: Optional[int] = None,
+):
+    """
+    Without parameters: the most recent raw metrics. With from/to/resolution/points:
+    a downsampled series (mean plus min/max/p95 per bucket) from the rollups, or with
+    resolution=raw the records in the range, found by binary search on the time index.
+    """
+    if start is None and end is None and resolution is None and points is None:
+        data = get_recent_data()
+        return {"history": data}
+    try:
+        return get_history(start, end, resolution, points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/ingest")
+async def ingest(request: Request):
+    """
+    Bulk ingestion for real sensors. Body: a JSON array (or single object) of readings,
+    or NDJSON with one reading per line; each reading is
+    {co2_emissions, waste_level, energy_usage, timestamp?}.
+    Applies backpressure: 429 + Retry-After while INGEST_MAX_INFLIGHT batches are in progress.
+    """
+    if ingest_slots.locked():
+        raise HTTPException(
+            status_code=429, detail="Ingestion busy, retry shortly.", headers={"Retry-After": "1"}
+        )
+    async with ingest_slots:
+        if int(request.headers.get("content-length") or 0) > INGEST_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Payload too large.")
+        body = await request.body()
+        if len(body) > INGEST_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Payload too large.")
+        try:
+            return await run_in_threadpool(
+                ingest_readings, body, request.headers.get("content-type", ""), INGEST_MAX_READINGS
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/analyze")
@@ -184,28 +464,87 @@ def analyze_data(data: dict):
     Analyze sustainability metrics using Watsonx.ai and suggest workflow actions.
     Optionally simulate triggering workflows in Watson Orchestrate.
     """
-    return analyze_with_watsonx(data)
+    try:
+        return analyze_with_watsonx(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/analyze/stream")
+async def analyze_data_stream(data: dict):
+    """/analyze as SSE: model tokens as they arrive, then the same final payload."""
+    try:
+        check_readings(data)  # validate before the stream starts
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(iterate_in_threadpool(stream_analysis(data)), media_type="text/event-stream")
+
+
+@app.get("/analyze/rules")
+def analyze_rules(window: int = 1000):
+    """
+    The /analyze pre-screen rules, how many requests they answered locally vs escalated,
+    and how often each rule fires over the last `window` stored records.
+    """
+    return {**analysis_rules.describe(), "recent": analysis_rules.hit_rates(get_recent_values(window))}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Request latencies, upstream call timings and store/cache/stream state in Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/cache/stats")
+def response_cache_stats():
+    """Hit/miss/eviction counters of the /analyze and /forecast response caches."""
+    return cache_stats()
 
 
 @app.post("/similar")
 def find_similar(data: dict):
-    """Find similar sustainability patterns from in-memory store."""
+    """
+    Find similar sustainability patterns from in-memory store.
+    Optional body keys: "metric" (see find_similar_metrics_batch) and per-field "weights".
+    """
     try:
-        results = find_similar_metrics(data, top_k=5)
+        results = find_similar_metrics(
+            data, top_k=5, metric=data.get("metric"), weights=data.get("weights")
+        )
         return {"similar": results}
     except Exception as e:
         print(f"⚠️ Similarity search failed: {e}")
         return {"similar": []}
-    
+
+
+@app.post("/similar/batch")
+def find_similar_batch(data: dict):
+    """
+    Find similar patterns for several metric snapshots in one vectorized pass.
+    Body: { "queries": [ {co2_emissions, waste_level, energy_usage}, ... ], "top_k": 5,
+            "metric": "scaled" | "euclidean" | "cosine" | "mahalanobis", "weights": {...} }
+    """
+    try:
+        queries = data.get("queries") or []
+        top_k = min(max(int(data.get("top_k", 5)), 1), MAX_SIMILAR_TOP_K)
+        results = find_similar_metrics_batch(
+            queries, top_k=top_k, metric=data.get("metric"), weights=data.get("weights")
+        )
+        return {"similar": results}
+    except Exception as e:
+        print(f"⚠️ Batch similarity search failed: {e}")
+        return {"similar": []}
+
 
 @app.get("/get-result")
 async def get_result(query: str, agent_id: str):
     try:
-        token = get_ibm_access_token()
+        token = await get_ibm_access_token_async()
         headers = {"Authorization": f"Bearer {token}"}
 
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            task_response = await client.post(THREAD_ENDPOINT, headers=headers, json={
+        client = get_http_client()
+        with upstream_timer("orchestrate", "chat"):
+            task_response = await client.post(THREAD_ENDPOINT, headers=headers, timeout=10.0, json={
                 "message": {
                     "role": "user",
                     "content": query
@@ -213,40 +552,110 @@ async def get_result(query: str, agent_id: str):
                 "agent_id": agent_id
             })
 
-            if task_response.status_code != 200:
-                raise HTTPException(
-                    status_code=task_response.status_code,
-                    detail=f"Error from orchestration API: {task_response.text}"
-                )
+        if task_response.status_code != 200:
+            raise HTTPException(
+                status_code=task_response.status_code,
+                detail=f"Error from orchestration API: {task_response.text}"
+            )
 
-            run_id = task_response.json().get("run_id")
+        run_id = task_response.json().get("run_id")
 
-        result_url = f"{RUN_RESULT_URL}{run_id}"
+        try:
+            data = await run_tracker.wait(run_id, headers)
+        except RunFailed:
+            raise HTTPException(status_code=400, detail="❌ Task failed.")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=408, detail="⏱️ Polling timed out.")
+        return {"message": "✅ Task completed.", "result": data.get("result")}
 
-        timeout = 60
-        interval = 2
-        start_time = time.time()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"🔴 Server error: {str(e)}")
 
-        while True:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(result_url, headers=headers)
-                response.raise_for_status()
-                data = response.json()
+@app.get("/orchestrate/runs/{run_id}/events")
+async def run_events(run_id: str):
+    """SSE: status changes of an orchestrate run, ending with its result."""
+    token = await get_ibm_access_token_async()
+    if not token:
+        raise HTTPException(status_code=502, detail="Auth failed")
+    headers = {"Authorization": f"Bearer {token}"}
+    return StreamingResponse(run_tracker.events(run_id, headers), media_type="text/event-stream")
+
+@app.post("/runs", status_code=202)
+async def create_run(data: dict):
+    """Queue an agent run and return its job id without waiting for the upstream."""
+    query, agent_id = data.get("query"), data.get("agent_id")
+    if not query or not agent_id:
+        raise HTTPException(status_code=400, detail="'query' and 'agent_id' are required")
+    try:
+        job = job_runner.submit("chat", {"query": query, "agent_id": agent_id, "thread_id": data.get("thread_id")})
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    return {"id": job.id, "status": job.status}
 
-            status = data.get("status")
-            result = data.get("result")
 
-            if status == "completed":
-                return {"message": "✅ Task completed.", "result": result}
-            elif status == "failed":
-                raise HTTPException(status_code=400, detail="❌ Task failed.")
-            elif time.time() - start_time > timeout:
-                raise HTTPException(status_code=408, detail="⏱️ Polling timed out.")
+def _valid_trigger(trigger) -> bool:
+    return (
+        isinstance(trigger, dict)
+        and isinstance(trigger.get("workflow"), str) and bool(trigger["workflow"])
+        and isinstance(trigger.get("key"), (str, type(None)))
+        and isinstance(trigger.get("context"), (dict, type(None)))
+    )
 
-            await asyncio.sleep(interval)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"🔴 Server error: {str(e)}")
+@app.post("/workflows/trigger")
+async def trigger_workflows(data: dict):
+    """
+    Trigger orchestrate workflows and report one outcome per trigger.
+
+    Body: {"workflows": [{"workflow": name, "context": {...}, "key": optional dedupe key}]},
+    or {"metrics": {...}, "site": optional} to trigger whatever the threshold rules
+    select for those readings. Repeats of a workflow for the same key (else site, else
+    identical context) within WORKFLOW_COOLDOWN_S are collapsed into the earlier dispatch.
+    """
+    triggers = data.get("workflows")
+    if triggers is None and isinstance(data.get("metrics"), dict):
+        try:
+            check_readings(data["metrics"])  # same readings /analyze accepts
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        context = {**data["metrics"], **({"site": data["site"]} if data.get("site") else {})}
+        triggers = [
+            {"workflow": action["workflow"], "context": context}
+            for action in analyze_environmental_data(data["metrics"])
+        ]
+    if not isinstance(triggers, list) or not all(_valid_trigger(t) for t in triggers):
+        raise HTTPException(status_code=400, detail="Provide 'workflows' [{workflow, context?, key?}] or 'metrics'.")
+    if len(triggers) > WORKFLOW_MAX_TRIGGERS:
+        raise HTTPException(status_code=413, detail=f"At most {WORKFLOW_MAX_TRIGGERS} triggers per request.")
+    outcomes = await workflow_dispatcher.dispatch_many(triggers)
+    return {
+        "outcomes": outcomes,
+        "succeeded": sum(o["status"] == "succeeded" for o in outcomes),
+        "failed": sum(o["status"] != "succeeded" for o in outcomes),
+    }
+
+
+@app.get("/workflows/stats")
+def workflow_stats():
+    """Dispatcher counters: sends, retries, collapsed duplicates, in flight, cooling down."""
+    return workflow_dispatcher.stats()
+
+
+@app.get("/runs/{job_id}")
+def get_run(job_id: str):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired run id")
+    return job.to_dict()
+
+
+@app.get("/runs/{job_id}/events")
+async def get_run_events(job_id: str):
+    """SSE: the job's status changes, ending with its result or error."""
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired run id")
+    return StreamingResponse(job_runner.events(job), media_type="text/event-stream")
 
 # === /chat: STREAMING ENDPOINT ===
 @app.get("/chat")
@@ -258,60 +667,9 @@ async def chat_non_stream(
 ):
     """Non-streaming convenience endpoint. Tries inline result; if needed, polls by run_id."""
     try:
-        token = get_ibm_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
-        body = {"message": {"role": "user", "content": query}, "agent_id": agent_id}
-        if thread_id:
-            body["thread_id"] = thread_id
-        params = {"stream": "false", "multiple_content": "true"}
-
-        trig = requests.post(
-            THREAD_ENDPOINT, headers=headers, params=params, json=body
-        )
-        trig.raise_for_status()
-        trig_data = trig.json()
-
-        inline_text = _extract_final_text(trig_data)
-        returned_thread = trig_data.get("thread_id") or thread_id
-        if inline_text:
-            out = {
-                "error_message": False,
-                "status": "completed",
-                "response": inline_text,
-                "thread_id": returned_thread,
-            }
-            if include_raw:
-                out["raw"] = trig_data
-            return JSONResponse(out)
-
-        run_id = trig_data.get("run_id")
-        if not run_id:
-            out = {
-                "error_message": False,
-                "status": trig_data.get("status") or "unknown",
-                "response": "",
-                "thread_id": returned_thread,
-            }
-            if include_raw:
-                out["raw"] = trig_data
-            return JSONResponse(out)
-
-        final_data = await _poll_run_result(run_id, headers)
-        final_text = _extract_final_text(final_data) or ""
-        returned_thread = final_data.get("thread_id") or returned_thread
-        status = final_data.get("status") or "completed"
-
-        out = {
-            "error_message": False,
-            "status": str(status),
-            "response": final_text,
-            "thread_id": returned_thread,
-        }
+        out, raw = await _coalesced_chat(query, agent_id, thread_id)
         if include_raw:
-            out["raw"] = final_data
+            out["raw"] = raw
         return JSONResponse(out)
 
     except httpx.HTTPStatusError as http_err:
@@ -325,11 +683,24 @@ async def chat_non_stream(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
     
+def _event_thread_id(event: dict) -> Optional[str]:
+    """thread_id carried by an orchestrate stream event, at the top level or under data."""
+    data = event.get("data") if isinstance(event.get("data"), dict) else {}
+    for source in (event, data, data.get("message"), data.get("delta")):
+        if isinstance(source, dict) and source.get("thread_id"):
+            return source["thread_id"]
+    return None
+
+
 @app.get("/chat/v2", response_class=StreamingResponse)
 async def chat_with_agent(query: str, agent_id: str, thread_id: str = None):
+    """
+    Streams the agent's reply as SSE. Without a thread_id the upstream creates the
+    thread in this same call; its id is taken from the stream's events and included
+    in every frame once known.
+    """
     try:
-        token = get_ibm_access_token()
-        thread_id = await get_or_create_thread(query, token, thread_id)
+        token = await get_ibm_access_token_async()
 
         headers = {
             "Authorization": f"Bearer {token}",
@@ -342,8 +713,9 @@ async def chat_with_agent(query: str, agent_id: str, thread_id: str = None):
                 "content": query
             },
             "agent_id": agent_id,
-            "thread_id": thread_id
         }
+        if thread_id:
+            body["thread_id"] = thread_id
 
         params = {
             "stream": "true",
@@ -352,30 +724,27 @@ async def chat_with_agent(query: str, agent_id: str, thread_id: str = None):
         }
 
         async def stream_response():
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream("POST", THREAD_ENDPOINT, headers=headers, params=params, json=body) as response:
+            current_thread = thread_id
+            with upstream_timer("orchestrate", "chat_stream"):
+                async with get_http_client().stream("POST", THREAD_ENDPOINT, headers=headers, params=params, json=body, timeout=None) as response:
                     if response.status_code != 200:
                         error_text = await response.aread()
                         raise HTTPException(status_code=response.status_code, detail=error_text.decode())
 
-                    async for chunk in response.aiter_text():
-                        chunk = chunk.strip()
-                        if not chunk:
-                            continue
-                        try:
-                            event = json.loads(chunk)
-                            if event["event"] == "message.delta":
-                                contents = event["data"]["delta"].get("content", [])
-                                for part in contents:
-                                    if part.get("response_type") == "text":
-                                        response_json = {
-                                            "error_message": False,
-                                            "response": part["text"],
-                                            "thread_id": thread_id
-                                        }
-                                        yield f"data: {json.dumps(response_json)}\n\n"
-                        except json.JSONDecodeError:
+                    async for event in iter_events(response):
+                        current_thread = current_thread or _event_thread_id(event)
+                        if event.get("event") != "message.delta":
                             continue
+                        data = event.get("data") if isinstance(event.get("data"), dict) else {}
+                        delta = data.get("delta") if isinstance(data.get("delta"), dict) else {}
+                        for part in delta.get("content", []):
+                            if isinstance(part, dict) and part.get("response_type") == "text":
+                                response_json = {
+                                    "error_message": False,
+                                    "response": part.get("text", ""),
+                                    "thread_id": current_thread
+                                }
+                                yield f"data: {json.dumps(response_json)}\n\n"
 
         return StreamingResponse(stream_response(), media_type="text/event-stream")
 
@@ -386,6 +755,19 @@ async def chat_with_agent(query: str, agent_id: str, thread_id: str = None):
 
 
 @app.get("/forecast")
-def forecast():
-    """Generate sustainability trend forecast using Watsonx.ai"""
-    return forecast_with_watsonx()
+def forecast(horizon: Optional[float] = None, model: Optional[str] = None):
+    """Statistical forecast `horizon` seconds ahead, narrated by Watsonx.ai"""
+    try:
+        return forecast_with_watsonx(horizon, model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/forecast/stream")
+async def forecast_stream(horizon: Optional[float] = None, model: Optional[str] = None):
+    """/forecast as SSE: narration tokens as they arrive, then the same final payload."""
+    try:
+        await run_in_threadpool(get_forecast, horizon, model)  # validate before the stream starts
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(iterate_in_threadpool(stream_forecast(horizon, model)), media_type="text/event-stream")
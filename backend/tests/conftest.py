@@ -0,0 +1,33 @@
+import os
+import time
+
+import pytest
+
+# Module-level configuration is read at import time: keep the store small, on the heap,
+# and every upstream service switched off before any utils module is imported.
+os.environ.update(
+    MAX_MEMORY_RECORDS="4096",
+    METRICS_DATA_PATH="",
+    METRICS_SHM_NAME="",
+    WATSONX_API_KEY="",
+    WATSONX_PROJECT_ID="",
+    WORKFLOW_TRIGGER_URL="",
+    THREAD_ENDPOINT="http://127.0.0.1:9/threads",
+    IBM_TOKEN_URL="http://127.0.0.1:9/token",
+)
+
+
+@pytest.fixture
+def fresh_store():
+    """vector_utils with an empty store and derived state caught up with it."""
+    from utils import vector_utils
+
+    with vector_utils._derived_lock:
+        vector_utils._memory_store.clear()
+        vector_utils._normalized.stats.reset()
+        vector_utils._sync()
+    deadline = time.time() + 10
+    while not vector_utils._rollups_ready:  # clearing restarts the background rollup rebuild
+        assert time.time() < deadline, "rollup rebuild did not finish"
+        time.sleep(0.01)
+    return vector_utils
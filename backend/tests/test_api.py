@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)  # no lifespan: the simulator and publishers stay off
+
+VALID = {"co2_emissions": 95.0, "waste_level": 50.0, "energy_usage": 11000.0}
+BAD_READINGS = [
+    '{"co2_emissions": null, "waste_level": 50, "energy_usage": 11000}',
+    '{"waste_level": 50, "energy_usage": 11000}',
+    '{"co2_emissions": "abc", "waste_level": 50, "energy_usage": 11000}',
+    '{"co2_emissions": NaN, "waste_level": 50, "energy_usage": 11000}',
+    '{"co2_emissions": 95, "waste_level": Infinity, "energy_usage": 11000}',
+]
+
+
+def _post(path: str, body: str):
+    return client.post(path, content=body, headers={"content-type": "application/json"})
+
+
+@pytest.mark.parametrize("path", ["/analyze", "/analyze/stream"])
+@pytest.mark.parametrize("body", BAD_READINGS)
+def test_analyze_rejects_missing_non_numeric_and_non_finite_readings(path, body):
+    response = _post(path, body)
+    assert response.status_code == 400
+    assert "Metrics must" in response.json()["detail"]
+
+
+def test_analyze_answers_readings_within_thresholds_locally():
+    response = client.post("/analyze", json=VALID)
+    assert response.status_code == 200
+    assert response.json()["triggered"]["recommended_workflows"] == []
+
+
+@pytest.mark.parametrize("body", BAD_READINGS)
+def test_workflow_trigger_rejects_bad_metrics(body):
+    response = _post("/workflows/trigger", '{"metrics": %s}' % body)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {},
+        {"workflows": "CarbonAuditWorkflow"},
+        {"workflows": [{"workflow": ["CarbonAuditWorkflow"]}]},
+        {"workflows": [{"workflow": "CarbonAuditWorkflow", "key": ["k"]}]},
+        {"workflows": [{"workflow": "CarbonAuditWorkflow", "context": "plant-1"}]},
+    ],
+)
+def test_workflow_trigger_rejects_malformed_triggers(payload):
+    assert client.post("/workflows/trigger", json=payload).status_code == 400
+
+
+def test_workflow_trigger_limits_the_batch_size():
+    triggers = [{"workflow": "CarbonAuditWorkflow", "key": str(i)} for i in range(main.WORKFLOW_MAX_TRIGGERS + 1)]
+    assert client.post("/workflows/trigger", json={"workflows": triggers}).status_code == 413
+
+
+@pytest.mark.parametrize("path", ["/forecast", "/forecast/stream"])
+@pytest.mark.parametrize("horizon", ["inf", "nan", "-1", "0", "1e300"])
+def test_forecast_rejects_bad_horizons(fresh_store, path, horizon):
+    fresh_store.store_metrics_vector(dict(VALID))
+    assert client.get(path, params={"horizon": horizon}).status_code == 400
+
+
+def test_forecast_rejects_unknown_models(fresh_store):
+    fresh_store.store_metrics_vector(dict(VALID))
+    assert client.get("/forecast", params={"model": "arima"}).status_code == 400
+
+
+@pytest.mark.parametrize(
+    "params", [{"points": 2}, {"resolution": "2m"}, {"from": "2025-01-02T00:00:00", "to": "2025-01-01T00:00:00"}]
+)
+def test_history_rejects_bad_queries(fresh_store, params):
+    assert client.get("/history", params=params).status_code == 400
+
+
+def test_ingest_rejects_unparseable_bodies(fresh_store):
+    assert _post("/ingest", '[{"co2_emissions": 1,').status_code == 400
+
+
+def test_ingest_reports_bad_readings_per_row(fresh_store):
+    readings = [dict(VALID), {**VALID, "energy_usage": "high"}, {**VALID, "timestamp": "2250-01-01T00:00:00"}]
+    body = json.dumps(readings)[:-1] + ', {"co2_emissions": NaN, "waste_level": 1, "energy_usage": 1}]'
+    response = _post("/ingest", body)
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["accepted"] == 1 and summary["rejected"] == 3
+    assert [error["index"] for error in summary["errors"]] == [1, 2, 3]
+    assert len(fresh_store._memory_store) == 1
@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import pytest
+
+from utils.rollups import lttb_indices
+
+S = 1_000_000_000
+
+
+def _store_series(vector_utils, n: int, step_s: float, end: float):
+    """n records every step_s seconds up to `end`, with a sine on co2 and a spike at the middle."""
+    timestamps = ((end - step_s * np.arange(n)[::-1]) * S).astype(np.int64)
+    co2 = 100 + 10 * np.sin(np.arange(n) / 50)
+    co2[n // 2] = 250
+    vectors = np.column_stack([co2, np.full(n, 60.0), np.linspace(12000, 14000, n)])
+    vector_utils.store_metrics_batch(timestamps, vectors)
+    return timestamps, vectors
+
+
+def test_lttb_keeps_the_endpoints_and_the_peak():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 40)
+    y[613] = 50
+    keep = lttb_indices(x, y, 40)
+    assert len(keep) == 40 and keep[0] == 0 and keep[-1] == 999
+    assert 613 in keep and (np.diff(keep) > 0).all()
+
+
+def test_rollup_history_is_downsampled_to_the_point_budget(fresh_store):
+    now = time.time()
+    _store_series(fresh_store, 4000, 10, now)
+    result = fresh_store.get_history(now - 6 * 3600, now, resolution="1m", points=60)
+    rows = result["history"]
+    assert result["resolution"] == "1m"
+    assert 3 <= len(rows) <= 60
+    assert rows == sorted(rows, key=lambda row: row["timestamp"])
+    assert max(row["co2_emissions"] for row in rows) > 120  # the spike's bucket survives LTTB
+    for row in rows:
+        assert row["min"]["co2_emissions"] <= row["co2_emissions"] <= row["max"]["co2_emissions"]
+        assert row["min"]["co2_emissions"] <= row["p95"]["co2_emissions"] <= row["max"]["co2_emissions"]
+
+
+def test_rollup_buckets_count_every_record_in_range(fresh_store):
+    now = 1_800_000_000.0  # a minute boundary keeps the bucket edges exact
+    timestamps, _ = _store_series(fresh_store, 600, 10, now)
+    result = fresh_store.get_history(now - 3600, now, resolution="1m", points=1000)
+    in_range = ((timestamps >= (now - 3600) * S) & (timestamps <= now * S)).sum()
+    assert len(result["history"]) == 61  # the bucket starting at `to` holds its last record
+    assert sum(row["count"] for row in result["history"]) == in_range
+
+
+def test_auto_picks_the_finest_rollup_that_covers_the_range(fresh_store):
+    now = time.time()
+    _store_series(fresh_store, 200, 60, now)
+    assert fresh_store.get_history(now - 3600, now)["resolution"] == "1m"
+    assert fresh_store.get_history(now - 5 * 86400, now)["resolution"] == "5m"
+    assert fresh_store.get_history(now - 30 * 86400, now)["resolution"] == "1h"
+
+
+def test_raw_history_returns_the_newest_records_in_range(fresh_store):
+    now = time.time()
+    timestamps, vectors = _store_series(fresh_store, 100, 1, now)
+    result = fresh_store.get_history(now - 50.5, now, resolution="raw", points=10)
+    assert result["truncated"]
+    assert [row["energy_usage"] for row in result["history"]] == pytest.approx(vectors[-10:, 2].tolist())
+
+
+def test_history_reads_raw_records_until_the_rollups_are_rebuilt(fresh_store, monkeypatch):
+    now = time.time()
+    _store_series(fresh_store, 500, 5, now)
+    monkeypatch.setattr(fresh_store, "_rollups_ready", False)
+    result = fresh_store.get_history(now - 3600, now, resolution="1m", points=30)
+    assert result["resolution"] == "raw"
+    assert 3 <= len(result["history"]) <= 30
+    assert all(row["count"] == 1 for row in result["history"])
+    assert max(row["co2_emissions"] for row in result["history"]) == 250
+
+
+def test_background_rebuild_reproduces_the_incremental_rollups(fresh_store):
+    now = time.time()
+    _store_series(fresh_store, 3000, 20, now)
+    before = fresh_store.get_history(now - 86400, now, resolution="5m", points=10_000)["history"]
+    with fresh_store._derived_lock:
+        fresh_store._refit_rollups()
+    deadline = time.time() + 10
+    while not fresh_store._rollups_ready:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert fresh_store.get_history(now - 86400, now, resolution="5m", points=10_000)["history"] == before
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"points": 2}, {"resolution": "2m"}, {"start": 200.0, "end": 100.0}],
+)
+def test_invalid_history_queries_raise(fresh_store, kwargs):
+    with pytest.raises(ValueError):
+        fresh_store.get_history(**kwargs)
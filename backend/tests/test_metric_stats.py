@@ -0,0 +1,73 @@
+import numpy as np
+
+from utils.metric_stats import NORMALIZATION_MIN_SAMPLES, NormalizedColumns, RunningStats
+from utils.metrics_store import MetricsStore
+
+
+def _assert_matches(stats: RunningStats, rows: np.ndarray):
+    assert stats.count == len(rows)
+    assert np.allclose(stats.mean, rows.mean(axis=0))
+    assert np.allclose(stats.covariance, np.cov(rows, rowvar=False))
+
+
+def test_single_inserts_and_evictions_track_a_sliding_window():
+    rng = np.random.default_rng(0)
+    rows = rng.normal([100, 60, 13000], [5, 3, 400], size=(500, 3))
+    stats = RunningStats(3)
+    window = 64
+    for i, row in enumerate(rows):
+        if i >= window:
+            stats.remove(rows[i - window])
+        stats.add(row)
+    _assert_matches(stats, rows[-window:])
+
+
+def test_batch_updates_match_single_updates():
+    rng = np.random.default_rng(1)
+    rows = rng.normal(size=(300, 3)) * [1, 10, 1000]
+    stats = RunningStats(3)
+    stats.add_batch(rows[:120])
+    stats.add_batch(rows[120:])
+    stats.remove_batch(rows[:50])
+    _assert_matches(stats, rows[50:])
+
+
+def test_fit_recomputes_from_columns():
+    rng = np.random.default_rng(2)
+    rows = rng.normal(size=(40, 3))
+    stats = RunningStats(3)
+    stats.add(np.ones(3) * 1e6)  # discarded by fit
+    stats.fit(rows.T)
+    _assert_matches(stats, rows)
+
+
+def test_removing_the_last_rows_resets():
+    stats = RunningStats(3)
+    stats.add(np.array([1.0, 2.0, 3.0]))
+    stats.remove(np.array([1.0, 2.0, 3.0]))
+    assert stats.count == 0 and not stats.mean.any()
+    assert np.array_equal(stats.covariance, np.eye(3))
+
+
+def test_stats_live_in_the_store_block():
+    store = MetricsStore(8)
+    stats = RunningStats(3, block=store.stats_block)
+    stats.add(np.array([2.0, 4.0, 6.0]))
+    assert store.stats_block[0] == 1 and store.stats_block[1:4].tolist() == [2.0, 4.0, 6.0]
+
+
+def test_normalized_columns_use_default_scales_until_warmed_up():
+    store = MetricsStore(256)
+    columns = NormalizedColumns(store, (10.0, 10.0, 1000.0))
+    rng = np.random.default_rng(3)
+    rows = rng.normal([100, 60, 13000], [5, 3, 400], size=(NORMALIZATION_MIN_SAMPLES + 40, 3))
+    for i, row in enumerate(rows):
+        slot = store.append(i, row)
+        columns.observe(row)
+        columns.update_slot(slot, store.written)
+        if i == 0:
+            assert np.allclose(columns.values[:, 0], row / [10.0, 10.0, 1000.0])
+    assert columns.fitted
+    live = store.live_values()
+    assert np.allclose(columns.live_values(), (live - columns.center[:, None]) / columns.scale[:, None])
+    assert np.allclose(columns.center, live.mean(axis=1), atol=columns.scale * 0.25)
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from utils.metrics_store import (
+    HEADER_BYTES,
+    METRIC_FIELDS,
+    SEGMENT_MAGIC,
+    MetricsStore,
+    _H_CAPACITY,
+    _H_DIM,
+    _H_MAGIC,
+    _H_VERSION,
+    _H_WRITTEN,
+    _segment_bytes,
+)
+
+S = 1_000_000_000  # ns per second
+
+
+def _fill(store, timestamps):
+    """Append one record per timestamp (seconds); the value columns echo the append order."""
+    for i, ts in enumerate(timestamps):
+        store.append(int(ts * S), [float(i), float(i) * 2, float(i) * 3])
+
+
+def _brute_force(store, start, end):
+    slots = np.arange(store.size)
+    ts = store.timestamps[slots]
+    hits = slots[(ts >= start) & (ts <= end)]
+    return hits[np.argsort(store.timestamps[hits], kind="stable")]
+
+
+def test_range_slots_match_a_full_scan_with_late_records_and_wraparound():
+    rng = np.random.default_rng(7)
+    store = MetricsStore(64)
+    timestamps = np.arange(150, dtype=np.float64) * 10
+    late = rng.choice(150, 25, replace=False)
+    timestamps[late] -= rng.uniform(5, 400, 25)  # out-of-order arrivals
+    _fill(store, timestamps)
+    assert store.written == 150 and store.size == 64
+    for _ in range(200):
+        lo, hi = sorted(rng.uniform(0, 1600, 2))
+        start, end = int(lo * S), int(hi * S)
+        got = store.range_slots(start, end)
+        assert np.array_equal(np.sort(got), np.sort(_brute_force(store, start, end)))
+        assert (np.diff(store.timestamps[got]) >= 0).all()
+
+
+def test_range_slots_are_in_time_order_without_late_records():
+    store = MetricsStore(16)
+    _fill(store, range(40))
+    slots = store.range_slots(30 * S, 39 * S)
+    assert (store.timestamps[slots] // S).tolist() == list(range(30, 40))
+    assert store.max_lag == 0
+
+
+def test_append_many_matches_single_appends_across_the_wrap():
+    rng = np.random.default_rng(1)
+    timestamps = (np.cumsum(rng.uniform(0, 2, 90)) * S).astype(np.int64)
+    timestamps[[10, 50, 70]] -= 30 * S
+    vectors = rng.normal(size=(90, len(METRIC_FIELDS)))
+    one, bulk = MetricsStore(32), MetricsStore(32)
+    for ts, vec in zip(timestamps, vectors):
+        one.append(int(ts), vec)
+    bulk.append_many(timestamps[:20], vectors[:20])
+    bulk.append_many(timestamps[20:], vectors[20:])
+    for name in ("timestamps", "time_index", "values"):
+        assert np.array_equal(getattr(one, name), getattr(bulk, name))
+    assert (one.written, one.size, one.max_lag) == (bulk.written, bulk.size, bulk.max_lag)
+
+
+def test_max_lag_falls_once_the_late_record_is_overwritten():
+    store = MetricsStore(32)
+    _fill(store, [100, 200, 50])  # the third record trails the time index by 150 s
+    assert store.max_lag == 150 * S
+    _fill(store, range(300, 364))  # two full laps
+    assert store.max_lag == 0
+
+
+def test_recent_slots_and_rows_are_oldest_first():
+    store = MetricsStore(8)
+    _fill(store, range(20))
+    rows = store.rows(store.recent_slots(3))
+    assert [row["co2_emissions"] for row in rows] == [17.0, 18.0, 19.0]
+    assert rows[-1]["timestamp"] == "1970-01-01T00:00:19"
+
+
+def test_segment_survives_a_reopen(tmp_path):
+    path = str(tmp_path / "metrics.seg")
+    store = MetricsStore(32, path=path)
+    _fill(store, [10, 20, 5, 30])
+    store.close()
+
+    reopened = MetricsStore(32, path=path)
+    assert reopened.written == 4 and reopened.max_lag == 15 * S
+    assert reopened.values[0, :4].tolist() == [0.0, 1.0, 2.0, 3.0]
+    assert (reopened.timestamps[reopened.range_slots(0, 40 * S)] // S).tolist() == [5, 10, 20, 30]
+    reopened.close()
+
+
+def test_resizing_a_segment_keeps_the_newest_records(tmp_path):
+    path = str(tmp_path / "metrics.seg")
+    store = MetricsStore(32, path=path)
+    _fill(store, range(50))
+    store.close()
+
+    smaller = MetricsStore(8, path=path)
+    assert smaller.size == 8 and smaller.written == 8
+    assert (smaller.timestamps[smaller.recent_slots(8)] // S).tolist() == list(range(42, 50))
+    assert smaller.values[0, smaller.recent_slots(8)].tolist() == [float(i) for i in range(42, 50)]
+    smaller.close()
+
+
+def test_float_seconds_segments_are_migrated_to_epoch_ns(tmp_path):
+    path = str(tmp_path / "metrics.seg")
+    capacity, n = 16, 5
+    raw = np.zeros(_segment_bytes(capacity, version=2), dtype=np.uint8)
+    header = raw[:HEADER_BYTES].view(np.int64)
+    header[[_H_MAGIC, _H_VERSION, _H_CAPACITY, _H_DIM, _H_WRITTEN]] = [
+        SEGMENT_MAGIC, 2, capacity, len(METRIC_FIELDS), n
+    ]
+    raw[HEADER_BYTES:HEADER_BYTES + 8 * capacity].view(np.float64)[:n] = [1.5, 2.5, 2.0, 4.0, 5.0]
+    values = raw[HEADER_BYTES + 8 * capacity:].view(np.float64).reshape(len(METRIC_FIELDS), capacity)
+    values[:, :n] = np.arange(n)
+    raw.tofile(path)
+
+    store = MetricsStore(capacity, path=path)
+    assert store.written == n
+    assert store.timestamps[:n].tolist() == [1_500_000_000, 2_500_000_000, 2 * S, 4 * S, 5 * S]
+    assert store.time_index[:n].tolist() == [1_500_000_000, 2_500_000_000, 2_500_000_000, 4 * S, 5 * S]
+    assert store.max_lag == 500_000_000
+    assert store.values[1, :n].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    store.close()
+
+
+def test_rejects_files_that_are_not_segments(tmp_path):
+    path = tmp_path / "metrics.seg"
+    path.write_bytes(b"\x01" * HEADER_BYTES)
+    with pytest.raises(ValueError):
+        MetricsStore(8, path=str(path))
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from utils.metrics_store import METRIC_FIELDS, MetricsStore
+from utils.vector_index import ExactIndex, GridIndex, build_index
+
+
+def _store_with(points: np.ndarray, capacity: int) -> MetricsStore:
+    store = MetricsStore(capacity)
+    store.append_many(np.arange(len(points), dtype=np.int64), points)
+    return store
+
+
+def _assert_same_neighbours(grid, exact, queries, k, weights=None):
+    for (g_slots, g_dist), (e_slots, e_dist) in zip(
+        grid.query_batch(queries, k, weights=weights), exact.query_batch(queries, k, weights=weights)
+    ):
+        assert np.allclose(g_dist, e_dist)
+        # ties may come back in a different order, but never a different set of distances
+        assert len(set(g_slots.tolist())) == len(g_slots)
+
+
+def test_grid_matches_exact_search():
+    rng = np.random.default_rng(3)
+    points = rng.normal(size=(3000, len(METRIC_FIELDS)))
+    store = _store_with(points, 4096)
+    grid = GridIndex(store, cell_size=0.25, points=store.values)
+    exact = ExactIndex(store, points=store.values)
+    grid.rebuild()
+    queries = np.vstack([rng.normal(size=(40, 3)), rng.normal(size=(5, 3)) * 6])  # include far-away queries
+    for k in (1, 5, 50):
+        _assert_same_neighbours(grid, exact, queries, k)
+    _assert_same_neighbours(grid, exact, queries, 5, weights=np.array([1.0, 0.0, 4.0]))
+
+
+def test_grid_tracks_inserts_and_overwritten_slots():
+    rng = np.random.default_rng(4)
+    store = _store_with(rng.normal(size=(500, 3)), 512)
+    grid = GridIndex(store, cell_size=0.5, points=store.values)
+    exact = ExactIndex(store, points=store.values)
+    grid.rebuild()
+    queries = rng.normal(size=(20, 3))
+    for i in range(300):  # wraps the ring: these overwrite slots already in the grid
+        slot = store.append(10_000 + i, rng.normal(size=3) + 2.0)
+        grid.insert(slot)
+        if grid.wants_rebuild():
+            grid.rebuild()
+    _assert_same_neighbours(grid, exact, queries, 10)
+    grid.rebuild()
+    _assert_same_neighbours(grid, exact, queries, 10)
+
+
+def test_grid_handles_fewer_records_than_k():
+    store = _store_with(np.eye(3), 16)
+    grid = GridIndex(store, cell_size=0.25, points=store.values)
+    grid.rebuild()
+    slots, distances = grid.query_batch(np.zeros((1, 3)), 10)[0]
+    assert sorted(slots.tolist()) == [0, 1, 2]
+    assert np.allclose(distances, 1.0)
+
+
+def test_build_index_rejects_unknown_kinds():
+    with pytest.raises(ValueError):
+        build_index("kd-tree", MetricsStore(4))
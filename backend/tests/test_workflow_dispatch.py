@@ -0,0 +1,123 @@
+import asyncio
+
+import httpx
+
+from utils.workflow_dispatch import WorkflowDispatcher
+
+
+def _status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://orchestrate.test/workflows")
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=httpx.Response(status, request=request))
+
+
+class FakeSend:
+    """Records every send; fails with the queued errors first, then succeeds after `delay`."""
+
+    def __init__(self, errors=(), delay: float = 0.0):
+        self.calls = []
+        self.errors = list(errors)
+        self.delay = delay
+
+    async def __call__(self, workflow: str, context: dict):
+        self.calls.append((workflow, context))
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"workflow": workflow}
+
+
+def _dispatcher(send, **kwargs) -> WorkflowDispatcher:
+    return WorkflowDispatcher(send, backoff_initial_s=0.001, backoff_max_s=0.002, **kwargs)
+
+
+def test_concurrent_duplicates_share_one_send():
+    send = FakeSend(delay=0.05)
+    dispatcher = _dispatcher(send)
+    outcomes = asyncio.run(dispatcher.dispatch_many([
+        {"workflow": "CarbonAuditWorkflow", "context": {"site": "plant-1", "co2": 120}},
+        {"workflow": "CarbonAuditWorkflow", "context": {"site": "plant-1", "co2": 125}},
+        {"workflow": "CarbonAuditWorkflow", "context": {"site": "plant-2"}},
+    ]))
+    assert len(send.calls) == 2
+    assert [o["deduplicated"] for o in outcomes] == [False, True, False]
+    assert all(o["status"] == "succeeded" for o in outcomes)
+    assert dispatcher.stats()["deduplicated"] == 1
+
+
+def test_repeats_within_the_cooldown_collapse():
+    send = FakeSend()
+    dispatcher = _dispatcher(send, cooldown_s=60)
+
+    async def run():
+        first = await dispatcher.dispatch("WasteCollectionWorkflow", {"plant": "A"})
+        second = await dispatcher.dispatch("WasteCollectionWorkflow", {"plant": "A"})
+        other = await dispatcher.dispatch("WasteCollectionWorkflow", {"plant": "B"})
+        keyed = await dispatcher.dispatch("WasteCollectionWorkflow", {"plant": "C"}, key="line-1")
+        same_key = await dispatcher.dispatch("WasteCollectionWorkflow", {"plant": "D"}, key="line-1")
+        return first, second, other, keyed, same_key
+
+    first, second, other, keyed, same_key = asyncio.run(run())
+    assert not first["deduplicated"] and second["deduplicated"]
+    assert not other["deduplicated"] and not keyed["deduplicated"] and same_key["deduplicated"]
+    assert [context for _, context in send.calls] == [{"plant": "A"}, {"plant": "B"}, {"plant": "C"}]
+
+
+def test_dedupe_key_ignores_context_key_order():
+    a = WorkflowDispatcher.dedupe_key("w", {"x": 1, "y": 2})
+    b = WorkflowDispatcher.dedupe_key("w", {"y": 2, "x": 1})
+    assert a == b and a != WorkflowDispatcher.dedupe_key("w", {"x": 1, "y": 3})
+
+
+def test_transient_failures_are_retried():
+    send = FakeSend(errors=[_status_error(503), httpx.ConnectError("refused")])
+    dispatcher = _dispatcher(send, retries=3)
+    outcome = asyncio.run(dispatcher.dispatch("EnergyOptimizationWorkflow", {"site": "s"}))
+    assert outcome["status"] == "succeeded" and outcome["attempts"] == 3
+    assert dispatcher.stats()["retried"] == 2
+
+
+def test_retries_are_bounded_and_failures_are_not_remembered():
+    send = FakeSend(errors=[_status_error(500)] * 5)
+    dispatcher = _dispatcher(send, retries=2)
+
+    async def run():
+        failed = await dispatcher.dispatch("EnergyOptimizationWorkflow", {"site": "s"})
+        again = await dispatcher.dispatch("EnergyOptimizationWorkflow", {"site": "s"})
+        return failed, again
+
+    failed, again = asyncio.run(run())
+    assert failed["status"] == "failed" and failed["attempts"] == 3 and "500" in failed["error"]
+    assert not again["deduplicated"]  # a failure does not hold back the next trigger
+    assert again["status"] == "succeeded" and len(send.calls) == 6
+
+
+def test_client_errors_are_not_retried_but_401_refreshes_auth():
+    refreshed = []
+    send = FakeSend(errors=[_status_error(400)])
+    dispatcher = _dispatcher(send, on_auth_error=lambda: refreshed.append(True))
+    outcome = asyncio.run(dispatcher.dispatch("CarbonAuditWorkflow", {"site": "s"}))
+    assert outcome["status"] == "failed" and outcome["attempts"] == 1
+
+    send = FakeSend(errors=[_status_error(401)])
+    dispatcher = _dispatcher(send, on_auth_error=lambda: refreshed.append(True))
+    outcome = asyncio.run(dispatcher.dispatch("CarbonAuditWorkflow", {"site": "s"}))
+    assert outcome["status"] == "succeeded" and outcome["attempts"] == 2
+    assert refreshed == [True]
+
+
+def test_parallel_sends_are_bounded():
+    running, peak = 0, 0
+
+    async def send(workflow, context):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {}
+
+    dispatcher = _dispatcher(send, max_parallel=3)
+    triggers = [{"workflow": "CarbonAuditWorkflow", "context": {"site": f"s{i}"}} for i in range(12)]
+    outcomes = asyncio.run(dispatcher.dispatch_many(triggers))
+    assert all(o["status"] == "succeeded" for o in outcomes)
+    assert peak == 3
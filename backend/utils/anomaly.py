@@ -0,0 +1,163 @@
+import math
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+ANOMALY_DETECTORS = ("zscore", "ewma", "cusum")
+
+
+class _FieldState:
+    """Sliding-window baseline plus EWMA and CUSUM statistics for one series."""
+
+    __slots__ = ("window", "head", "count", "mean", "m2", "ewma", "cusum_high", "cusum_low", "alarms")
+
+    def __init__(self, size: int):
+        self.window = [0.0] * size
+        self.head = 0  # next slot to overwrite once the window is full
+        self.count = 0
+        self.mean = self.m2 = 0.0
+        self.ewma = None
+        self.cusum_high = self.cusum_low = 0.0
+        self.alarms = {name: 0 for name in ANOMALY_DETECTORS}  # +1 high, -1 low, 0 clear
+
+    def push(self, x: float):
+        """Add x to the window, dropping the oldest value when full (Welford add/remove)."""
+        size = len(self.window)
+        if self.count == size:
+            old = self.window[self.head]
+            self.count -= 1
+            delta = old - self.mean
+            self.mean -= delta / self.count
+            self.m2 -= delta * (old - self.mean)
+        self.window[self.head] = x
+        self.head = (self.head + 1) % size
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def std(self) -> float:
+        return math.sqrt(max(self.m2, 0.0) / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class AnomalyDetector:
+    """
+    Online anomaly detection per metric field, O(1) per record:
+
+      - "zscore": |x - mean| / std of the last `window` records exceeds `z`
+      - "ewma": an EWMA (weight `lam`) leaves mean ± L·std·sqrt(lam / (2 - lam))
+      - "cusum": two-sided CUSUM of standardized values (slack `k`) passes `h`
+
+    Each record is judged against the baseline of the records before it. Nothing is
+    reported until `min_samples` records are in the window, and a detector reports
+    once when it goes into alarm on a side (high or low), not on every record while
+    it stays there (CUSUM restarts from zero after each alarm).
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        window: int = 120,
+        min_samples: int = 20,
+        z: float = 4.0,
+        lam: float = 0.2,
+        L: float = 3.5,
+        k: float = 0.5,
+        h: float = 8.0,
+        replay_max: int = 5000,
+    ):
+        self.fields = tuple(fields)
+        self.window = window
+        self.min_samples = max(min_samples, 2)
+        self.z = z
+        self.lam = lam
+        self.ewma_width = L * math.sqrt(lam / (2.0 - lam))
+        self.k = k
+        self.h = h
+        self.replay_max = replay_max
+        self.reset()
+
+    def reset(self):
+        self._states = [_FieldState(self.window) for _ in self.fields]
+        self.records = 0
+        self.detections = 0
+
+    def update(self, ts: float, values: Sequence[float]) -> List[Dict]:
+        """Fold one record in; returns the alerts it raised (usually none)."""
+        alerts = []
+        lam = self.lam
+        for field, state, x in zip(self.fields, self._states, values):
+            x = float(x)
+            if state.count >= self.min_samples:
+                mean = state.mean
+                std = max(state.std(), 1e-9 * abs(mean), 1e-12)
+                score = (x - mean) / std
+                ewma = x if state.ewma is None else lam * x + (1.0 - lam) * state.ewma
+                state.ewma = ewma
+                ewma_score = (ewma - mean) / (std * self.ewma_width)
+                state.cusum_high = max(0.0, state.cusum_high + score - self.k)
+                state.cusum_low = max(0.0, state.cusum_low - score - self.k)
+                cusum = state.cusum_high if state.cusum_high >= state.cusum_low else -state.cusum_low
+                checks = (
+                    ("zscore", abs(score) > self.z, score, self.z),
+                    ("ewma", abs(ewma_score) > 1.0, ewma_score * self.ewma_width, self.ewma_width),
+                    ("cusum", abs(cusum) > self.h, cusum, self.h),
+                )
+                for name, firing, statistic, limit in checks:
+                    alarm = (1 if statistic > 0 else -1) if firing else 0
+                    if alarm and alarm != state.alarms[name]:
+                        alerts.append({
+                            "timestamp": ts,
+                            "field": field,
+                            "detector": name,
+                            "value": x,
+                            "baseline": mean,
+                            "std": std,
+                            "score": statistic,
+                            "limit": limit,
+                            "direction": "high" if alarm > 0 else "low",
+                        })
+                    state.alarms[name] = alarm
+                if abs(cusum) > self.h:
+                    state.cusum_high = state.cusum_low = 0.0
+            else:
+                state.ewma = x if state.ewma is None else lam * x + (1.0 - lam) * state.ewma
+            state.push(x)
+        self.records += 1
+        self.detections += len(alerts)
+        return alerts
+
+    def update_many(self, timestamps: np.ndarray, values: np.ndarray, report: bool = True) -> List[Dict]:
+        """Fold (n,) timestamps and (n, dim) values, oldest first; long batches replay only their tail."""
+        if len(timestamps) > self.replay_max:
+            self.reset()
+            timestamps, values = timestamps[-self.replay_max:], values[-self.replay_max:]
+        alerts = []
+        for ts, row in zip(timestamps.tolist(), values.tolist()):
+            found = self.update(ts, row)
+            if report:
+                alerts.extend(found)
+        return alerts
+
+    def refit(self, timestamps: np.ndarray, values: np.ndarray):
+        """Rebuild the state from history without reporting anything."""
+        self.reset()
+        tail = max(self.window * 4, self.min_samples)
+        self.update_many(timestamps[-tail:], values[-tail:], report=False)
+        self.detections = 0
+
+    def state(self) -> List[Dict]:
+        """Current baseline and statistics per field."""
+        return [
+            {
+                "field": field,
+                "samples": state.count,
+                "baseline": state.mean,
+                "std": state.std(),
+                "ewma": state.ewma,
+                "cusum_high": state.cusum_high,
+                "cusum_low": state.cusum_low,
+                "in_alarm": {name: ("high" if on > 0 else "low") for name, on in state.alarms.items() if on},
+            }
+            for field, state in zip(self.fields, self._states)
+        ]
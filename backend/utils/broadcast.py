@@ -0,0 +1,79 @@
+import asyncio
+import os
+import tempfile
+from typing import AsyncIterator, Set
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: every process considers itself elected
+    fcntl = None
+
+
+class Broadcaster:
+    """
+    In-process pub/sub hub: one producer publishes, every subscriber reads its own
+    bounded asyncio.Queue. Messages are published pre-encoded, so each extra
+    subscriber only costs a queue put. A subscriber that falls `max_queue`
+    messages behind loses its oldest messages instead of slowing everyone down.
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: Set[asyncio.Queue] = set()
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, message):
+        """Fan a message out to every subscriber without awaiting any of them."""
+        self.published += 1
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()  # slow consumer: drop its oldest message
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    async def stream(self) -> AsyncIterator:
+        """Yield published messages until the consumer goes away."""
+        queue = self.subscribe()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.unsubscribe(queue)
+
+
+class ProcessElection:
+    """
+    Non-blocking flock on a well-known lock file: at most one process on the host
+    holds it, so work such as the sensor simulator runs once however many uvicorn
+    workers are started. If the holder exits, the next try_acquire() elsewhere wins.
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._fd = None
+        self.elected = fcntl is None
+
+    def try_acquire(self) -> bool:
+        if self.elected:
+            return True
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.elected = True
+        except OSError:
+            self.elected = False
+        return self.elected
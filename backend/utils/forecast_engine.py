@@ -0,0 +1,191 @@
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+FORECAST_MODELS = ("ewma", "holt", "linear")
+
+
+class _FieldModels:
+    """Incremental EWMA, damped Holt and exponentially weighted linear-trend state for one series."""
+
+    __slots__ = (
+        "level", "ewma_var",
+        "holt_level", "holt_trend", "holt_var",
+        "s0", "st", "stt", "sy", "sty", "syy",
+        "last",
+    )
+
+    def __init__(self):
+        self.level = self.ewma_var = 0.0
+        self.holt_level = self.holt_trend = self.holt_var = 0.0
+        self.s0 = self.st = self.stt = self.sy = self.sty = self.syy = 0.0
+        self.last = 0.0
+
+
+class ForecastEngine:
+    """
+    Per-field forecasting state, updated in O(1) per record and queried in O(1).
+
+    Three models run side by side on every series:
+      - "ewma": simple exponential smoothing (level only), weight `alpha`
+      - "holt": Holt's linear method with a damped trend (`alpha`, `beta`, `phi`)
+      - "linear": least-squares line over time with exponential forgetting `decay`
+    One-step-ahead errors feed an exponentially weighted error variance per model,
+    from which forecast() derives symmetric prediction intervals (`z` std devs);
+    for the `nonnegative` fields forecasts and bounds are clipped at 0.
+    Every model forgets old data geometrically, so replaying only the newest
+    `replay_max` records reproduces the state to within rounding.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        alpha: float = 0.1,
+        beta: float = 0.02,
+        phi: float = 0.98,
+        decay: float = 0.999,
+        var_alpha: float = 0.05,
+        z: float = 1.96,
+        replay_max: int = 20000,
+        nonnegative: Sequence[str] = (),
+    ):
+        self.fields = tuple(fields)
+        self.floors = [0.0 if name in nonnegative else -math.inf for name in self.fields]
+        self.alpha, self.beta, self.phi = alpha, beta, phi
+        self.decay = decay
+        self.var_alpha = var_alpha
+        self.z = z
+        self.replay_max = replay_max
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.origin: Optional[float] = None  # epoch seconds of t=0 for the linear model
+        self.last_ts: Optional[float] = None
+        self.interval = 0.0  # EW mean seconds between records
+        self._models = [_FieldModels() for _ in self.fields]
+
+    # --- updates ---
+    def update(self, ts: float, values: Sequence[float]):
+        if self.origin is None:
+            self.origin = ts
+        if self.last_ts is not None and ts > self.last_ts:
+            gap = ts - self.last_ts
+            self.interval = gap if not self.interval else self.interval + self.var_alpha * (gap - self.interval)
+        newest = self.last_ts is None or ts >= self.last_ts
+        if newest:
+            self.last_ts = ts
+        t = (ts - self.origin) / 3600.0  # hours keep the regression sums well conditioned
+        alpha, beta, phi, decay, va = self.alpha, self.beta, self.phi, self.decay, self.var_alpha
+        first = self.count == 0
+        for m, y in zip(self._models, values):
+            y = float(y)
+            if newest:
+                m.last = y  # the reading with the latest timestamp, not the last one folded in
+            if first:
+                m.level = m.holt_level = y
+            else:
+                err = y - m.level
+                m.ewma_var += va * (err * err - m.ewma_var)
+                m.level += alpha * err
+
+                predicted = m.holt_level + phi * m.holt_trend
+                err = y - predicted
+                m.holt_var += va * (err * err - m.holt_var)
+                level = predicted + alpha * err
+                m.holt_trend = beta * (level - m.holt_level) + (1 - beta) * phi * m.holt_trend
+                m.holt_level = level
+            m.s0 = decay * m.s0 + 1.0
+            m.st = decay * m.st + t
+            m.stt = decay * m.stt + t * t
+            m.sy = decay * m.sy + y
+            m.sty = decay * m.sty + t * y
+            m.syy = decay * m.syy + y * y
+        self.count += 1
+
+    def update_many(self, timestamps: np.ndarray, values: np.ndarray):
+        """Fold (n,) timestamps and (n, dim) values, oldest first; long batches replay only their tail."""
+        n = len(timestamps)
+        if n > self.replay_max:
+            self.reset()
+            timestamps, values = timestamps[-self.replay_max:], values[-self.replay_max:]
+        for ts, row in zip(timestamps.tolist(), values.tolist()):
+            self.update(ts, row)
+
+    def refit(self, timestamps: np.ndarray, values: np.ndarray):
+        self.reset()
+        self.update_many(timestamps, values)
+
+    # --- queries ---
+    def _linear(self, m: _FieldModels, t: float):
+        """Weighted least-squares prediction at t (hours) and its residual variance factor."""
+        if m.s0 < 2:
+            return None
+        t_mean = m.st / m.s0
+        y_mean = m.sy / m.s0
+        sxx = m.stt - m.s0 * t_mean * t_mean
+        if sxx <= 1e-12:
+            return None
+        slope = (m.sty - m.s0 * t_mean * y_mean) / sxx
+        sse = max(m.syy - m.s0 * y_mean * y_mean - slope * slope * sxx, 0.0)
+        var = sse / max(m.s0 - 2.0, 1.0)
+        predicted = y_mean + slope * (t - t_mean)
+        return predicted, var * (1.0 + 1.0 / m.s0 + (t - t_mean) ** 2 / sxx)
+
+    def _holt_var_factor(self, h: float) -> float:
+        """1 + sum_{j=1}^{h-1} (alpha + alpha*beta*(phi + ... + phi^j))^2, in closed form."""
+        alpha, beta, phi = self.alpha, self.beta, self.phi
+        steps = max(h - 1.0, 0.0)
+        if phi >= 1.0:  # undamped: sum of (alpha + alpha*beta*j)^2 for j = 1..n
+            n = int(steps)
+            c = alpha * beta
+            return 1.0 + n * alpha * alpha + alpha * c * n * (n + 1) + c * c * n * (n + 1) * (2 * n + 1) / 6.0
+        c = phi / (1.0 - phi)
+        a = alpha * (1.0 + beta * c)
+        b = alpha * beta * c
+        geo1 = phi * (1.0 - phi ** steps) / (1.0 - phi)
+        geo2 = phi * phi * (1.0 - phi ** (2 * steps)) / (1.0 - phi * phi)
+        return 1.0 + steps * a * a - 2.0 * a * b * geo1 + b * b * geo2
+
+    def forecast(self, horizon_s: float, model: str = "holt") -> Optional[Dict]:
+        """Point forecasts and prediction intervals `horizon_s` seconds past the newest record."""
+        if not self.count:
+            return None
+        if model not in FORECAST_MODELS:
+            raise ValueError(f"Unknown forecast model: {model}")
+        steps = max(horizon_s / self.interval, 1.0) if self.interval > 0 else 1.0
+        t_target = (self.last_ts + horizon_s - self.origin) / 3600.0
+        damp = self.phi * (1.0 - self.phi ** steps) / (1.0 - self.phi) if self.phi < 1.0 else steps
+        ewma_factor = 1.0 + (steps - 1.0) * self.alpha ** 2
+        holt_factor = self._holt_var_factor(steps)
+
+        fields: List[Dict] = []
+        for name, floor, m in zip(self.fields, self.floors, self._models):
+            models = {
+                "ewma": (m.level, m.ewma_var * ewma_factor),
+                "holt": (m.holt_level + damp * m.holt_trend, m.holt_var * holt_factor),
+            }
+            linear = self._linear(m, t_target)
+            models["linear"] = linear if linear is not None else models["ewma"]
+            fields.append({
+                "field": name,
+                "latest": m.last,
+                "level": m.level,
+                "models": {
+                    key: {
+                        "predicted": max(p, floor),
+                        "lower": max(p - self.z * math.sqrt(v), floor),
+                        "upper": max(p + self.z * math.sqrt(v), floor),
+                    }
+                    for key, (p, v) in models.items()
+                },
+            })
+        return {
+            "model": model,
+            "horizon_s": horizon_s,
+            "steps": steps,
+            "records": self.count,
+            "as_of": self.last_ts,
+            "fields": fields,
+        }
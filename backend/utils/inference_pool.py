@@ -0,0 +1,168 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+
+class PoolTimeout(Exception):
+    """No inference instance became free within the checkout timeout."""
+
+
+def is_auth_error(error: Exception) -> bool:
+    """Best-effort check for an expired/invalid token coming back from the SDK."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status in (401, 403):
+        return True
+    text = str(error).lower()
+    return "401" in text or "unauthorized" in text or "token expired" in text or "authentication" in text
+
+
+class InferencePool:
+    """
+    A fixed number of model instances sharing one authenticated client.
+
+    The client and each model instance are built once (on warm() or first checkout)
+    and then reused, so a call pays only for generate(). The pool size doubles as the
+    concurrency limit: callers block in checkout() until an instance is free. When a
+    call fails with an auth error the client is dropped and every instance is rebuilt
+    lazily against a fresh one ("generation" bump).
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], object],
+        model_factory: Callable[[object], object],
+        size: int = 4,
+        checkout_timeout: Optional[float] = 30.0,
+    ):
+        self.client_factory = client_factory
+        self.model_factory = model_factory
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self._lock = threading.Lock()
+        self._client = None
+        self._generation = 0
+        self._slots: queue.Queue = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._slots.put(None)  # placeholder: built on first checkout
+        self.builds = 0
+        self.refreshes = 0
+
+    def _current_client(self) -> Tuple[object, int]:
+        with self._lock:
+            if self._client is None:
+                self._client = self.client_factory()
+            return self._client, self._generation
+
+    def invalidate(self, generation: Optional[int] = None):
+        """Forget the client (and, lazily, every instance built on it)."""
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self._client = None
+                self._generation += 1
+                self.refreshes += 1
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[object]:
+        try:
+            slot = self._slots.get(timeout=self.checkout_timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"all {self.size} inference instances busy")
+        try:
+            if slot is None or slot[0] != self._generation:
+                slot = None
+                client, generation = self._current_client()
+                if client is None:
+                    raise RuntimeError("inference client unavailable")
+                slot = (generation, self.model_factory(client))
+                self.builds += 1
+            yield slot[1]
+        except Exception as e:
+            if slot is not None and is_auth_error(e):
+                self.invalidate(slot[0])
+                slot = None
+            raise
+        finally:
+            self._slots.put(slot)
+
+    def generate(self, prompt, params: Optional[dict] = None):
+        """model.generate() on a pooled instance, retried once after an auth refresh."""
+        for attempt in range(2):
+            try:
+                with self.checkout() as model:
+                    return model.generate(prompt=prompt, params=params)
+            except Exception as e:
+                if attempt or not is_auth_error(e):
+                    raise
+
+    def warm(self):
+        """Build the client and every instance up front (called at startup)."""
+        for _ in range(self.size):
+            with self.checkout():
+                pass
+
+
+class _Batch:
+    __slots__ = ("prompts", "results", "error", "full", "done")
+
+    def __init__(self):
+        self.prompts: List[str] = []
+        self.results: List[object] = []
+        self.error: Optional[Exception] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Gathers prompts submitted within `window_s` (or until `max_batch` arrive) and sends
+    them as one list-prompt call to `run_batch`, which must return one result per prompt.
+
+    There is no background thread: the first caller of a batch waits out the window and
+    then runs the call for everyone; the others block until their result is in.
+    """
+
+    def __init__(self, run_batch: Callable[[List[str]], Sequence[object]], window_s: float = 0.025, max_batch: int = 8):
+        self.run_batch = run_batch
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+        self.batches = 0
+        self.prompts = 0
+
+    def submit(self, prompt: str):
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            position = len(batch.prompts)
+            batch.prompts.append(prompt)
+            if len(batch.prompts) >= self.max_batch:
+                self._open = None  # later arrivals start the next batch
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window_s)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+    def _run(self, batch: _Batch):
+        try:
+            results = list(self.run_batch(batch.prompts))
+            if len(results) != len(batch.prompts):
+                raise RuntimeError(f"batch returned {len(results)} results for {len(batch.prompts)} prompts")
+            batch.results = results
+            self.batches += 1
+            self.prompts += len(results)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
@@ -0,0 +1,231 @@
+import asyncio
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# seconds; HTTP handlers, upstream calls and similarity queries all fit this range
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram, one series per label combination. observe() is a
+    dict lookup, a bisect and three additions under a lock (about a microsecond), so
+    it is cheap enough for every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple, List] = {}  # labels -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        lines = []
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, hits in zip(self.buckets + (math.inf,), counts):
+                cumulative += hits
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in snapshot]
+
+
+class Collected:
+    """
+    A gauge or counter read at scrape time from `fn`, which returns a number or a
+    {label values tuple: number} dict. Suits state other components already track
+    (store size, subscriber counts, cache hits), which then costs nothing per request.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable, labels: Sequence[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labels)
+        self.kind = kind
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} unavailable: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in sorted(values.items())
+            if value is not None
+        ]
+
+
+class Registry:
+    """Named metrics, rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def collect(self, name: str, help: str, fn: Callable, labels: Sequence[str] = (), kind: str = "gauge") -> Collected:
+        return self.register(Collected(name, help, fn, labels, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+upstream_seconds = registry.histogram(
+    "greenforce_upstream_request_seconds",
+    "Duration of calls to IAM, watsonx Orchestrate and watsonx.ai (streams: until the last event).",
+    ("service", "operation", "outcome"),
+)
+
+
+@contextmanager
+def upstream_timer(service: str, operation: str):
+    """
+    Time the enclosed upstream call; an exception inside marks it outcome="error".
+    A stream closed by its consumer (GeneratorExit, e.g. the client disconnected) or
+    a cancelled task counts as outcome="cancelled" instead.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        upstream_seconds.observe(time.perf_counter() - started, service, operation, outcome)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware recording each HTTP request's duration, labelled by the matched
+    route template (so /runs/{job_id} is one series) and response status. For
+    streaming endpoints the duration runs until the stream ends; time to the response
+    headers is recorded separately. With `header` set, responses carry
+    `Server-Timing: app;dur=<ms>` (time to headers).
+    """
+
+    def __init__(self, app, duration: Histogram, first_byte: Histogram, header: bool = False):
+        self.app = app
+        self.duration = duration
+        self.first_byte = first_byte
+        self.header = header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                elapsed = time.perf_counter() - started
+                self.first_byte.observe(elapsed, scope["method"], _route(scope))
+                if self.header:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", f"app;dur={elapsed * 1000:.2f}".encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            self.duration.observe(time.perf_counter() - started, scope["method"], _route(scope), str(status[0]))
+
+
+def _route(scope) -> str:
+    route = scope.get("route")  # set by the router once a route matched
+    return getattr(route, "path", None) or "unmatched"
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from utils.broadcast import Broadcaster
+
+JOB_STATUSES = ("queued", "running", "completed", "failed")
+
+
+class QueueFull(Exception):
+    """Raised by JobRunner.submit when the pending queue is at capacity."""
+
+
+class Job:
+    __slots__ = ("id", "kind", "params", "status", "result", "error", "created", "started", "finished")
+
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> Dict:
+        out = {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.status == "completed":
+            out["result"] = self.result
+        if self.error is not None:
+            out["error"] = self.error
+        return out
+
+
+class JobRunner:
+    """
+    In-process job table drained by a fixed pool of worker tasks.
+
+    submit() only enqueues, so the HTTP request that created a job returns at once;
+    at most `workers` jobs talk to the upstream concurrently and at most `max_pending`
+    wait behind them. Finished jobs stay queryable for `ttl_s` seconds, then are evicted.
+    """
+
+    def __init__(self, handler: Callable[[Job], Awaitable], workers: int = 8, max_pending: int = 256, ttl_s: float = 600):
+        self.handler = handler
+        self.workers = workers
+        self.ttl_s = ttl_s
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._jobs: Dict[str, Job] = {}
+        self._hubs: Dict[str, Broadcaster] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._next_sweep = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, kind: str, params: dict) -> Job:
+        self._evict()
+        job = Job(kind, params)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self._queue.maxsize} jobs already pending")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    async def events(self, job: Job) -> AsyncIterator[str]:
+        """SSE frames for each status change of `job`, ending when it finishes."""
+        if job.done:
+            yield _frame(job)
+            return
+        hub = self._hubs.setdefault(job.id, Broadcaster(max_queue=len(JOB_STATUSES)))
+        queue = hub.subscribe()
+        try:
+            yield _frame(job)
+            final = False
+            while not final:
+                frame, final = await queue.get()
+                yield frame
+        finally:
+            hub.unsubscribe(queue)
+
+    def _evict(self):
+        """Drop finished jobs older than ttl_s; sweeps at most once per second."""
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + 1.0
+        cutoff = now - self.ttl_s
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _set_status(self, job: Job, status: str):
+        job.status = status
+        hub = self._hubs.get(job.id)
+        if job.done:
+            self._hubs.pop(job.id, None)
+        if hub is not None:
+            hub.publish((_frame(job), job.done))
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            job.started = time.time()
+            self._set_status(job, "running")
+            try:
+                job.result = await self.handler(job)
+                status = "completed"
+            except asyncio.CancelledError:
+                job.error = "cancelled"
+                job.finished = time.time()
+                self._set_status(job, "failed")
+                raise
+            except Exception as e:
+                job.error = getattr(e, "detail", None) or str(e)
+                status = "failed"
+            job.finished = time.time()
+            self._set_status(job, status)
+
+
+def _frame(job: Job) -> str:
+    return f"event: {job.status}\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
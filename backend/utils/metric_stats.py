@@ -0,0 +1,203 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+from utils.metrics_store import MetricsStore
+
+NORMALIZATION_MIN_SAMPLES = 32  # use the fixed default scales until this many records exist
+RESCALE_CHECK_EVERY = 4096  # inserts between drift checks once warmed up
+RESCALE_DRIFT = 0.25  # relative drift of mean/std (in std units) that triggers a rescale
+
+
+class RunningStats:
+    """
+    Mean and covariance of a sliding window, updated in O(d^2) per insert or eviction (Welford).
+
+    State lives in a flat `block` of 1 + d + d*d floats (count, mean, M2); passing the
+    store's stats block keeps it in the shared segment, where every worker sees it.
+    """
+
+    def __init__(self, dim: int, block: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.block = np.zeros(1 + dim + dim * dim) if block is None else block
+        self.mean = self.block[1:1 + dim]
+        self._m2 = self.block[1 + dim:].reshape(dim, dim)
+
+    @property
+    def count(self) -> int:
+        return int(self.block[0])
+
+    @count.setter
+    def count(self, value: int):
+        self.block[0] = value
+
+    def reset(self):
+        self.block[:] = 0.0
+
+    def add(self, x: np.ndarray):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += np.outer(delta, x - self.mean)
+
+    def remove(self, x: np.ndarray):
+        if self.count <= 1:
+            self.reset()
+            return
+        delta = x - self.mean
+        self.count -= 1
+        self.mean -= delta / self.count
+        self._m2 -= np.outer(delta, x - self.mean)
+
+    def add_batch(self, rows: np.ndarray):
+        """Merge an (n, dim) block of new rows (Chan et al. parallel update)."""
+        nb = len(rows)
+        if not nb:
+            return
+        na = self.count
+        mean_b = rows.mean(axis=0)
+        centered = rows - mean_b
+        n = na + nb
+        delta = mean_b - self.mean
+        self._m2 += centered.T @ centered + np.outer(delta, delta) * (na * nb / n)
+        self.mean += delta * (nb / n)
+        self.count = n
+
+    def remove_batch(self, rows: np.ndarray):
+        """Inverse of add_batch: take an (n, dim) block of rows back out of the window."""
+        nb = len(rows)
+        if not nb:
+            return
+        n = self.count
+        na = n - nb
+        if na <= 1:
+            self.reset()
+            return
+        mean_b = rows.mean(axis=0)
+        centered = rows - mean_b
+        mean_a = (self.mean * n - mean_b * nb) / na
+        delta = mean_b - mean_a
+        self._m2 -= centered.T @ centered + np.outer(delta, delta) * (na * nb / n)
+        self.mean[:] = mean_a
+        self.count = na
+
+    def fit(self, columns: np.ndarray):
+        """Recompute from scratch over a (dim, n) block of columns."""
+        if not columns.shape[1]:
+            self.reset()
+            return
+        self.count = columns.shape[1]
+        self.mean[:] = columns.mean(axis=1)
+        centered = columns - self.mean[:, None]
+        self._m2[:] = centered @ centered.T
+
+    @property
+    def covariance(self) -> np.ndarray:
+        if self.count < 2:
+            return np.eye(self.dim)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(np.clip(np.diag(self.covariance), 0.0, None))
+
+
+class NormalizedColumns:
+    """
+    Standardized copy of the store columns, (x - center) / scale, kept in step with inserts.
+
+    center/scale are frozen snapshots of the running mean/std so stored columns stay
+    comparable; they are refreshed (and every column rewritten in one vectorized pass)
+    only when the live statistics drift by more than RESCALE_DRIFT. Until
+    NORMALIZATION_MIN_SAMPLES records exist, `default_scale` is used with a zero center.
+
+    The running statistics sit in the store's stats block and are updated by the writer
+    (`observe`); the standardized columns are a per-process cache filled by `update_slot`.
+    """
+
+    def __init__(self, store: MetricsStore, default_scale: Sequence[float]):
+        self.store = store
+        self.default_scale = np.asarray(default_scale, dtype=np.float64)
+        self.stats = RunningStats(store.values.shape[0], block=store.stats_block)
+        self.center = np.zeros_like(self.default_scale)
+        self.scale = self.default_scale.copy()
+        self.values = np.zeros_like(store.values)
+        self.fitted = False
+
+    def live_values(self) -> np.ndarray:
+        return self.values[:, : self.store.size]
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Standardize raw (n, dim) query vectors with the current center/scale."""
+        return (vectors - self.center) / self.scale
+
+    def observe(self, raw: np.ndarray, evicted: Optional[np.ndarray] = None):
+        """Writer side: fold a new record (and the one it replaced) into the running statistics."""
+        if evicted is not None:
+            self.stats.remove(evicted)
+        self.stats.add(raw)
+
+    def observe_many(self, raw: np.ndarray, evicted: np.ndarray):
+        """Writer side, bulk: (n, dim) new records and the (k, dim) records they replaced."""
+        self.stats.remove_batch(evicted)
+        self.stats.add_batch(raw)
+
+    def update_slots(self, slots: np.ndarray, previous: int, written: int) -> bool:
+        """Vectorized update_slot for the records appended between write positions previous and written."""
+        self.values[:, slots] = (self.store.values[:, slots] - self.center[:, None]) / self.scale[:, None]
+        return self._maybe_rescale(written, previous)
+
+    def update_slot(self, slot: int, written: int) -> bool:
+        """
+        Standardize the record in `slot`, the `written`-th one appended.
+        Returns True when the columns were rescaled and any index over them must be rebuilt.
+        """
+        self.values[:, slot] = (self.store.values[:, slot] - self.center) / self.scale
+        return self._maybe_rescale(written)
+
+    def refit(self):
+        """Recompute statistics and every normalized column from the store."""
+        self.stats.fit(self.store.live_values())
+        self.renormalize()
+
+    def precision(self) -> np.ndarray:
+        """Inverse covariance of the live window, expressed in normalized units."""
+        cov = self.stats.covariance / np.outer(self.scale, self.scale)
+        return np.linalg.pinv(cov)
+
+    def _maybe_rescale(self, written: int, previous: Optional[int] = None) -> bool:
+        """Check for drift when the write position crossed a checkpoint in (previous, written]."""
+        if self.stats.count < NORMALIZATION_MIN_SAMPLES:
+            return False
+        previous = written - 1 if previous is None else previous
+        # Powers of two while history is short, then every RESCALE_CHECK_EVERY records
+        warming = written.bit_length() > max(previous, 0).bit_length()
+        periodic = written // RESCALE_CHECK_EVERY > previous // RESCALE_CHECK_EVERY
+        if not (warming or periodic or not self.fitted):
+            return False
+        std = self._target_scale()
+        drift = np.maximum(
+            np.abs(std / self.scale - 1.0),
+            np.abs(self.stats.mean - self.center) / self.scale,
+        )
+        if self.fitted and drift.max() <= RESCALE_DRIFT:
+            return False
+        self.renormalize()
+        return True
+
+    def _target_scale(self) -> np.ndarray:
+        std = self.stats.std
+        return np.where(std > 1e-9, std, self.default_scale)
+
+    def renormalize(self):
+        """Snapshot center/scale from the current statistics and rewrite every column."""
+        if self.stats.count >= NORMALIZATION_MIN_SAMPLES:
+            self.center = self.stats.mean.copy()
+            self.scale = self._target_scale()
+            self.fitted = True
+        else:
+            self.center = np.zeros_like(self.default_scale)
+            self.scale = self.default_scale.copy()
+            self.fitted = False
+        size = self.store.size
+        self.values[:, :size] = (self.store.values[:, :size] - self.center[:, None]) / self.scale[:, None]
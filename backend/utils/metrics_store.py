@@ -0,0 +1,489 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: writers are only serialized within one process
+    fcntl = None
+
+# Order of the metric columns; matches _vector_from_metrics in vector_utils.
+METRIC_FIELDS = ("co2_emissions", "waste_level", "energy_usage")
+
+
+def to_epoch(timestamp) -> float:
+    """Convert an ISO timestamp (naive values are treated as UTC) to epoch seconds."""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if isinstance(timestamp, datetime):
+        ts = timestamp
+    else:
+        ts = datetime.fromisoformat(str(timestamp))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_ns(timestamp) -> int:
+    """Like to_epoch, but exact integer nanoseconds (numbers are still read as epoch seconds)."""
+    if isinstance(timestamp, (int, float)):
+        return int(round(float(timestamp) * 1e9))
+    ts = timestamp if isinstance(timestamp, datetime) else datetime.fromisoformat(str(timestamp))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def to_iso(epoch: float) -> str:
+    """Render epoch seconds as a naive UTC ISO string, like datetime.utcnow().isoformat()."""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).replace(tzinfo=None).isoformat()
+
+
+# Segment layout (file or shared memory): one header page, then the timestamp column,
+# the time-index column (v3+), then the metric columns. The header also carries the
+# running statistics block.
+SEGMENT_MAGIC = int.from_bytes(b"GFMETRIC", "little")
+SEGMENT_VERSION = 3  # v2 added the statistics block; v3 int64 epoch-ns timestamps and the time index
+HEADER_BYTES = 4096
+_H_MAGIC, _H_VERSION, _H_CAPACITY, _H_DIM, _H_WRITTEN, _H_MAX_LAG, _H_LAG_BLOCK = range(7)
+STATS_OFFSET = 64  # bytes into the header
+STATS_SLOTS = 1 + len(METRIC_FIELDS) + len(METRIC_FIELDS) ** 2  # count, mean, M2
+LAG_BLOCKS_OFFSET = 512  # bytes into the header: largest lateness per block of slots
+LAG_BLOCKS = (HEADER_BYTES - LAG_BLOCKS_OFFSET) // 8
+_LAG_LIMIT = 2 ** 63 - 1
+
+
+def _time_columns(version: int) -> int:
+    return 2 if version >= 3 else 1
+
+
+def _segment_bytes(capacity: int, version: int = SEGMENT_VERSION) -> int:
+    return HEADER_BYTES + 8 * capacity * (_time_columns(version) + len(METRIC_FIELDS))
+
+
+class MetricsStore:
+    """
+    Fixed-capacity ring buffer of metric records backed by preallocated NumPy columns.
+
+    `timestamps` holds int64 epoch nanoseconds and `values` holds one contiguous row
+    per metric field (shape: len(METRIC_FIELDS) x capacity), so similarity and
+    history queries work on whole columns instead of walking Python dicts.
+
+    `time_index` is the running maximum of `timestamps` in append order, so it never
+    decreases from the oldest live record to the newest and time ranges are found by
+    binary search (range_slots) instead of sorting. A late record keeps its real
+    timestamp; the header tracks the largest lateness among live records (`max_lag`)
+    and range queries widen their search by that much, then order only the slice
+    they return. The ring is split into LAG_BLOCKS blocks that each remember their
+    own largest lateness; a block's value is recomputed once all of its slots have
+    been rewritten, so max_lag falls again when late records are overwritten.
+
+    With `path`, the columns live in a memory-mapped segment file instead of the
+    heap: reads are zero-copy views of the mapping, and a restart reopens the file
+    with its full history. Each append writes the record first and only then bumps
+    the `written` counter in the header, so the new record never becomes visible
+    half-written. Until the ring is full that is the whole guarantee. After it
+    wraps, the slot being rewritten still holds the oldest live record, which is
+    overwritten in place: a crash mid-append can leave that one record mixing old
+    and new fields, and a lock-free reader in another worker can see it that way
+    while the write is in progress. Every other record is unaffected.
+
+    With `shm_name`, the same layout lives in a named shared-memory block instead.
+    Either way the segment is visible to every worker process on the host:
+    appends are serialized by an inter-process lock (one writer at a time), while
+    readers never lock and simply `refresh()` the published `written` counter
+    (so they are subject to the oldest-record caveat above).
+    """
+
+    def __init__(self, capacity: int, path: Optional[str] = None, shm_name: Optional[str] = None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.path = path
+        self.shm_name = shm_name
+        self._mmap = None
+        self._shm = None
+        self._header = None
+        self._lock_fd = None
+        self._thread_lock = threading.Lock()
+        self.lag_block_size = -(-self.capacity // LAG_BLOCKS)
+        if path:
+            self._open_lock_file(f"{path}.lock")
+            with self._process_lock():
+                self._open_segment(path)
+        elif shm_name:
+            self._open_lock_file(os.path.join(tempfile.gettempdir(), f"{shm_name}.lock"))
+            with self._process_lock():
+                self._open_shared_memory(shm_name)
+        else:
+            self.timestamps = np.zeros(self.capacity, dtype=np.int64)
+            self.time_index = np.zeros(self.capacity, dtype=np.int64)
+            self.values = np.zeros((len(METRIC_FIELDS), self.capacity), dtype=np.float64)
+            self.stats_block = np.zeros(STATS_SLOTS, dtype=np.float64)
+            self.lag_blocks = np.zeros(LAG_BLOCKS, dtype=np.int64)
+            self.size = 0  # number of live records
+            self.written = 0  # total records ever appended
+            self.max_lag = 0  # ns the latest live out-of-order record trailed the time index by
+
+    @property
+    def shared(self) -> bool:
+        """True when other processes may read or write the same segment."""
+        return self._header is not None
+
+    def _bind(self, buffer, version: int = SEGMENT_VERSION):
+        """
+        Lay the header and columns over a raw buffer of _segment_bytes(capacity, version).
+        Pre-v3 layouts (float64 epoch seconds, no time index) are only bound for migration.
+        """
+        self._header = np.ndarray((HEADER_BYTES // 8,), dtype=np.int64, buffer=buffer)
+        self.stats_block = np.ndarray((STATS_SLOTS,), dtype=np.float64, buffer=buffer, offset=STATS_OFFSET)
+        self.lag_blocks = np.ndarray((LAG_BLOCKS,), dtype=np.int64, buffer=buffer, offset=LAG_BLOCKS_OFFSET)
+        time_dtype = np.int64 if version >= 3 else np.float64
+        self.timestamps = np.ndarray((self.capacity,), dtype=time_dtype, buffer=buffer, offset=HEADER_BYTES)
+        self.time_index = None
+        if version >= 3:
+            self.time_index = np.ndarray(
+                (self.capacity,), dtype=np.int64, buffer=buffer, offset=HEADER_BYTES + 8 * self.capacity
+            )
+        self.values = np.ndarray(
+            (len(METRIC_FIELDS), self.capacity),
+            dtype=np.float64,
+            buffer=buffer,
+            offset=HEADER_BYTES + 8 * self.capacity * _time_columns(version),
+        )
+
+    def _init_header(self):
+        self._header[_H_VERSION] = SEGMENT_VERSION
+        self._header[_H_CAPACITY] = self.capacity
+        self._header[_H_DIM] = len(METRIC_FIELDS)
+        self._header[_H_WRITTEN] = 0
+        self._header[_H_MAX_LAG] = 0
+        self._header[_H_LAG_BLOCK] = self.lag_block_size
+        self.stats_block[:] = 0.0
+        self.lag_blocks[:] = 0
+        self._header[_H_MAGIC] = SEGMENT_MAGIC  # written last: marks the header complete
+
+    def _check_header(self, header: np.ndarray, source: str) -> bool:
+        """Validate a segment header; returns False when its capacity or layout needs migrating."""
+        if header[_H_MAGIC] != SEGMENT_MAGIC or header[_H_VERSION] not in (1, 2, SEGMENT_VERSION):
+            raise ValueError(f"{source} is not a metrics segment (or has an unsupported version)")
+        return (
+            header[_H_VERSION] == SEGMENT_VERSION
+            and header[_H_CAPACITY] == self.capacity
+            and header[_H_DIM] == len(METRIC_FIELDS)
+        )
+
+    def _open_segment(self, path: str):
+        existing = os.path.exists(path) and os.path.getsize(path) >= HEADER_BYTES
+        if existing:
+            header = np.fromfile(path, dtype=np.int64, count=_H_MAX_LAG + 1)
+            if not self._check_header(header, path):
+                self._migrate_segment(path, int(header[_H_CAPACITY]), int(header[_H_VERSION]))
+                return
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "wb") as f:
+                f.truncate(_segment_bytes(self.capacity))
+
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r+", shape=(_segment_bytes(self.capacity),))
+        self._bind(self._mmap)
+        if not existing:
+            self._init_header()
+            self._mmap.flush()
+        self.refresh()
+        self._check_lag_blocks()
+
+    def _migrate_segment(self, path: str, old_capacity: int, old_version: int = SEGMENT_VERSION):
+        """
+        Rewrite a segment created with a different capacity or an older layout, keeping
+        its most recent records (pre-v3 float seconds become epoch-ns with a fresh time index).
+        """
+        old = MetricsStore(old_capacity)
+        old._mmap = np.memmap(path, dtype=np.uint8, mode="r", shape=(_segment_bytes(old_capacity, old_version),))
+        old._bind(old._mmap, old_version)
+        old.refresh()
+        slots = old.recent_slots(self.capacity)
+        tmp_path = f"{path}.resize"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        new = MetricsStore(self.capacity, tmp_path)
+        n = len(slots)
+        if old_version >= 3:
+            new.timestamps[:n] = old.timestamps[slots]
+        else:
+            new.timestamps[:n] = np.round(old.timestamps[slots] * 1e9).astype(np.int64)
+        np.maximum.accumulate(new.timestamps[:n], out=new.time_index[:n])
+        new.values[:, :n] = old.values[:, slots]
+        if old_version >= 2:
+            new.stats_block[:] = old.stats_block  # same records while the capacity is unchanged
+        new.written = new.size = n
+        new._header[_H_WRITTEN] = n
+        new._rebuild_lag_blocks()
+        new.flush()
+        new.close()
+        del old
+        os.replace(tmp_path, path)
+        if os.path.exists(f"{tmp_path}.lock"):
+            os.remove(f"{tmp_path}.lock")
+        self._open_segment(path)
+
+    def _open_shared_memory(self, name: str):
+        size = _segment_bytes(self.capacity)
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            created = False
+        # Keep the block alive when this worker exits; it is shared with its siblings
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        if self._shm.size < size:
+            raise ValueError(f"Shared memory block {name} is too small for {self.capacity} records")
+        self._bind(self._shm.buf)
+        if created:
+            self._init_header()
+        elif not self._check_header(self._header, f"shared memory block {name}"):
+            raise ValueError(
+                f"Shared memory block {name} was created with a different capacity or layout; unlink it to resize"
+            )
+        self.refresh()
+        self._check_lag_blocks()
+
+    def _open_lock_file(self, lock_path: str):
+        if fcntl is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def _process_lock(self):
+        if self._lock_fd is None:
+            yield
+            return
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Serialize writers across threads and worker processes. Inside the lock the
+        local view is refreshed, so appends always continue from the published counter.
+        """
+        with self._thread_lock, self._process_lock():
+            self.refresh()
+            yield
+
+    def refresh(self) -> int:
+        """Pick up records published by other processes; returns the current write counter."""
+        if self._header is not None:
+            self.written = int(self._header[_H_WRITTEN])
+            self.size = min(self.written, self.capacity)
+            self.max_lag = int(self._header[_H_MAX_LAG])
+        return self.written
+
+    def flush(self):
+        """Force mapped pages to disk (no-op for heap and shared-memory stores)."""
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        """Release the mapping (the shared-memory block itself is left for other workers)."""
+        self.flush()
+        self.timestamps = self.time_index = self.values = self._header = self.stats_block = None
+        self._mmap = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _lags(self, lo: int, hi: int) -> np.ndarray:
+        """Lateness (time_index - timestamps) of slots [lo, hi), free of int64 wraparound."""
+        return self.time_index[lo:hi].view(np.uint64) - self.timestamps[lo:hi].view(np.uint64)
+
+    def _block_lag(self, lo: int, hi: int) -> int:
+        return min(int(self._lags(lo, hi).max()), _LAG_LIMIT) if hi > lo else 0
+
+    def _publish_max_lag(self):
+        self.max_lag = int(self.lag_blocks.max())
+        if self._header is not None:
+            self._header[_H_MAX_LAG] = self.max_lag
+
+    def _rebuild_lag_blocks(self):
+        """Recompute every block's lateness from the live slots."""
+        bs = self.lag_block_size
+        for b in range(LAG_BLOCKS):
+            self.lag_blocks[b] = self._block_lag(b * bs, min((b + 1) * bs, self.size))
+        if self._header is not None:
+            self._header[_H_LAG_BLOCK] = bs
+        self._publish_max_lag()
+
+    def _check_lag_blocks(self):
+        """Segments written before the per-block lateness existed get it computed once."""
+        if self._header[_H_LAG_BLOCK] != self.lag_block_size:
+            self._rebuild_lag_blocks()
+
+    def _track_lag(self, start: int, n: int):
+        """Fold the lateness of freshly written slots [start, start + n) into the blocks and max_lag."""
+        bs = self.lag_block_size
+        end = start + n
+        for b in range(start // bs, (end - 1) // bs + 1):
+            lo, hi = b * bs, min((b + 1) * bs, self.capacity)
+            if end >= hi:
+                # the whole block now holds records written this lap: drop what was overwritten
+                self.lag_blocks[b] = self._block_lag(lo, hi)
+            else:
+                self.lag_blocks[b] = max(int(self.lag_blocks[b]), self._block_lag(max(lo, start), end))
+        self._publish_max_lag()
+
+    def newest_index(self) -> Optional[int]:
+        """Time-index value of the newest record (the latest timestamp seen), in epoch ns."""
+        if not self.size:
+            return None
+        return int(self.time_index[(self.written - 1) % self.capacity])
+
+    def append(self, timestamp: int, vector: Sequence[float]) -> int:
+        """Write one record (epoch-ns timestamp), overwriting the oldest when full. Returns the slot used."""
+        slot = self.written % self.capacity
+        newest = self.newest_index()
+        key = timestamp if newest is None or timestamp >= newest else newest
+        self.timestamps[slot] = timestamp
+        self.time_index[slot] = key
+        self.values[:, slot] = vector
+        lag = int(key) - int(timestamp)
+        block = slot // self.lag_block_size
+        if slot + 1 == min((block + 1) * self.lag_block_size, self.capacity):
+            self._track_lag(slot, 1)  # block complete: recompute it
+        elif lag > self.lag_blocks[block]:
+            self.lag_blocks[block] = min(lag, _LAG_LIMIT)
+            if lag > self.max_lag:
+                self._publish_max_lag()
+        self.written += 1
+        if self._header is not None:
+            self._header[_H_WRITTEN] = self.written  # publish only after the record is in place
+        if self.size < self.capacity:
+            self.size += 1
+        return slot
+
+    def append_many(self, timestamps: np.ndarray, vectors: np.ndarray):
+        """
+        Bulk-write n records (epoch-ns timestamps, vectors shaped (n, dim)) in at most two
+        slice copies. Only the last `capacity` records can survive, so earlier ones are skipped.
+        """
+        n = len(timestamps)
+        newest = self.newest_index()
+        keys = np.maximum.accumulate(timestamps)
+        if newest is not None:
+            np.maximum(keys, newest, out=keys)
+        if n > self.capacity:
+            self.written += n - self.capacity
+            timestamps, vectors, n = timestamps[-self.capacity:], vectors[-self.capacity:], self.capacity
+            keys = keys[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self.timestamps[start:start + first] = timestamps[:first]
+        self.time_index[start:start + first] = keys[:first]
+        self.values[:, start:start + first] = vectors[:first].T
+        if first < n:
+            self.timestamps[: n - first] = timestamps[first:]
+            self.time_index[: n - first] = keys[first:]
+            self.values[:, : n - first] = vectors[first:].T
+        if first:
+            self._track_lag(start, first)
+        if first < n:
+            self._track_lag(0, n - first)
+        self.written += n
+        if self._header is not None:
+            self._header[_H_WRITTEN] = self.written  # publish only after the records are in place
+        self.size = min(self.written, self.capacity)
+
+    def evicting_many(self, n: int) -> np.ndarray:
+        """Copy of the (k, dim) vectors that appending n records will overwrite (k may be 0)."""
+        count = min(max(self.size + n - self.capacity, 0), self.size)
+        oldest = self.written - self.size
+        slots = np.arange(oldest, oldest + count) % self.capacity
+        return self.values[:, slots].T.copy()
+
+    def evicting(self) -> Optional[np.ndarray]:
+        """Copy of the metric vector the next append will overwrite, or None while not full."""
+        if self.size < self.capacity:
+            return None
+        return self.values[:, self.written % self.capacity].copy()
+
+    def live_values(self) -> np.ndarray:
+        """View of the occupied metric columns, in slot (not time) order."""
+        return self.values[:, : self.size]
+
+    def recent_slots(self, limit: int) -> np.ndarray:
+        """Slot indices of the last `limit` records, oldest first."""
+        n = min(max(int(limit), 0), self.size)
+        return np.arange(self.written - n, self.written) % self.capacity
+
+    def in_time_order(self, slots: np.ndarray) -> np.ndarray:
+        """
+        Order slots given in append order by timestamp. Records that kept pace with the
+        time index are already sorted, so this only sorts when a late one is among them.
+        """
+        if self.max_lag and (self.timestamps[slots] != self.time_index[slots]).any():
+            return slots[np.argsort(self.timestamps[slots], kind="stable")]
+        return slots
+
+    def range_slots(self, start: int, end: int) -> np.ndarray:
+        """
+        Slots of the records with start <= timestamp <= end (epoch ns), oldest first.
+        Binary search over the time index: O(log n) plus the size of the answer.
+        """
+        if not self.size or start > end:
+            return np.empty(0, dtype=np.int64)
+        first = (self.written - self.size) % self.capacity
+        # Oldest-to-newest runs of the ring; each is a non-decreasing stretch of time_index
+        runs = [(first, self.capacity), (0, first)] if self.size == self.capacity and first else [(0, self.size)]
+        parts = []
+        for lo, hi in runs:
+            keys = self.time_index[lo:hi]
+            left = lo + int(np.searchsorted(keys, start, side="left"))
+            right = lo + int(np.searchsorted(keys, min(end + self.max_lag, _LAG_LIMIT), side="right"))
+            if right > left:
+                parts.append(np.arange(left, right))
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        slots = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        if self.max_lag:
+            ts = self.timestamps[slots]
+            slots = self.in_time_order(slots[(ts >= start) & (ts <= end)])
+        return slots
+
+    def rows(self, slots: np.ndarray) -> List[Dict]:
+        """Materialize the given slots as API-ready metric dicts."""
+        timestamps = (self.timestamps[slots] * 1e-9).tolist()
+        columns = [self.values[i, slots].tolist() for i in range(len(METRIC_FIELDS))]
+        return [
+            {"timestamp": to_iso(ts), **dict(zip(METRIC_FIELDS, vec))}
+            for ts, *vec in zip(timestamps, *columns)
+        ]
+
+    def clear(self):
+        self.size = 0
+        self.written = 0
+        self.max_lag = 0
+        self.lag_blocks[:] = 0
+        if self._header is not None:
+            self._header[_H_WRITTEN] = 0
+            self._header[_H_MAX_LAG] = 0
@@ -1,15 +1,20 @@
 import asyncio
 import json
+import os
 import random
 import time
-from typing import Dict
-from utils.vector_utils import store_metrics_vector
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.metrics_store import to_epoch_ns, to_iso
+from utils.vector_utils import store_metrics_batch, store_metrics_vector
 
 
 # --- Generate random metrics ---
 def generate_metrics() -> Dict:
     return {
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp": to_iso(time.time()),  # naive UTC ISO, the same format history rows use
         "co2_emissions": round(random.uniform(80, 150), 2),
         "waste_level": round(random.uniform(30, 90), 1),
         "energy_usage": round(random.uniform(10000, 18000), 1),
@@ -27,3 +32,95 @@ async def stream_metrics():
             print("Vector store error:", e)
         yield f"data: {json.dumps(data)}\n\n"
         await asyncio.sleep(5)
+
+
+# --- Bulk ingestion (POST /ingest) ---
+INGEST_FIELDS = ("co2_emissions", "waste_level", "energy_usage")
+MAX_REPORTED_ERRORS = 20
+INGEST_MAX_PAST_S = float(os.getenv("INGEST_MAX_PAST_S", str(365 * 86400)))  # oldest accepted timestamp, before now
+INGEST_MAX_FUTURE_S = float(os.getenv("INGEST_MAX_FUTURE_S", "300"))  # clock skew tolerated ahead of now
+
+
+def parse_readings(body: bytes, content_type: str = "") -> List:
+    """Decode a JSON array, a single JSON object, or NDJSON (one reading per line)."""
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise ValueError("Body must be UTF-8 encoded JSON or NDJSON.")
+    if not text.strip():
+        return []
+    if "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            payload = json.loads(text)
+            return payload if isinstance(payload, list) else [payload]
+        except json.JSONDecodeError as e:
+            if e.msg != "Extra data":  # several concatenated objects: treat as NDJSON
+                raise ValueError(f"Invalid JSON: {e}")
+    readings = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if line.strip():
+            try:
+                readings.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid NDJSON on line {line_no}: {e}")
+    return readings
+
+
+def readings_to_columns(readings: List) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
+    """
+    Validate readings against the compact schema
+    {co2_emissions: number, waste_level: number, energy_usage: number, timestamp?: ISO string | epoch seconds}
+    and return (timestamps, vectors, errors): int64 epoch-ns timestamps and (n, 3) vectors
+    for the valid readings. Timestamps must lie between INGEST_MAX_PAST_S before and
+    INGEST_MAX_FUTURE_S after now: a stray far-future or ancient reading would otherwise
+    skew the store's time index for as long as it stays in the ring.
+    """
+    now = time.time_ns()
+    oldest, newest = now - int(INGEST_MAX_PAST_S * 1e9), now + int(INGEST_MAX_FUTURE_S * 1e9)
+    timestamps, vectors, positions, errors = [], [], [], []
+    for i, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            errors.append({"index": i, "error": "reading must be a JSON object"})
+            continue
+        try:
+            vector = [reading[field] for field in INGEST_FIELDS]
+            if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in vector):
+                raise TypeError
+            ts = reading.get("timestamp")
+            ts = now if ts is None else to_epoch_ns(ts)
+        except KeyError as e:
+            errors.append({"index": i, "error": f"missing field {e.args[0]}"})
+            continue
+        except (TypeError, ValueError, OverflowError):
+            errors.append({"index": i, "error": "metrics must be numbers and timestamp ISO-8601 or epoch seconds"})
+            continue
+        if not oldest <= ts <= newest:
+            errors.append({"index": i, "error": "timestamp is outside the accepted window around the current time"})
+            continue
+        timestamps.append(ts)
+        vectors.append(vector)
+        positions.append(i)
+
+    ts = np.asarray(timestamps, dtype=np.int64)
+    vecs = np.asarray(vectors, dtype=np.float64).reshape(len(vectors), len(INGEST_FIELDS))
+    finite = np.isfinite(vecs).all(axis=1)
+    if not finite.all():
+        for pos in np.flatnonzero(~finite).tolist():
+            errors.append({"index": positions[pos], "error": "metrics must be finite"})
+        ts, vecs = ts[finite], vecs[finite]
+    return ts, vecs, errors
+
+
+def ingest_readings(body: bytes, content_type: str = "", max_readings: int = 100_000) -> Dict:
+    """Parse, validate and bulk-store a batch of sensor readings; returns a summary."""
+    readings = parse_readings(body, content_type)
+    if len(readings) > max_readings:
+        raise ValueError(f"Too many readings in one request (max {max_readings}).")
+    timestamps, vectors, errors = readings_to_columns(readings)
+    accepted = store_metrics_batch(timestamps, vectors)
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS],
+    }
@@ -1,25 +1,157 @@
-import os, requests
+import asyncio
+import os, requests, time
+from typing import Optional
+
+import httpx
 from dotenv import load_dotenv
 
+from utils.instrumentation import upstream_timer
+from utils.rules import analysis_rules
+
 load_dotenv()
 
 IBM_ORCH_INSTANCE_ID = os.getenv("IBM_ORCH_INSTANCE_ID")
 IBM_ORCH_REGION = os.getenv("IBM_ORCH_REGION")
 API_KEY = os.getenv("IBM_API_KEY")
 IBM_TOKEN_URL = os.getenv("IBM_TOKEN_URL")
+IAM_REFRESH_MARGIN_S = float(os.getenv("IAM_REFRESH_MARGIN_S", "300"))  # refresh this long before expiry
+IAM_DEFAULT_TTL_S = 3600  # used when IAM does not say how long the token lives
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_TIMEOUT_S = float(os.getenv("UPSTREAM_TIMEOUT_S", "30"))
+WORKFLOW_TRIGGER_URL = os.getenv("WORKFLOW_TRIGGER_URL") or (
+    f"https://api.{IBM_ORCH_REGION}.watson-orchestrate.cloud.ibm.com"
+    f"/instances/{IBM_ORCH_INSTANCE_ID}/v1/orchestrate/digital-employees/allskills"
+)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """Create the shared keep-alive client (called from the app lifespan)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT_S, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            ),
+        )
+    return _http_client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client for IBM Cloud / orchestrate calls; created lazily outside the app."""
+    if _http_client is None or _http_client.is_closed:
+        return init_http_client()
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class IAMTokenManager:
+    """
+    Caches the IBM IAM access token for its lifetime.
+
+    Within `refresh_margin` seconds of expiry the cached token is still returned
+    while one background refresh runs; only an expired (or missing) token makes
+    callers wait. Concurrent callers always share a single in-flight IAM request.
+    """
+
+    def __init__(self, token_url: str, api_key: str, refresh_margin: float = IAM_REFRESH_MARGIN_S):
+        self.token_url = token_url
+        self.api_key = api_key
+        self.refresh_margin = refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+
+    def _valid_for(self, seconds: float = 0.0) -> bool:
+        return bool(self._token) and time.time() + seconds < self._expires_at
+
+    def _form(self) -> dict:
+        return {
+            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+            "apikey": self.api_key,
+        }
+
+    def _remember(self, payload: dict) -> Optional[str]:
+        token = payload.get("access_token")
+        if not token:
+            raise ValueError("IAM response did not include an access_token")
+        ttl = payload.get("expires_in")
+        if not ttl and payload.get("expiration"):
+            ttl = float(payload["expiration"]) - time.time()
+        self._token = token
+        self._expires_at = time.time() + float(ttl or IAM_DEFAULT_TTL_S)
+        return token
+
+    async def _fetch(self) -> str:
+        with upstream_timer("iam", "token"):
+            resp = await get_http_client().post(
+                self.token_url, data=self._form(), headers={"Accept": "application/json"}
+            )
+            resp.raise_for_status()
+        return self._remember(resp.json())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._fetch())
+            self._refresh.add_done_callback(_log_refresh_failure)
+        return self._refresh
+
+    async def get_token(self) -> Optional[str]:
+        if self._valid_for(self.refresh_margin):
+            return self._token
+        if self._valid_for():
+            self._start_refresh()  # proactive: keep serving the current token meanwhile
+            return self._token
+        try:
+            return await asyncio.shield(self._start_refresh())
+        except Exception as e:
+            print(f"[Token Error] {e}")
+            return None
+
+    def invalidate(self):
+        """Forget the cached token, e.g. after the upstream rejected it with a 401."""
+        self._token = None
+        self._expires_at = 0.0
+
+    def get_token_sync(self) -> Optional[str]:
+        """Blocking variant for sync callers; shares the same cache."""
+        if self._valid_for(self.refresh_margin):
+            return self._token
+        try:
+            with upstream_timer("iam", "token"):
+                resp = requests.post(self.token_url, data=self._form(), headers={"Accept": "application/json"})
+                resp.raise_for_status()
+            return self._remember(resp.json())
+        except Exception as e:
+            print(f"[Token Error] {e}")
+            return self._token if self._valid_for() else None
+
+
+def _log_refresh_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[Token Error] {task.exception()}")
+
+
+token_manager = IAMTokenManager(IBM_TOKEN_URL, API_KEY)
+
+
+async def get_ibm_access_token_async() -> Optional[str]:
+    """Cached IAM token for async callers (one IAM round-trip per token lifetime)."""
+    return await token_manager.get_token()
+
 
 def get_ibm_access_token():
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": API_KEY
-    }
-    try:
-        resp = requests.post(IBM_TOKEN_URL, data=data)
-        resp.raise_for_status()
-        return resp.json().get("access_token")
-    except Exception as e:
-        print(f"[Token Error] {e}")
-        return None
+    return token_manager.get_token_sync()
 
 def trigger_workflow(workflow_name, context):
     token = get_ibm_access_token()
@@ -28,17 +160,34 @@ def trigger_workflow(workflow_name, context):
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     payload = {"name": workflow_name, "inputs": context}
     try:
-        r = requests.post(f"https://api.{IBM_ORCH_REGION}.watson-orchestrate.cloud.ibm.com/instances/{IBM_ORCH_INSTANCE_ID}/v1/orchestrate/digital-employees/allskills", headers=headers, json=payload)
+        with upstream_timer("orchestrate", "workflow_trigger"):
+            r = requests.post(WORKFLOW_TRIGGER_URL, headers=headers, json=payload)
         return r.json()
     except Exception as e:
         return {"error": str(e)}
 
+
+async def trigger_workflow_async(workflow_name: str, context: dict) -> dict:
+    """
+    Async trigger_workflow over the shared client with the cached token. Raises on
+    failure (httpx errors, ConnectionError without a token) so the dispatcher can retry.
+    """
+    token = await get_ibm_access_token_async()
+    if not token:
+        raise ConnectionError("IAM token unavailable")
+    with upstream_timer("orchestrate", "workflow_trigger"):
+        r = await get_http_client().post(
+            WORKFLOW_TRIGGER_URL,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json={"name": workflow_name, "inputs": context},
+        )
+        r.raise_for_status()
+    return r.json() if r.content else {}
+
 def analyze_environmental_data(data):
-    actions = []
-    if data.get("co2_emissions", 0) > 100:
-        actions.append({"workflow": "CarbonAuditWorkflow"})
-    if data.get("waste_level", 0) > 80:
-        actions.append({"workflow": "WasteCollectionWorkflow"})
-    if data.get("energy_usage", 0) > 12000:
-        actions.append({"workflow": "EnergyOptimizationWorkflow"})
-    return actions
+    """Orchestrate workflows for the threshold rules a reading fires (see utils/rules)."""
+    return [
+        {"workflow": rule.orchestrate_workflow}
+        for rule in analysis_rules.fired(data)
+        if rule.orchestrate_workflow
+    ]
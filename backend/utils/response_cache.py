@@ -0,0 +1,101 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache for LLM responses keyed on a metric vector and a prompt version.
+
+    Vectors are quantized to `buckets` (one width per field), so readings that differ by
+    less than a bucket share an entry. With a `distance` function and `radius` > 0, an
+    exact-bucket miss falls back to the nearest cached vector of the same prompt version
+    within `radius` (a "similar" hit). Values are deep-copied in and out, so callers may
+    mutate what they get back.
+    """
+
+    def __init__(
+        self,
+        buckets: Sequence[float],
+        max_entries: int = 512,
+        ttl_s: float = 300,
+        distance: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None,
+        radius: float = 0.0,
+    ):
+        self.buckets = np.asarray(buckets, dtype=np.float64)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.distance = distance
+        self.radius = radius
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires, vector, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, vector: np.ndarray, version: str) -> tuple:
+        return (version, *np.floor(vector / self.buckets).astype(np.int64).tolist())
+
+    def get(self, vector: Sequence[float], version: str):
+        vector = np.asarray(vector, dtype=np.float64)
+        key = self.key(vector, version)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None and self.distance is not None and self.radius > 0:
+                key = self._nearest(vector, version, now)
+                entry = self._entries.get(key) if key is not None else None
+                if entry is not None:
+                    self.similar_hits += 1
+            elif entry is not None:
+                self.hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            value = entry[2]
+        return copy.deepcopy(value)
+
+    def put(self, vector: Sequence[float], version: str, value):
+        vector = np.asarray(vector, dtype=np.float64)
+        key = self.key(vector, version)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_s, vector, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _nearest(self, vector: np.ndarray, version: str, now: float) -> Optional[tuple]:
+        keys = [k for k, (expires, _, _) in self._entries.items() if k[0] == version and expires >= now]
+        if not keys:
+            return None
+        distances = self.distance(vector, np.stack([self._entries[k][1] for k in keys]))
+        best = int(np.argmin(distances))
+        return keys[best] if distances[best] <= self.radius else None
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,192 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ROLLUP_RESOLUTIONS = {"1m": 60, "5m": 300, "1h": 3600}
+ROLLUP_QUANTILE = 0.95
+
+
+class Rollup:
+    """
+    Fixed ring of time buckets at one resolution: count, sum, min, max and a histogram
+    per field, so mean and an (interpolated) p95 come out of any bucket in O(bins).
+
+    Bucket i holds epoch seconds [id * resolution, (id + 1) * resolution) in slot
+    id % capacity; a newer bucket id claims its slot by clearing it, and records older
+    than the bucket currently in their slot are outside the window and dropped.
+    """
+
+    def __init__(self, resolution_s: int, capacity: int, ranges: np.ndarray, bins: int = 128):
+        dim = len(ranges)
+        self.resolution_s = resolution_s
+        self.capacity = capacity
+        self.lo = ranges[:, 0].astype(np.float64)
+        self.width = (ranges[:, 1] - ranges[:, 0]).astype(np.float64) / bins
+        self.bins = bins
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.sum = np.zeros((capacity, dim))
+        self.min = np.full((capacity, dim), np.inf)
+        self.max = np.full((capacity, dim), -np.inf)
+        self.hist = np.zeros((capacity, dim, bins), dtype=np.uint32)
+        self._fields = np.arange(dim)
+
+    def _reset(self, slots):
+        self.count[slots] = 0
+        self.sum[slots] = 0.0
+        self.min[slots] = np.inf
+        self.max[slots] = -np.inf
+        self.hist[slots] = 0
+
+    def bin_index(self, values: np.ndarray) -> np.ndarray:
+        return np.clip(((values - self.lo) / self.width).astype(np.int64), 0, self.bins - 1)
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray, bins: Optional[np.ndarray] = None):
+        """Fold (n,) epoch-second timestamps and (n, dim) values into their buckets."""
+        if bins is None:
+            bins = self.bin_index(values)
+        if len(timestamps) <= 4:
+            for ts, row, row_bins in zip(timestamps.tolist(), values, bins):
+                self._add_one(ts, row, row_bins)
+            return
+        ids = np.floor(timestamps / self.resolution_s).astype(np.int64)
+        slots = ids % self.capacity
+        claimed = self.ids.copy()
+        unique = np.unique(ids)
+        np.maximum.at(claimed, unique % self.capacity, unique)
+        renewed = np.nonzero(claimed != self.ids)[0]
+        if len(renewed):
+            self._reset(renewed)
+            self.ids = claimed
+        keep = self.ids[slots] == ids
+        if not keep.all():
+            slots, values, bins = slots[keep], values[keep], bins[keep]
+        if not len(slots):
+            return
+        np.add.at(self.count, slots, 1)
+        np.add.at(self.sum, slots, values)
+        np.minimum.at(self.min, slots, values)
+        np.maximum.at(self.max, slots, values)
+        fields = np.arange(values.shape[1])[None, :]
+        np.add.at(self.hist, (slots[:, None], fields, bins), 1)
+
+    def _add_one(self, ts: float, row: np.ndarray, bins: np.ndarray):
+        """Scalar path for the common single-record append (np.*.at overhead dominates there)."""
+        bucket = int(ts // self.resolution_s)
+        slot = bucket % self.capacity
+        if self.ids[slot] != bucket:
+            if self.ids[slot] > bucket:
+                return
+            self._reset(slot)
+            self.ids[slot] = bucket
+        self.count[slot] += 1
+        self.sum[slot] += row
+        np.minimum(self.min[slot], row, out=self.min[slot])
+        np.maximum(self.max[slot], row, out=self.max[slot])
+        self.hist[slot, self._fields, bins] += 1
+
+    def covers(self, start: float) -> bool:
+        """True when `start` is still inside the ring's window."""
+        newest = int(self.ids.max())
+        return newest < 0 or np.floor(start / self.resolution_s) > newest - self.capacity
+
+    def series(self, start: float, end: float) -> Dict[str, np.ndarray]:
+        """Buckets overlapping [start, end], oldest first, as column arrays."""
+        first, last = np.floor(start / self.resolution_s), np.floor(end / self.resolution_s)
+        selected = np.nonzero((self.ids >= first) & (self.ids <= last) & (self.count > 0))[0]
+        selected = selected[np.argsort(self.ids[selected], kind="stable")]
+        count = self.count[selected]
+        return {
+            "timestamp": self.ids[selected].astype(np.float64) * self.resolution_s,
+            "count": count,
+            "mean": self.sum[selected] / count[:, None],
+            "min": self.min[selected],
+            "max": self.max[selected],
+            "p95": self._quantile(selected, ROLLUP_QUANTILE),
+        }
+
+    def _quantile(self, slots: np.ndarray, q: float) -> np.ndarray:
+        hist = self.hist[slots].astype(np.int64)  # (k, dim, bins)
+        cumulative = hist.cumsum(axis=2)
+        target = q * self.count[slots][:, None]  # (k, dim)
+        position = np.argmax(cumulative >= target[:, :, None], axis=2)
+        below = np.take_along_axis(cumulative, position[:, :, None], axis=2)[:, :, 0] - \
+            np.take_along_axis(hist, position[:, :, None], axis=2)[:, :, 0]
+        inside = np.take_along_axis(hist, position[:, :, None], axis=2)[:, :, 0]
+        fraction = np.where(inside > 0, (target - below) / np.maximum(inside, 1), 0.0)
+        estimate = self.lo + (position + fraction) * self.width
+        return np.clip(estimate, self.min[slots], self.max[slots])
+
+
+class RollupSet:
+    """One Rollup per resolution in ROLLUP_RESOLUTIONS, updated together."""
+
+    def __init__(self, capacities: Dict[str, int], ranges: Sequence[Tuple[float, float]], bins: int = 128):
+        ranges = np.asarray(ranges, dtype=np.float64)
+        self.rollups = {
+            name: Rollup(ROLLUP_RESOLUTIONS[name], capacities[name], ranges, bins)
+            for name in ROLLUP_RESOLUTIONS
+        }
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        bins = next(iter(self.rollups.values())).bin_index(values)  # same ranges at every resolution
+        for rollup in self.rollups.values():
+            rollup.add(timestamps, values, bins)
+
+    def pick(self, start: float, end: float, max_buckets: int) -> str:
+        """Finest resolution that still covers `start` and needs at most `max_buckets` buckets."""
+        for name, rollup in self.rollups.items():
+            if rollup.covers(start) and (end - start) / rollup.resolution_s <= max_buckets:
+                return name
+        return list(self.rollups)[-1]
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the shape of (x, y)."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)  # threshold-2 inner buckets
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nxt_lo, nxt_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        nxt_hi = max(nxt_hi, nxt_lo + 1)
+        avg_x, avg_y = x[nxt_lo:nxt_hi].mean(), y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(series: Dict[str, np.ndarray], points: int) -> Dict[str, np.ndarray]:
+    """
+    Reduce a multi-field series to about `points` rows: LTTB runs on each field's mean
+    with an equal share of the budget and the chosen rows are merged, so every field
+    keeps its own peaks while rows stay aligned on shared timestamps.
+    """
+    n = len(series["timestamp"])
+    if n <= points:
+        return series
+    dim = series["mean"].shape[1]
+    share = max(points // dim, 3)
+    keep = np.unique(np.concatenate([
+        lttb_indices(series["timestamp"], series["mean"][:, f], share) for f in range(dim)
+    ]))
+    return {key: column[keep] for key, column in series.items()}
+
+
+def series_rows(series: Dict[str, np.ndarray], fields: Sequence[str], to_iso) -> List[Dict]:
+    """Rows shaped like raw history records (field = mean) plus per-field min/max/p95 and count."""
+    rows = []
+    columns = {key: series[key].tolist() for key in ("mean", "min", "max", "p95")}
+    for i, (ts, count) in enumerate(zip(series["timestamp"].tolist(), series["count"].tolist())):
+        row = {"timestamp": to_iso(ts), "count": count}
+        for f, field in enumerate(fields):
+            row[field] = round(columns["mean"][i][f], 4)
+        for stat in ("min", "max", "p95"):
+            row[stat] = {field: round(columns[stat][i][f], 4) for f, field in enumerate(fields)}
+        rows.append(row)
+    return rows
@@ -0,0 +1,199 @@
+import json
+import operator
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.metrics_store import METRIC_FIELDS
+
+load_dotenv()
+
+ANALYZE_RULES_PATH = os.getenv("ANALYZE_RULES_PATH", "")  # JSON rule set; empty = DEFAULT_RULE_SET
+
+# The thresholds analyze_environmental_data always used, plus "critical" levels past
+# which a reading is treated as a real anomaly. Only readings that fire no rule are
+# answered locally; any breach goes to the LLM. Patterns that are understood well
+# enough to answer from the rules alone belong in an ANALYZE_RULES_PATH rule set.
+DEFAULT_RULE_SET = {
+    "rules": [
+        {
+            "name": "co2_high", "field": "co2_emissions", "op": ">", "threshold": 100, "critical": 130,
+            "workflow": "carbon_audit", "orchestrate_workflow": "CarbonAuditWorkflow",
+            "reason": "CO₂ emissions of {value:.1f} tons exceed {threshold:g} tons",
+            "action": "Map the main CO₂ sources and schedule a carbon audit",
+        },
+        {
+            "name": "waste_high", "field": "waste_level", "op": ">", "threshold": 80, "critical": 90,
+            "workflow": "waste_reduction", "orchestrate_workflow": "WasteCollectionWorkflow",
+            "reason": "Waste level of {value:.1f}% exceeds {threshold:g}%",
+            "action": "Schedule a waste collection and review recycling rates",
+        },
+        {
+            "name": "energy_high", "field": "energy_usage", "op": ">", "threshold": 12000, "critical": 16000,
+            "workflow": "energy_optimization", "orchestrate_workflow": "EnergyOptimizationWorkflow",
+            "reason": "Energy usage of {value:.0f} kWh exceeds {threshold:g} kWh",
+            "action": "Review peak loads and shift flexible consumption off-peak",
+        },
+    ],
+    "local_patterns": [[]],
+}
+
+_OPS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+_SCALAR_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+
+class Rule:
+    """One threshold check on one metric field (see DEFAULT_RULE_SET for the keys)."""
+
+    __slots__ = ("name", "field", "op", "threshold", "critical", "workflow", "orchestrate_workflow", "reason", "action")
+
+    def __init__(self, spec: Dict):
+        self.name = str(spec["name"])
+        self.field = spec["field"]
+        if self.field not in METRIC_FIELDS:
+            raise ValueError(f"Rule {self.name}: unknown field {self.field}")
+        self.op = spec.get("op", ">")
+        if self.op not in _OPS:
+            raise ValueError(f"Rule {self.name}: op must be one of {', '.join(_OPS)}")
+        self.threshold = float(spec["threshold"])
+        self.critical = None if spec.get("critical") is None else float(spec["critical"])
+        self.workflow = spec.get("workflow", self.name)
+        self.orchestrate_workflow = spec.get("orchestrate_workflow")
+        self.reason = spec.get("reason", "{field} is {value:g} (threshold {threshold:g})")
+        self.action = spec.get("action")
+
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def explain(self, value: float) -> str:
+        return self.reason.format(field=self.field, value=value, threshold=self.threshold)
+
+
+class RuleEngine:
+    """
+    Threshold rules compiled into per-operator column/threshold arrays, so a whole
+    (n, dim) block of readings is checked with one comparison per operator.
+
+    A reading is answered locally when the set of rules it fires is one of the
+    `local_patterns` and no value crosses a rule's critical level; otherwise it
+    should be escalated (to the LLM).
+    """
+
+    def __init__(self, rules: Sequence[Dict], local_patterns: Optional[Sequence[Sequence[str]]] = None):
+        self.rules = [Rule(spec) for spec in rules]
+        if len(self.rules) > 62:
+            raise ValueError("At most 62 rules are supported")
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+        self._bits = 1 << np.arange(len(self.rules), dtype=np.int64)
+        self._groups = []  # (op, rule positions, field columns, thresholds, critical levels)
+        for op, compare in _OPS.items():
+            positions = [i for i, rule in enumerate(self.rules) if rule.op == op]
+            if not positions:
+                continue
+            never = np.inf if op in (">", ">=") else -np.inf
+            self._groups.append((
+                compare,
+                np.asarray(positions),
+                np.asarray([METRIC_FIELDS.index(self.rules[i].field) for i in positions]),
+                np.asarray([self.rules[i].threshold for i in positions]),
+                np.asarray([never if self.rules[i].critical is None else self.rules[i].critical for i in positions]),
+            ))
+        patterns = [] if local_patterns is None else local_patterns
+        unknown = {name for pattern in patterns for name in pattern} - set(names)
+        if unknown:
+            raise ValueError(f"local_patterns name unknown rules: {', '.join(sorted(unknown))}")
+        self.local_patterns = [sorted(set(pattern)) for pattern in patterns]
+        self._pattern_masks = np.asarray(
+            [sum(1 << names.index(name) for name in pattern) for pattern in self.local_patterns], dtype=np.int64
+        )
+        self._pattern_set = frozenset(self._pattern_masks.tolist())
+        self._scalar = [  # (rule, bit, column, compare) for evaluate()'s per-reading path
+            (rule, 1 << i, METRIC_FIELDS.index(rule.field), _SCALAR_OPS[rule.op])
+            for i, rule in enumerate(self.rules)
+        ]
+        self.answered_locally = 0
+        self.escalated = 0
+
+    def evaluate_many(self, values: np.ndarray):
+        """(n, dim) readings -> fired (n, rules) and critical (n, rules) boolean masks."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(METRIC_FIELDS))
+        fired = np.zeros((len(values), len(self.rules)), dtype=bool)
+        critical = np.zeros_like(fired)
+        for compare, positions, columns, thresholds, criticals in self._groups:
+            block = values[:, columns]
+            fired[:, positions] = compare(block, thresholds)
+            critical[:, positions] = compare(block, criticals)
+        return fired, critical
+
+    def local_many(self, values: np.ndarray) -> np.ndarray:
+        """Boolean (n,) mask: which readings can be answered without escalating."""
+        fired, critical = self.evaluate_many(values)
+        masks = fired.astype(np.int64) @ self._bits
+        return np.isin(masks, self._pattern_masks) & ~critical.any(axis=1)
+
+    def evaluate(self, vector: Sequence[float]) -> Dict:
+        """
+        Check one [co2, waste, energy] reading; also counts local vs escalated verdicts.
+        Plain Python: for a single reading NumPy's per-call overhead would dominate.
+        """
+        fired, critical, mask = [], [], 0
+        for rule, bit, column, compare in self._scalar:
+            value = vector[column]
+            if compare(value, rule.threshold):
+                fired.append(rule)
+                mask |= bit
+                if rule.critical is not None and compare(value, rule.critical):
+                    critical.append(rule.name)
+        local = mask in self._pattern_set and not critical
+        if local:
+            self.answered_locally += 1
+        else:
+            self.escalated += 1
+        return {"fired": fired, "critical": critical, "local": local}
+
+    def fired(self, data: Dict) -> List[Rule]:
+        """Rules a metrics dict fires (missing fields count as 0); ValueError for non-numeric or non-finite values."""
+        try:
+            vector = [float(data.get(field, 0) or 0) for field in METRIC_FIELDS]
+        except (TypeError, ValueError):
+            raise ValueError("Metrics must be numbers.")
+        if not np.isfinite(vector).all():
+            raise ValueError("Metrics must be finite numbers.")
+        fired, _ = self.evaluate_many(vector)
+        return [rule for rule, hit in zip(self.rules, fired[0].tolist()) if hit]
+
+    def hit_rates(self, values: np.ndarray) -> Dict:
+        """Share of the given readings that fire each rule, and that would be answered locally."""
+        if not len(values):
+            return {"records": 0, "rules": {}, "local": None}
+        fired, _ = self.evaluate_many(values)
+        rates = fired.mean(axis=0).tolist()
+        return {
+            "records": len(values),
+            "rules": {rule.name: round(rate, 4) for rule, rate in zip(self.rules, rates)},
+            "local": round(float(self.local_many(values).mean()), 4),
+        }
+
+    def describe(self) -> Dict:
+        return {
+            "rules": [rule.to_dict() for rule in self.rules],
+            "local_patterns": self.local_patterns,
+            "answered_locally": self.answered_locally,
+            "escalated": self.escalated,
+        }
+
+
+def load_rule_engine(path: str = ANALYZE_RULES_PATH) -> RuleEngine:
+    """Rule set from a JSON file ({"rules": [...], "local_patterns": [[...], ...]}), else the default."""
+    rule_set = DEFAULT_RULE_SET
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rule_set = json.load(f)
+    return RuleEngine(rule_set["rules"], rule_set.get("local_patterns"))
+
+
+analysis_rules = load_rule_engine()
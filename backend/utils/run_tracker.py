@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from utils.broadcast import Broadcaster
+from utils.instrumentation import upstream_timer
+from utils.orchestrate_agent import get_http_client
+from utils.sse import iter_events
+
+RUN_EVENTS_URL = os.getenv("RUN_EVENTS_URL")  # optional streaming endpoint, e.g. https://.../runs/{run_id}/events
+RUN_TIMEOUT_S = float(os.getenv("RUN_TIMEOUT_S", "60"))
+RUN_POLL_INITIAL_S = float(os.getenv("RUN_POLL_INITIAL_S", "0.25"))
+RUN_POLL_MAX_S = float(os.getenv("RUN_POLL_MAX_S", "2"))
+RUN_RESULT_TTL_S = 300  # finished runs are answered from memory this long
+RUN_RESULT_CACHE = 1024
+
+COMPLETED_STATUSES = {"completed", "succeeded", "success", "done"}
+FAILED_STATUSES = {"failed", "error", "cancelled"}
+
+
+class RunFailed(Exception):
+    """The upstream run finished unsuccessfully; `data` is its last payload."""
+
+    def __init__(self, data: dict):
+        super().__init__(json.dumps(data))
+        self.data = data
+
+
+def run_status(data: dict) -> str:
+    if not isinstance(data, dict):
+        return ""
+    status = data.get("status") or data.get("state") or data.get("run_status") or ""
+    if not status and isinstance(data.get("event"), str):
+        status = data["event"].rsplit(".", 1)[-1]  # e.g. "run.completed"
+    return str(status).lower()
+
+
+def backoff_delays(initial: float, ceiling: float):
+    """Exponential backoff with jitter: ~initial, 2*initial, ... capped at ceiling."""
+    delay = initial
+    while True:
+        yield delay * random.uniform(0.5, 1.0)
+        delay = min(delay * 2, ceiling)
+
+
+class RunTracker:
+    """
+    Waits for orchestrate runs to finish, once per run_id.
+
+    The first caller for a run starts a watcher task (streaming from RUN_EVENTS_URL
+    when configured, otherwise polling the result URL with jittered exponential
+    backoff); everyone else awaiting the same run shares it. Status changes are
+    published on a per-run Broadcaster for SSE subscribers, and finished runs are
+    kept for RUN_RESULT_TTL_S so late callers do not hit the upstream again.
+    """
+
+    def __init__(self, result_url: str, events_url: Optional[str] = RUN_EVENTS_URL):
+        self.result_url = result_url.rstrip("/")
+        self.events_url = events_url
+        self._watchers: Dict[str, asyncio.Task] = {}
+        self._hubs: Dict[str, Broadcaster] = {}
+        self._finished: "OrderedDict[str, tuple]" = OrderedDict()
+        self.upstream_requests = 0
+        self.deduplicated = 0
+
+    # --- public API ---
+    async def wait(self, run_id: str, headers: dict, timeout_s: float = RUN_TIMEOUT_S) -> dict:
+        """Final payload of a completed run; raises RunFailed or asyncio.TimeoutError."""
+        finished = self._cached(run_id)
+        if finished is not None:
+            return _unwrap(finished)
+        watcher = self._watch(run_id, headers, timeout_s)
+        # shield: a caller that gives up must not cancel the watcher others share
+        return await asyncio.wait_for(asyncio.shield(watcher), timeout_s)
+
+    async def events(self, run_id: str, headers: dict) -> AsyncIterator[str]:
+        """SSE frames for every status change of the run, ending with its outcome."""
+        finished = self._cached(run_id)
+        if finished is not None:
+            yield _frame(run_id, *finished)
+            return
+        hub = self._hubs.setdefault(run_id, Broadcaster(max_queue=32))
+        queue = hub.subscribe()
+        try:
+            self._watch(run_id, headers, RUN_TIMEOUT_S)
+            while True:
+                frame, final = await queue.get()
+                yield frame
+                if final:
+                    return
+        finally:
+            hub.unsubscribe(queue)
+
+    # --- watcher lifecycle ---
+    def _cached(self, run_id: str) -> Optional[tuple]:
+        entry = self._finished.get(run_id)
+        if entry is None:
+            return None
+        expires, status, data = entry
+        if expires < time.time():
+            del self._finished[run_id]
+            return None
+        return status, data
+
+    def _watch(self, run_id: str, headers: dict, timeout_s: float) -> asyncio.Task:
+        watcher = self._watchers.get(run_id)
+        if watcher is not None:
+            self.deduplicated += 1
+            return watcher
+        watcher = asyncio.create_task(self._track(run_id, headers, time.monotonic() + timeout_s))
+        watcher.add_done_callback(lambda task: self._finish(run_id, task))
+        self._watchers[run_id] = watcher
+        return watcher
+
+    def _finish(self, run_id: str, task: asyncio.Task):
+        self._watchers.pop(run_id, None)
+        if task.cancelled():
+            status, data = "cancelled", {}
+        elif isinstance(task.exception(), RunFailed):
+            status, data = "failed", task.exception().data
+        elif task.exception() is not None:
+            status, data = "error", {"error": str(task.exception())}
+        else:
+            status, data = "completed", task.result()
+        if status in {"completed", "failed"}:
+            self._finished[run_id] = (time.time() + RUN_RESULT_TTL_S, status, data)
+            while len(self._finished) > RUN_RESULT_CACHE:
+                self._finished.popitem(last=False)
+        hub = self._hubs.pop(run_id, None)
+        if hub is not None:
+            hub.publish((_frame(run_id, status, data), True))
+
+    def _publish(self, run_id: str, status: str):
+        hub = self._hubs.get(run_id)
+        if hub is not None:
+            hub.publish((_frame(run_id, status, {}), False))
+
+    # --- upstream ---
+    async def _track(self, run_id: str, headers: dict, deadline: float) -> dict:
+        if self.events_url:
+            try:
+                data = await self._stream(run_id, headers, deadline)
+                if data is not None:
+                    return data
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                print(f"⚠️ Run event stream unavailable, polling instead: {e}")
+        return await self._poll(run_id, headers, deadline)
+
+    async def _stream(self, run_id: str, headers: dict, deadline: float) -> Optional[dict]:
+        """Follow the run's event stream; returns the final payload, or None if it ended early."""
+        url = self.events_url.format(run_id=run_id)
+        self.upstream_requests += 1
+        async with asyncio.timeout(max(deadline - time.monotonic(), 0)):
+            with upstream_timer("orchestrate", "run_events"):
+                async with get_http_client().stream("GET", url, headers=headers, timeout=None) as response:
+                    response.raise_for_status()
+                    async for event in iter_events(response):
+                        payload = event.get("data") if isinstance(event.get("data"), dict) else event
+                        status = run_status(event) or run_status(payload)
+                        if status in FAILED_STATUSES:
+                            raise RunFailed(payload)
+                        if status in COMPLETED_STATUSES:
+                            # event bodies may omit the result; one GET fetches it
+                            return payload if payload.get("result") else await self._fetch(run_id, headers)
+                        if status:
+                            self._publish(run_id, status)
+        return None
+
+    async def _fetch(self, run_id: str, headers: dict) -> dict:
+        self.upstream_requests += 1
+        with upstream_timer("orchestrate", "run_result"):
+            r = await get_http_client().get(f"{self.result_url}/{run_id}", headers=headers)
+            r.raise_for_status()
+        return r.json()
+
+    async def _poll(self, run_id: str, headers: dict, deadline: float) -> dict:
+        last_status = None
+        for delay in backoff_delays(RUN_POLL_INITIAL_S, RUN_POLL_MAX_S):
+            try:
+                data = await self._fetch(run_id, headers)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code < 500:
+                    raise
+                data = {}  # transient upstream error: keep backing off
+            except httpx.TransportError:
+                data = {}
+            status = run_status(data)
+            if status in COMPLETED_STATUSES:
+                return data
+            if status in FAILED_STATUSES:
+                raise RunFailed(data)
+            if status and status != last_status:
+                self._publish(run_id, status)
+                last_status = status
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"run {run_id} did not finish in time")
+            await asyncio.sleep(min(delay, remaining))
+
+
+def _unwrap(finished: tuple) -> dict:
+    status, data = finished
+    if status == "failed":
+        raise RunFailed(data)
+    return data
+
+
+def _frame(run_id: str, status: str, data: dict) -> str:
+    event = {"run_id": run_id, "status": status}
+    if data:
+        event["data"] = data
+    return f"event: {status}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,95 @@
+import json
+from typing import AsyncIterator, List, Optional
+
+
+class EventStreamParser:
+    """
+    Incremental parser for upstream event streams: SSE (`event:` / `data:` fields,
+    events ended by a blank line, multi-line data joined with newlines) and NDJSON
+    (one JSON object per line), mixed freely.
+
+    feed() takes text chunks exactly as the network delivers them and returns the
+    events completed so far as decoded JSON objects. SSE events named by an `event:`
+    field whose data has no "event" key of its own come back in the NDJSON envelope,
+    {"event": name, "data": payload}, so consumers see one shape. Only the new chunk
+    is searched for line breaks, so a long event split over many chunks is not
+    re-scanned. Use one parser per connection.
+    """
+
+    def __init__(self):
+        self._partial: List[str] = []  # pieces of the current, unterminated line
+        self._data: List[str] = []  # data lines of the SSE event being assembled
+        self._event: Optional[str] = None
+
+    def feed(self, chunk: str) -> List[dict]:
+        events: List[dict] = []
+        start = 0
+        while True:
+            end = chunk.find("\n", start)
+            if end < 0:
+                break
+            piece = chunk[start:end]
+            if self._partial:
+                self._partial.append(piece)
+                piece = "".join(self._partial)
+                self._partial = []
+            self._line(piece[:-1] if piece.endswith("\r") else piece, events)
+            start = end + 1
+        if start < len(chunk):
+            self._partial.append(chunk[start:])
+        return events
+
+    def close(self) -> List[dict]:
+        """Flush a trailing line and event left open when the stream ends."""
+        events: List[dict] = []
+        if self._partial:
+            line = "".join(self._partial)
+            self._partial = []
+            self._line(line.rstrip("\r"), events)
+        self._dispatch(events)
+        return events
+
+    def _line(self, line: str, events: List[dict]):
+        if not line:
+            self._dispatch(events)
+        elif line[0] == ":":
+            pass  # comment / keep-alive
+        elif line[0] == "{":
+            self._dispatch(events)  # NDJSON record: an event on its own
+            self._decode(line, None, events)
+        else:
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "data":
+                self._data.append(value)
+            elif field == "event":
+                self._event = value
+            # id / retry and unknown fields are ignored
+
+    def _dispatch(self, events: List[dict]):
+        if self._data:
+            self._decode("\n".join(self._data), self._event, events)
+        self._data = []
+        self._event = None
+
+    @staticmethod
+    def _decode(text: str, name: Optional[str], events: List[dict]):
+        try:
+            payload = json.loads(text)
+        except json.JSONDecodeError:
+            return  # e.g. a "[DONE]" sentinel
+        if name and not (isinstance(payload, dict) and "event" in payload):
+            payload = {"event": name, "data": payload}
+        if isinstance(payload, dict):
+            events.append(payload)
+
+
+async def iter_events(response) -> AsyncIterator[dict]:
+    """Decoded events of a streaming httpx response, parsed incrementally."""
+    parser = EventStreamParser()
+    async for chunk in response.aiter_text():
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
@@ -0,0 +1,235 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from utils.metrics_store import MetricsStore
+
+# Max query x record distances held in memory at once by the exact scan
+SIMILARITY_CHUNK = 4_000_000
+# GridIndex inserts kept in the exact-scan delta before a rebuild is worthwhile (or 1/32 of the records)
+GRID_DELTA_MIN = 4096
+
+
+def squared_distances(points: np.ndarray, queries: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """(Weighted) squared Euclidean distances, shape (len(queries), n_points), one pass per field."""
+    distances = np.zeros((queries.shape[0], points.shape[1]), dtype=np.float64)
+    for field in range(points.shape[0]):
+        diff = points[field][None, :] - queries[:, field][:, None]
+        if weights is None:
+            distances += diff * diff
+        else:
+            distances += weights[field] * (diff * diff)
+    return distances
+
+
+def cosine_distances(points: np.ndarray, queries: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+    """1 - cosine similarity between each query and each point (0 for zero-length vectors)."""
+    if weights is not None:
+        root = np.sqrt(weights)
+        points = points * root[:, None]
+        queries = queries * root[None, :]
+    dots = queries @ points
+    norms = np.sqrt((queries * queries).sum(axis=1))[:, None] * np.sqrt((points * points).sum(axis=0))[None, :]
+    cosine = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+    return 1.0 - cosine
+
+
+def mahalanobis_distances(points: np.ndarray, queries: np.ndarray, precision: np.ndarray) -> np.ndarray:
+    """Squared Mahalanobis distances under `precision` (inverse covariance), via whitening."""
+    eigvals, eigvecs = np.linalg.eigh(precision)
+    whiten = (eigvecs * np.sqrt(np.clip(eigvals, 0.0, None))).T
+    return squared_distances(whiten @ points, queries @ whiten.T)
+
+
+def scan_top_k(points: np.ndarray, queries: np.ndarray, k: int, distance_fn: Callable = squared_distances):
+    """Exact top-k over all `points` columns, scoring queries in memory-bounded chunks."""
+    if points.shape[1] == 0 or k <= 0:
+        return [(np.empty(0, dtype=np.int64), np.empty(0)) for _ in queries]
+    chunk = max(1, SIMILARITY_CHUNK // points.shape[1])
+    results = []
+    for start in range(0, len(queries), chunk):
+        distances = distance_fn(points, queries[start:start + chunk])
+        slots = top_k_indices(distances, k)
+        results.extend(zip(slots, np.take_along_axis(distances, slots, axis=1)))
+    return results
+
+
+def top_k_indices(distances: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest entries per row, ascending, via argpartition."""
+    n = distances.shape[1]
+    if k >= n:
+        return np.argsort(distances, axis=1, kind="stable")
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(distances, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Brute-force index: every query scans all live records in one vectorized pass.
+    Holds no state of its own, so inserts and evictions are free.
+    """
+
+    name = "exact"
+
+    def __init__(self, store: MetricsStore, points: np.ndarray = None):
+        self.store = store
+        self.points = store.values if points is None else points
+
+    def insert(self, slot: int):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def wants_rebuild(self) -> bool:
+        return False
+
+    def query_batch(self, queries: np.ndarray, k: int, weights: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Return (slots, squared distances) per query, nearest first."""
+        live = self.points[:, : self.store.size]
+        return scan_top_k(live, queries, k, lambda p, q: squared_distances(p, q, weights))
+
+
+class GridIndex:
+    """
+    Uniform grid bucket index over the metric vector space.
+
+    Each record lives in the cell floor(vector / cell_size). A query ranks the
+    occupied cells by their minimum possible distance to the query, scans the
+    nearest cells until it holds k candidates, then adds every cell that could
+    still beat the current k-th distance. With max_probe = 0 the answer is exact;
+    a positive max_probe caps the cells scanned per query, trading recall for latency.
+
+    Cell membership is stored as arrays, not per-cell Python sets: the slots sorted
+    by cell (`_order`) with each cell's start offset (`_starts`), as produced by the
+    argsort in rebuild(). Inserts between rebuilds go to a small delta list that
+    every query scans exactly; a reused ring slot is masked out of the sorted
+    arrays. wants_rebuild() reports when the delta has grown enough to merge.
+    """
+
+    name = "grid"
+
+    def __init__(self, store: MetricsStore, cell_size: float, max_probe: int = 0, points: np.ndarray = None):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.store = store
+        self.points = store.values if points is None else points
+        self.cell_size = float(cell_size)
+        self.max_probe = int(max_probe)
+        slot_dtype = np.int32 if store.capacity < 2 ** 31 else np.int64
+        self._order = np.empty(0, dtype=slot_dtype)  # indexed slots, grouped by cell
+        self._starts = np.zeros(1, dtype=np.int64)  # cell i owns _order[_starts[i]:_starts[i + 1]]
+        self._cell_keys = np.empty((0, self.points.shape[0]), dtype=np.int64)
+        self._live = np.empty(0, dtype=np.int64)  # per cell: members not overwritten since the rebuild
+        self._slot_cell = np.zeros(store.capacity, dtype=np.int32 if store.capacity < 2 ** 31 else np.int64)
+        self._in_base = np.zeros(store.capacity, dtype=bool)  # slot still holds the record rebuild() saw
+        self._in_delta = np.zeros(store.capacity, dtype=bool)
+        self._delta: List[int] = []
+        self._delta_slots = None  # array copy of _delta, rebuilt lazily
+
+    def __len__(self) -> int:
+        return int(self._in_base.sum()) + len(self._delta)
+
+    def insert(self, slot: int):
+        """Index the record currently held in `slot`, evicting whatever it replaced."""
+        if self._in_base[slot]:
+            self._in_base[slot] = False
+            self._live[self._slot_cell[slot]] -= 1
+        if not self._in_delta[slot]:  # a delta slot is scored from its current contents
+            self._in_delta[slot] = True
+            self._delta.append(slot)
+            self._delta_slots = None
+
+    def wants_rebuild(self) -> bool:
+        return len(self._delta) > max(GRID_DELTA_MIN, self.store.size // 32)
+
+    def rebuild(self):
+        """Re-index every live slot, e.g. after the underlying points were rewritten."""
+        self._in_base[:] = False
+        self._in_delta[:] = False
+        self._delta = []
+        self._delta_slots = None
+        size = self.store.size
+        if not size:
+            self._order = self._order[:0]
+            self._starts = np.zeros(1, dtype=np.int64)
+            self._cell_keys = self._cell_keys[:0]
+            self._live = self._live[:0]
+            return
+        keys = np.floor(self.points[:, :size].T / self.cell_size).astype(np.int64)
+        # Group slots by cell with one sort
+        low = keys.min(axis=0)
+        extent = keys.max(axis=0) - low + 1
+        if np.prod(extent.astype(np.float64)) < 2 ** 62:
+            flat = np.ravel_multi_index((keys - low).T, extent)
+        else:  # extreme outliers: fall back to a row-wise unique
+            flat = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+        order = np.argsort(flat, kind="stable")
+        flat_sorted = flat[order]
+        starts = np.flatnonzero(np.r_[True, flat_sorted[1:] != flat_sorted[:-1]])
+        self._cell_keys = keys[order[starts]]
+        self._order = order.astype(self._order.dtype)
+        self._starts = np.append(starts, size)
+        self._live = np.diff(self._starts)
+        self._slot_cell[order] = np.repeat(np.arange(len(starts), dtype=self._slot_cell.dtype), self._live)
+        self._in_base[:size] = True
+
+    def _gather(self, cells: np.ndarray) -> np.ndarray:
+        starts, order = self._starts, self._order
+        parts = [order[starts[c]:starts[c + 1]] for c in cells.tolist()]
+        slots = np.concatenate(parts).astype(np.int64) if parts else np.empty(0, dtype=np.int64)
+        return slots[self._in_base[slots]]
+
+    def query(self, query: np.ndarray, k: int, weights: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (slots, weighted squared distances) of the k nearest records, nearest first."""
+        if self._delta_slots is None:
+            self._delta_slots = np.asarray(self._delta, dtype=np.int64)
+        delta = self._delta_slots
+        keys = self._cell_keys
+        if (not len(keys) and not len(delta)) or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = delta
+        distances = squared_distances(self.points[:, delta], query[None, :], weights)[0]
+
+        if len(keys):
+            # Lower bound of the distance from the query to any point inside each cell
+            low = keys * self.cell_size
+            gap = np.maximum(np.maximum(low - query, query - (low + self.cell_size)), 0.0)
+            bounds = (gap * gap if weights is None else weights * (gap * gap)).sum(axis=1)
+            order = np.argsort(bounds, kind="stable")
+            limit = len(order) if self.max_probe <= 0 else min(self.max_probe, len(order))
+
+            # Seed with the nearest cells until k candidates are available
+            found = np.cumsum(self._live[order[:limit]]) + len(delta)
+            seed = min(int(np.searchsorted(found, k, side="left")) + 1, limit)
+            base = self._gather(order[:seed])
+            candidates = np.concatenate([candidates, base])
+            distances = np.concatenate([distances, squared_distances(self.points[:, base], query[None, :], weights)[0]])
+
+            # Every cell whose lower bound beats the current k-th distance may hold a closer point
+            if seed < limit and len(candidates) >= k:
+                kth = np.partition(distances, k - 1)[k - 1]
+                reach = min(int(np.searchsorted(bounds[order], kth, side="right")), limit)
+                if reach > seed:
+                    extra = self._gather(order[seed:reach])
+                    candidates = np.concatenate([candidates, extra])
+                    distances = np.concatenate(
+                        [distances, squared_distances(self.points[:, extra], query[None, :], weights)[0]]
+                    )
+
+        best = top_k_indices(distances[None, :], k)[0]
+        return candidates[best], distances[best]
+
+    def query_batch(self, queries: np.ndarray, k: int, weights: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        return [self.query(q, k, weights) for q in queries]
+
+
+def build_index(kind: str, store: MetricsStore, cell_size: float = 0.25, max_probe: int = 0, points: np.ndarray = None):
+    """Create the similarity index named by `kind` ("exact" or "grid")."""
+    kind = (kind or "exact").lower()
+    if kind == "exact":
+        return ExactIndex(store, points=points)
+    if kind == "grid":
+        return GridIndex(store, cell_size=cell_size, max_probe=max_probe, points=points)
+    raise ValueError(f"Unknown similarity index: {kind}")
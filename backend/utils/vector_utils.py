@@ -1,16 +1,260 @@
-from collections import deque
+import atexit
+import itertools
 import json
+import math
+import os
 import re
-from typing import List, Dict
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
-import math
+
+import numpy as np
+
+from utils.anomaly import AnomalyDetector
+from utils.forecast_engine import FORECAST_MODELS, ForecastEngine
+from utils.instrumentation import registry
+from utils.metric_stats import NormalizedColumns
+from utils.rollups import ROLLUP_RESOLUTIONS, RollupSet, downsample, series_rows
+from utils.metrics_store import METRIC_FIELDS, MetricsStore, to_epoch, to_epoch_ns, to_iso
+from utils.vector_index import (
+    build_index,
+    cosine_distances,
+    mahalanobis_distances,
+    scan_top_k,
+    squared_distances,
+)
 
 # Configuration
-MAX_MEMORY_RECORDS = 1000  # rolling memory cap
+MAX_MEMORY_RECORDS = int(os.getenv("MAX_MEMORY_RECORDS", "1000000"))  # rolling memory cap
+METRICS_DATA_PATH = os.getenv("METRICS_DATA_PATH", "")  # memory-mapped segment file; empty = heap only
+METRICS_FLUSH_EVERY = int(os.getenv("METRICS_FLUSH_EVERY", "1000"))  # appends between msyncs
+METRICS_SHM_NAME = os.getenv("METRICS_SHM_NAME", "")  # shared-memory block for multi-worker setups
 VECTOR_DIM = 3  # [co2, waste, energy]
+SIMILARITY_METRICS = ("scaled", "euclidean", "cosine", "mahalanobis")
+SIMILARITY_METRIC = os.getenv("SIMILARITY_METRIC", "scaled")  # default distance for /similar
+SIMILARITY_INDEX = os.getenv("SIMILARITY_INDEX", "grid")  # "grid" or "exact"
+SIMILARITY_CELL_SIZE = float(os.getenv("SIMILARITY_CELL_SIZE", "0.25"))  # grid cell width, in std units
+SIMILARITY_MAX_PROBE = int(os.getenv("SIMILARITY_MAX_PROBE", "0"))  # 0 = exact grid search
+DEFAULT_FIELD_SCALES = (150.0, 100.0, 20000.0)  # used until enough history exists for live stats
+ROLLUP_CAPACITIES = {"1m": 2 * 24 * 60, "5m": 7 * 24 * 12, "1h": 90 * 24}  # buckets kept: 2 days, 7 days, 90 days
+ROLLUP_RANGES = [  # histogram range per field for p95 (values outside land in the edge bins)
+    tuple(float(v) for v in r.split(":"))
+    for r in os.getenv("ROLLUP_RANGES", "0:300,0:100,0:40000").split(",")
+]
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "500"))  # default LTTB budget for /history
+ROLLUP_REBUILD_CHUNK = 65536  # records folded per step of a background rollup rebuild
+FORECAST_MODEL = os.getenv("FORECAST_MODEL", "holt")  # "holt", "ewma" or "linear"
+FORECAST_HORIZON_S = float(os.getenv("FORECAST_HORIZON_S", "3600"))  # default look-ahead for /forecast
+FORECAST_MAX_HORIZON_S = float(os.getenv("FORECAST_MAX_HORIZON_S", str(7 * 86400)))  # longest look-ahead accepted
+FORECAST_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.1"))  # level smoothing per record
+FORECAST_BETA = float(os.getenv("FORECAST_BETA", "0.02"))  # trend smoothing per record
+FORECAST_PHI = float(os.getenv("FORECAST_PHI", "0.98"))  # trend damping per step
+FORECAST_DECAY = float(os.getenv("FORECAST_DECAY", "0.999"))  # forgetting factor of the linear trend
+FORECAST_NONNEGATIVE = ("waste_level", "energy_usage")  # forecasts and bounds clipped at 0
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "120"))  # records in the rolling baseline
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "20"))  # no alerts until the baseline has this many
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "4"))  # rolling z-score limit
+ANOMALY_EWMA_LAMBDA = float(os.getenv("ANOMALY_EWMA_LAMBDA", "0.2"))
+ANOMALY_EWMA_L = float(os.getenv("ANOMALY_EWMA_L", "3.5"))  # EWMA control limit width, in std units
+ANOMALY_CUSUM_K = float(os.getenv("ANOMALY_CUSUM_K", "0.5"))  # CUSUM slack, in std units
+ANOMALY_CUSUM_H = float(os.getenv("ANOMALY_CUSUM_H", "8"))  # CUSUM decision limit
+ALERT_LOG_SIZE = int(os.getenv("ALERT_LOG_SIZE", "1000"))  # recent alerts kept for /alerts
+
+# In-memory store: ring buffer of {timestamp, co2_emissions, waste_level, energy_usage} columns,
+# optionally backed by a memory-mapped segment that survives restarts, or by a shared-memory
+# block; both are shared by every uvicorn worker on the host
+_memory_store = MetricsStore(
+    MAX_MEMORY_RECORDS,
+    path=METRICS_DATA_PATH or None,
+    shm_name=(METRICS_SHM_NAME or None) if not METRICS_DATA_PATH else None,
+)
+# Standardized copy of the columns; the similarity index is built over it
+_normalized = NormalizedColumns(_memory_store, DEFAULT_FIELD_SCALES)
+_index = build_index(
+    SIMILARITY_INDEX,
+    _memory_store,
+    cell_size=SIMILARITY_CELL_SIZE,
+    max_probe=SIMILARITY_MAX_PROBE,
+    points=_normalized.values,
+)
+# Incremental forecasting models over the same records
+_forecaster = ForecastEngine(
+    METRIC_FIELDS,
+    alpha=FORECAST_ALPHA,
+    beta=FORECAST_BETA,
+    phi=FORECAST_PHI,
+    decay=FORECAST_DECAY,
+    nonnegative=FORECAST_NONNEGATIVE,
+)
+# min/max/mean/p95 per 1m/5m/1h bucket, for downsampled /history queries. After a restart
+# they are rebuilt by a background thread; until it finishes /history reads raw records
+_rollups = RollupSet(ROLLUP_CAPACITIES, ROLLUP_RANGES)
+_rollups_ready = True
+_rollups_generation = 0  # bumped by every rebuild, so a superseded one stops
+# Online z-score / EWMA / CUSUM detectors; their alerts are numbered and kept in _alerts
+_detector = AnomalyDetector(
+    METRIC_FIELDS,
+    window=ANOMALY_WINDOW,
+    min_samples=ANOMALY_MIN_SAMPLES,
+    z=ANOMALY_Z,
+    lam=ANOMALY_EWMA_LAMBDA,
+    L=ANOMALY_EWMA_L,
+    k=ANOMALY_CUSUM_K,
+    h=ANOMALY_CUSUM_H,
+)
+_alerts: deque = deque(maxlen=ALERT_LOG_SIZE)
+_alert_ids = itertools.count(1)
+# Per-process derived state (normalized columns, index, forecaster, rollups, detectors) and how far it has caught up
+_derived_lock = threading.RLock()
+_seen = 0
+_index_stale = False  # rebuilt by the next similarity query, e.g. after a warm restart
+
+similarity_seconds = registry.histogram(
+    "greenforce_similarity_query_seconds",
+    "Time to answer one find_similar_metrics_batch call, including catching up derived state.",
+    ("metric",),
+)
+similarity_queries = registry.counter(
+    "greenforce_similarity_queries_total", "Query vectors answered, per distance metric.", ("metric",)
+)
+
+
+def _restore_history():
+    """Rebuild derived state (normalization) for records already in a persisted or shared segment."""
+    global _seen, _index_stale
+    with _derived_lock:
+        _memory_store.refresh()
+        if _memory_store:
+            start = time.perf_counter()
+            if _normalized.stats.count != len(_memory_store):
+                _normalized.refit()  # segment predates the stored statistics
+            else:
+                _normalized.renormalize()
+            _index_stale = True
+            _refit_forecaster()
+            _refit_rollups()
+            _refit_detector()
+            elapsed = (time.perf_counter() - start) * 1000
+            source = METRICS_DATA_PATH or f"shared memory {METRICS_SHM_NAME}"
+            print(f"[InMemoryDB] Restored {len(_memory_store)} records from {source} in {elapsed:.1f} ms.")
+        _seen = _memory_store.written
+
+
+def _refit_forecaster():
+    slots = _memory_store.recent_slots(_forecaster.replay_max)
+    _forecaster.refit(_memory_store.timestamps[slots] * 1e-9, _memory_store.values[:, slots].T)
+
+
+def _refit_rollups():
+    """
+    Start rebuilding the rollups from every live record in a background thread; a full
+    pass takes seconds at a million records, far longer than the rest of a warm restart.
+    Call with _derived_lock held. Until the rebuild catches up, _sync leaves the rollups
+    alone and get_history answers from raw records.
+    """
+    global _rollups_ready, _rollups_generation
+    _rollups_ready = False
+    _rollups_generation += 1
+    oldest = _memory_store.written - _memory_store.size
+    threading.Thread(
+        target=_rebuild_rollups, args=(_rollups_generation, oldest), name="rollup-rebuild", daemon=True
+    ).start()
+
 
-# In-memory store: list of {timestamp, co2_emissions, waste_level, energy_usage}
-_memory_store: deque = deque(maxlen=MAX_MEMORY_RECORDS)
+def _fold_rollups(rollups: RollupSet, position: int, end: int) -> int:
+    """
+    Add the records at write positions [position, end) to `rollups` in chunks. Records
+    a writer overwrote meanwhile are skipped (they left the store). Returns `end`.
+    """
+    capacity = _memory_store.capacity
+    for lo in range(position, end, ROLLUP_REBUILD_CHUNK):
+        hi = min(lo + ROLLUP_REBUILD_CHUNK, end)
+        slots = np.arange(lo, hi) % capacity
+        timestamps, values = _memory_store.timestamps[slots] * 1e-9, _memory_store.values[:, slots].T
+        overwritten = min(max(_memory_store.refresh() - capacity - lo, 0), hi - lo)
+        if overwritten < hi - lo:
+            rollups.add(timestamps[overwritten:], values[overwritten:])
+    return end
+
+
+def _rebuild_rollups(generation: int, position: int):
+    """Background half of _refit_rollups: fold the history outside the lock, then swap in."""
+    global _rollups, _rollups_ready
+    fresh = RollupSet(ROLLUP_CAPACITIES, ROLLUP_RANGES)
+    try:
+        while True:
+            with _derived_lock:
+                if generation != _rollups_generation:
+                    return
+                if _seen - position <= ROLLUP_REBUILD_CHUNK:
+                    _fold_rollups(fresh, position, _seen)
+                    _rollups, _rollups_ready = fresh, True
+                    return
+                target = _seen
+            position = _fold_rollups(fresh, position, target)
+    except Exception as e:
+        print(f"⚠️ Rollup rebuild failed: {e}")
+
+
+def _refit_detector():
+    slots = _memory_store.recent_slots(_detector.window * 4)
+    _detector.refit(_memory_store.timestamps[slots] * 1e-9, _memory_store.values[:, slots].T)
+
+
+def _record_alerts(alerts: List[Dict]):
+    for alert in alerts:
+        alert["id"] = next(_alert_ids)
+        alert["timestamp"] = to_iso(alert["timestamp"])
+        _alerts.append(alert)
+
+
+def _sync():
+    """
+    Catch this process's derived state up with every record published to the store,
+    including appends made by other worker processes. Call with _derived_lock held.
+    A similarity index that needs regrouping is only marked stale here; the rebuild
+    waits for the next similarity query (_sync_index) so it never lengthens a write.
+    """
+    global _seen, _index_stale
+    written = _memory_store.refresh()
+    if written < _seen or written - _seen >= _memory_store.capacity:
+        _normalized.renormalize()
+        _index_stale = True
+        _refit_forecaster()
+        _refit_rollups()
+        _refit_detector()
+    elif written > _seen:
+        slots = np.arange(_seen, written) % _memory_store.capacity
+        new_timestamps, new_values = _memory_store.timestamps[slots] * 1e-9, _memory_store.values[:, slots].T
+        _forecaster.update_many(new_timestamps, new_values)
+        if _rollups_ready:
+            _rollups.add(new_timestamps, new_values)  # otherwise the rebuild folds them in
+        _record_alerts(_detector.update_many(new_timestamps, new_values))
+        if _normalized.update_slots(slots, _seen, written):
+            _index_stale = True  # every column was rewritten
+        elif not _index_stale:
+            if len(slots) > max(_memory_store.size // 4, 1024):
+                _index_stale = True  # cheaper to regroup everything than to insert one by one
+            else:
+                for slot in slots.tolist():
+                    _index.insert(slot)
+                _index_stale = _index.wants_rebuild()  # stop growing the delta until the rebuild
+    _seen = written
+
+
+def _sync_index():
+    """_sync, then rebuild the similarity index if it is stale. Call with _derived_lock held."""
+    global _index_stale
+    _sync()
+    if _index_stale or _index.wants_rebuild():
+        _index.rebuild()
+        _index_stale = False
+
+
+_restore_history()
+atexit.register(_memory_store.flush)
 
 
 def _vector_from_metrics(metrics: Dict) -> List[float]:
@@ -33,47 +277,292 @@ def store_metrics_vector(metrics: Dict):
     """
     if "timestamp" not in metrics:
         metrics["timestamp"] = datetime.utcnow().isoformat()
-    _memory_store.append(metrics)
+    timestamp = to_epoch_ns(metrics["timestamp"])
+    vector = np.asarray(_vector_from_metrics(metrics), dtype=np.float64)
+    with _memory_store.write_lock():
+        previous = _memory_store.written
+        evicted = _memory_store.evicting()
+        _memory_store.append(timestamp, vector)
+        _normalized.observe(vector, evicted)
+    _after_write(previous)
     print(f"[InMemoryDB] Stored metrics ({len(_memory_store)} total).")
 
 
+def store_metrics_batch(timestamps: np.ndarray, vectors: np.ndarray) -> int:
+    """
+    Bulk-insert n records: epoch-ns `timestamps` (n,) and `vectors` (n, VECTOR_DIM)
+    in [co2, waste, energy] order. Columns, statistics and the index are updated with
+    vectorized block operations instead of one append per record. Returns n.
+
+    The batch is put in timestamp order before it is appended, so out-of-order
+    readings within one request never reach the store's time index as late records.
+    """
+    n = len(timestamps)
+    if not n:
+        return 0
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(n, VECTOR_DIM)
+    if n > 1 and (np.diff(timestamps) < 0).any():
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, vectors = timestamps[order], vectors[order]
+    with _memory_store.write_lock():
+        previous = _memory_store.written
+        keep = min(n, _memory_store.capacity)
+        evicted = _memory_store.evicting_many(keep)
+        _memory_store.append_many(timestamps, vectors)
+        _normalized.observe_many(vectors[-keep:], evicted)
+    _after_write(previous)
+    print(f"[InMemoryDB] Stored {n} metrics in bulk ({len(_memory_store)} total).")
+    return n
+
+
+def _after_write(previous: int):
+    """Bring derived state up to date and msync when a flush checkpoint was crossed."""
+    with _derived_lock:
+        _sync()
+    written = _memory_store.written
+    if METRICS_FLUSH_EVERY > 0 and written // METRICS_FLUSH_EVERY > previous // METRICS_FLUSH_EVERY:
+        _memory_store.flush()
+
+
 def get_recent_metrics(limit: int = 30) -> List[Dict]:
     """Return up to the last `limit` metric entries, sorted by timestamp."""
-    recent = list(_memory_store)[-limit:]
-    return sorted(recent, key=lambda x: x["timestamp"])
+    _memory_store.refresh()
+    return _memory_store.rows(_memory_store.in_time_order(_memory_store.recent_slots(limit)))
+
+
+def get_recent_values(limit: int) -> np.ndarray:
+    """The last `limit` records as an (n, VECTOR_DIM) array, oldest first."""
+    _memory_store.refresh()
+    return _memory_store.values[:, _memory_store.recent_slots(limit)].T.copy()
 
 
-def find_similar_metrics(current_metrics: Dict, top_k: int = 5) -> List[Dict]:
+def get_store_stats() -> Dict:
+    """Store occupancy and how far this process's derived state trails it."""
+    written = _memory_store.refresh()
+    return {
+        "records": _memory_store.size,
+        "capacity": _memory_store.capacity,
+        "written": written,
+        "max_lag_s": _memory_store.max_lag * 1e-9,
+        "derived_behind": max(written - _seen, 0),
+    }
+
+
+def get_write_position() -> int:
+    """Total records ever appended to the store (by any worker); a cursor for get_metrics_since."""
+    return _memory_store.refresh()
+
+
+def get_metrics_since(position: int, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
     """
-    Return top_k metrics most similar (by Euclidean distance) to the current one.
+    Return the records appended after write position `position` (oldest first, at most
+    one ring's worth, or only the newest `limit` of them) and the new position to pass
+    on the next call, which skips any records left out.
     """
-    if not _memory_store:
-        return []
+    written = _memory_store.refresh()
+    start = max(position, written - _memory_store.size)
+    if limit is not None:
+        start = max(start, written - limit)
+    if start >= written:
+        return [], written
+    slots = np.arange(start, written) % _memory_store.capacity
+    return _memory_store.rows(slots), written
 
-    current_vec = _vector_from_metrics(current_metrics)
 
-    def euclidean_distance(v1, v2):
-        return math.sqrt(sum((a - b) ** 2 for a, b in zip(v1, v2)))
+def get_forecast(horizon_s: Optional[float] = None, model: Optional[str] = None) -> Optional[Dict]:
+    """
+    Forecast from the incrementally maintained models (no scan of the history):
+    per field the newest value, the smoothed level, and for every model the point
+    forecast with lower/upper prediction bounds. None when the store is empty.
+    """
+    model = (model or FORECAST_MODEL).lower()
+    if model not in FORECAST_MODELS:
+        raise ValueError(f"Unknown forecast model: {model}")
+    horizon_s = FORECAST_HORIZON_S if horizon_s is None else float(horizon_s)
+    if not (math.isfinite(horizon_s) and 0 < horizon_s <= FORECAST_MAX_HORIZON_S):
+        raise ValueError(f"horizon must be positive and at most {FORECAST_MAX_HORIZON_S:g} seconds")
+    _memory_store.refresh()
+    with _derived_lock:
+        _sync()
+        return _forecaster.forecast(horizon_s, model)
+
+
+def get_alert_position() -> int:
+    """Id of the newest alert raised in this process so far (0 before the first)."""
+    with _derived_lock:
+        _sync()
+        return _alerts[-1]["id"] if _alerts else 0
+
+
+def get_alerts_since(position: int) -> Tuple[List[Dict], int]:
+    """
+    Alerts with an id above `position`, oldest first, and the position to pass next.
+    Catches up with records written by other workers first, so each process detects
+    on every record.
+    """
+    with _derived_lock:
+        _sync()
+        new = list(itertools.takewhile(lambda alert: alert["id"] > position, reversed(_alerts)))
+        return new[::-1], (_alerts[-1]["id"] if _alerts else position)
 
-    scored = []
-    for record in _memory_store:
-        vec = _vector_from_metrics(record)
-        distance = euclidean_distance(current_vec, vec)
-        scored.append((distance, record))
 
-    # Sort by smallest distance (most similar)
-    scored_sorted = sorted(scored, key=lambda x: x[0])[:top_k]
+def get_recent_alerts(limit: int = 50) -> Dict:
+    """The last `limit` alerts (newest last) and each detector's current state."""
+    with _derived_lock:
+        _sync()
+        recent = list(_alerts)[-limit:] if limit > 0 else []
+        return {"alerts": recent, "detectors": _detector.state()}
+
+
+def _query_epoch(value) -> float:
+    """Query-string timestamp: epoch seconds or an ISO string."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return to_epoch(value)
 
-    return [
-        {
-            "timestamp": r["timestamp"],
-            "co2_emissions": r["co2_emissions"],
-            "waste_level": r["waste_level"],
-            "energy_usage": r["energy_usage"],
-            "score": round(d, 4),
-        }
-        for d, r in scored_sorted
-    ]
+
+def get_history(start=None, end=None, resolution: Optional[str] = None, points: Optional[int] = None) -> Dict:
+    """
+    History between `start` and `end` (ISO strings or epoch seconds; default: the last
+    24 h up to now).
+
+    resolution "1m"/"5m"/"1h" reads the rollups, and "auto" (default) picks the finest
+    one covering the range; the bucket series is then reduced to about `points` rows
+    with LTTB, so the cost depends on the ring sizes, not on how many raw records fall
+    in the range. While the rollups are still being rebuilt after a restart, the raw
+    records in the range are reduced the same way instead (resolution "raw", count 1
+    per row). "raw" returns the records themselves, found by binary search on the
+    store's time index: the newest `points` of them, with `truncated` set when more matched.
+    """
+    points = HISTORY_MAX_POINTS if points is None else int(points)
+    if points < 3:
+        raise ValueError("points must be at least 3")
+    resolution = (resolution or "auto").lower()
+    if resolution not in ("auto", "raw") and resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of auto, raw, {', '.join(ROLLUP_RESOLUTIONS)}")
+    _memory_store.refresh()
+    end = time.time() if end is None else _query_epoch(end)
+    start = end - 86400.0 if start is None else _query_epoch(start)
+    if start > end:
+        raise ValueError("'from' must not be after 'to'")
+    window = {"from": to_iso(start), "to": to_iso(end), "resolution": resolution}
+
+    if resolution == "raw":
+        slots = _memory_store.range_slots(to_epoch_ns(start), to_epoch_ns(end))
+        return {**window, "history": _memory_store.rows(slots[-points:]), "truncated": len(slots) > points}
+
+    with _derived_lock:
+        _sync()
+        if not _rollups_ready:
+            resolution, series = "raw", _raw_series(start, end)
+        else:
+            if resolution == "auto":
+                resolution = _rollups.pick(start, end, max_buckets=max(points * 4, 1000))
+            series = _rollups.rollups[resolution].series(start, end)
+    series = downsample(series, points)
+    return {**window, "resolution": resolution, "history": series_rows(series, METRIC_FIELDS, to_iso)}
+
+
+def _raw_series(start: float, end: float) -> Dict[str, np.ndarray]:
+    """Records in [start, end] as a one-record-per-bucket series, shaped like Rollup.series."""
+    slots = _memory_store.range_slots(to_epoch_ns(start), to_epoch_ns(end))
+    values = _memory_store.values[:, slots].T
+    return {
+        "timestamp": _memory_store.timestamps[slots] * 1e-9,
+        "count": np.ones(len(slots), dtype=np.int64),
+        "mean": values,
+        "min": values,
+        "max": values,
+        "p95": values,
+    }
+
+
+def _weights_vector(weights) -> Optional[np.ndarray]:
+    """Per-field weights as an array in METRIC_FIELDS order; accepts a dict or a list."""
+    if not weights:
+        return None
+    if isinstance(weights, dict):
+        values = [float(weights.get(field, 1.0)) for field in METRIC_FIELDS]
+    else:
+        values = [float(w) for w in weights]
+        if len(values) != VECTOR_DIM:
+            raise ValueError(f"weights must have {VECTOR_DIM} entries")
+    if any(w < 0 for w in values):
+        raise ValueError("weights must be non-negative")
+    return np.asarray(values, dtype=np.float64)
+
+
+def scaled_distance(query: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Distance of raw `vectors` (n, dim) to a raw `query` in the units of the "scaled" metric."""
+    scale = _normalized.scale
+    return np.sqrt(squared_distances((vectors / scale).T, (query / scale)[None, :]))[0]
+
+
+def find_similar_metrics_batch(
+    queries: List[Dict], top_k: int = 5, metric: Optional[str] = None, weights=None
+) -> List[List[Dict]]:
+    """
+    Return, for each query, the top_k most similar stored metrics.
+
+    metric:
+      - "scaled": Euclidean on standardized fields, answered by the similarity index
+      - "euclidean": Euclidean on raw values (energy dominates)
+      - "cosine": cosine distance between standardized vectors
+      - "mahalanobis": Euclidean after whitening by the running covariance
+    weights: optional per-field weights ({field: w} or [co2, waste, energy]);
+      ignored by "mahalanobis", where the covariance already sets the weighting.
+    """
+    metric = (metric or SIMILARITY_METRIC).lower()
+    if metric not in SIMILARITY_METRICS:
+        raise ValueError(f"Unknown similarity metric: {metric}")
+    if not queries:
+        return []
+    if not _memory_store.refresh() or top_k <= 0:
+        return [[] for _ in queries]
+
+    query_vecs = np.asarray([_vector_from_metrics(q) for q in queries], dtype=np.float64)
+    w = _weights_vector(weights)
+
+    similarity_queries.inc(len(queries), metric)
+    with similarity_seconds.time(metric), _derived_lock:
+        _sync_index()
+        if metric == "scaled":
+            matches = _index.query_batch(_normalized.transform(query_vecs), top_k, weights=w)
+        elif metric == "euclidean":
+            matches = scan_top_k(
+                _memory_store.live_values(), query_vecs, top_k, lambda p, q: squared_distances(p, q, w)
+            )
+        elif metric == "cosine":
+            matches = scan_top_k(
+                _normalized.live_values(), _normalized.transform(query_vecs), top_k,
+                lambda p, q: cosine_distances(p, q, w),
+            )
+        else:
+            precision = _normalized.precision()
+            matches = scan_top_k(
+                _normalized.live_values(), _normalized.transform(query_vecs), top_k,
+                lambda p, q: mahalanobis_distances(p, q, precision),
+            )
+
+    results = []
+    for slots, distances in matches:
+        scores = distances if metric == "cosine" else np.sqrt(np.clip(distances, 0.0, None))
+        results.append([
+            {**record, "score": round(d, 4)}
+            for record, d in zip(_memory_store.rows(slots), scores.tolist())
+        ])
+    return results
+
+
+def find_similar_metrics(
+    current_metrics: Dict, top_k: int = 5, metric: Optional[str] = None, weights=None
+) -> List[Dict]:
+    """
+    Return top_k metrics most similar to the current one (see find_similar_metrics_batch).
+    """
+    return find_similar_metrics_batch([current_metrics], top_k, metric=metric, weights=weights)[0]
 
 
 def get_recent_data(limit=100):
@@ -114,7 +603,7 @@ def format_ai_response(text: str) -> str:
     text = text.replace("#", "").split("End Response")[0].strip()
 
     # Normalize numbered lists to bullet format
-    text = re.sub(r"\s*\d+\.\s*", "\n• ", text)
+    text = re.sub(r"\s*\d+\.(?!\d)\s*", "\n• ", text)  # "1. item", but not decimals like 102.4
 
     # Split into lines, trim whitespace
     lines = [line.strip() for line in text.split("\n") if line.strip()]
@@ -186,4 +675,47 @@ def process_analyze_response(response_text: str):
     return {
         "ai_analysis": format_ai_response(ai_analysis),
         "triggered": triggered
-    }
\ No newline at end of file
+    }
+
+class AnalyzeStreamParser:
+    """
+    Incremental counterpart of process_analyze_response for streamed model output.
+
+    feed() takes raw text deltas and returns (event, payload) pairs as soon as they can
+    be produced: "analysis" with format_ai_response HTML of the complete lines seen so
+    far (before the <json> block), and "json" once </json> closes. finish() returns
+    exactly what process_analyze_response would for the whole text.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._lines_done = 0  # length of the text portion already formatted
+        self._json_start = -1
+        self._json_sent = False
+
+    def feed(self, delta: str) -> List[Tuple[str, object]]:
+        scan_from = max(len(self.text) - len("</json>"), 0)
+        self.text += delta
+        events = []
+        if self._json_start < 0:
+            start = self.text.find("<json>", scan_from)
+            if start >= 0:
+                self._json_start = start
+            head = self.text if start < 0 else self.text[:start]
+            cut = len(head) if start >= 0 else head.rfind("\n") + 1
+            if cut > self._lines_done and head[:cut].strip():
+                self._lines_done = cut
+                events.append(("analysis", format_ai_response(head[:cut].strip())))
+        if self._json_start >= 0 and not self._json_sent:
+            end = self.text.find("</json>", max(scan_from, self._json_start))
+            if end >= 0:
+                self._json_sent = True
+                block = re.sub(r"```(?:json)?", "", self.text[self._json_start + len("<json>"):end]).strip()
+                try:
+                    events.append(("json", json.loads(block)))
+                except json.JSONDecodeError:
+                    pass  # finish() reports the parse error the same way the batch path does
+        return events
+
+    def finish(self) -> Dict:
+        return process_analyze_response(self.text)
@@ -1,8 +1,21 @@
 import os
 import json
-import random
-from typing import Dict
-from utils.vector_utils import clean_watsonx_output, format_ai_response, get_recent_data, process_analyze_response
+import math
+from typing import Dict, Iterator, List, Optional
+from utils.inference_pool import InferencePool, MicroBatcher
+from utils.instrumentation import upstream_timer
+from utils.metrics_store import METRIC_FIELDS, to_iso
+from utils.response_cache import ResponseCache
+from utils.rules import analysis_rules
+from utils.single_flight import SingleFlight
+from utils.vector_utils import (
+    AnalyzeStreamParser,
+    clean_watsonx_output,
+    format_ai_response,
+    get_forecast,
+    process_analyze_response,
+    scaled_distance,
+)
 from dotenv import load_dotenv
 from ibm_watsonx_ai import APIClient, Credentials
 from ibm_watsonx_ai.foundation_models import ModelInference
@@ -13,6 +26,17 @@ load_dotenv()
 WATSONX_API_KEY = os.getenv("WATSONX_API_KEY", "")
 WATSONX_URL = os.getenv("WATSONX_URL", "https://us-south.ml.cloud.ibm.com")
 WATSONX_PROJECT_ID = os.getenv("WATSONX_PROJECT_ID", "")
+WATSONX_MODEL_ID = os.getenv("WATSONX_MODEL_ID", "ibm/granite-3-3-8b-instruct")
+WATSONX_POOL_SIZE = int(os.getenv("WATSONX_POOL_SIZE", "4"))  # concurrent generate calls per worker
+WATSONX_POOL_TIMEOUT_S = float(os.getenv("WATSONX_POOL_TIMEOUT_S", "30"))
+ANALYZE_BATCH_WINDOW_MS = float(os.getenv("ANALYZE_BATCH_WINDOW_MS", "25"))  # 0 = one generate call per request
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "8"))
+ANALYZE_PROMPT_VERSION = "1"  # bump when the prompt changes so cached answers are not reused
+FORECAST_PROMPT_VERSION = "2"
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "300"))
+RESPONSE_CACHE_BUCKETS = [float(b) for b in os.getenv("RESPONSE_CACHE_BUCKETS", "1,1,100").split(",")]  # co2, waste, energy
+RESPONSE_CACHE_RADIUS = float(os.getenv("RESPONSE_CACHE_RADIUS", "0"))  # >0: reuse answers this close (std units)
 
 
 def get_watsonx_client():
@@ -27,21 +51,60 @@ def get_watsonx_client():
         return None
 
 
-def analyze_with_watsonx(data: dict) -> str:
-    """
-    Analyze sustainability metrics using Watsonx.ai and suggest workflow actions.
-    Optionally simulate triggering workflows in Watson Orchestrate.
-    """
-    co2 = data.get("co2_emissions")
-    waste = data.get("waste_level")
-    energy = data.get("energy_usage")
+def _build_model(client) -> ModelInference:
+    return ModelInference(model_id=WATSONX_MODEL_ID, api_client=client)
+
+
+inference_pool = InferencePool(
+    get_watsonx_client, _build_model, size=WATSONX_POOL_SIZE, checkout_timeout=WATSONX_POOL_TIMEOUT_S
+)
+
+ANALYZE_PARAMS = {GenParams.MAX_NEW_TOKENS: 500}
+
+
+def _generate_analysis_batch(prompts: List[str]) -> List[Dict]:
+    """One generate call for several analysis prompts; the SDK returns one response per prompt."""
+    with upstream_timer("watsonx", "analyze_batch"):
+        return inference_pool.generate(prompts, ANALYZE_PARAMS)
+
+
+analysis_batcher = MicroBatcher(
+    _generate_analysis_batch, window_s=ANALYZE_BATCH_WINDOW_MS / 1000.0, max_batch=ANALYZE_BATCH_MAX
+)
+
+
+analyze_cache = ResponseCache(
+    RESPONSE_CACHE_BUCKETS, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S, scaled_distance, RESPONSE_CACHE_RADIUS
+)
+forecast_cache = ResponseCache(
+    RESPONSE_CACHE_BUCKETS, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S, scaled_distance, RESPONSE_CACHE_RADIUS
+)
+
+
+analyze_flight = SingleFlight()
+forecast_flight = SingleFlight()
+
+
+def cache_stats() -> Dict:
+    return {"analyze": analyze_cache.stats(), "forecast": forecast_cache.stats()}
+
+
+def watsonx_enabled() -> bool:
+    return bool(WATSONX_API_KEY and WATSONX_PROJECT_ID)
+
+
+def warm_watsonx():
+    """Create the shared client and model instances once, ahead of the first request."""
+    if not watsonx_enabled():
+        return
+    try:
+        inference_pool.warm()
+    except Exception as e:
+        print("⚠️ Watsonx warm-up error:", e)
 
-    # --- Reasoning via Watsonx.ai ---
-    client = get_watsonx_client()
-    ai_result = "No AI response."
 
-    if client:
-        prompt = f"""
+def _analyze_prompt(co2: float, waste: float, energy: float) -> str:
+    return f"""
         You are **GreenForce AI Assistant**, an intelligent sustainability advisor that helps organizations
         reduce their environmental footprint through actionable insights.
 
@@ -134,94 +197,265 @@ def analyze_with_watsonx(data: dict) -> str:
         </json>
         """
 
-        try:
-            model_inference = ModelInference(
-                model_id="ibm/granite-3-3-8b-instruct", api_client=client
-            )
-            generate_params = {
-                GenParams.MAX_NEW_TOKENS: 500
-            }
-            response = model_inference.generate(
-                prompt=prompt,
-                params=generate_params
-            )
+
+def _forecast_prompt(structured: List[Dict], horizon_s: float, model: str) -> str:
+    lines = "\n".join(
+        f"        - {row['metric']}: now {row['latest']}, predicted {row['predicted']} "
+        f"(95% interval {row['lower']} to {row['upper']})"
+        for row in structured
+    )
+    return f"""
+        You are an AI sustainability analyst. A statistical {model} model has produced the following
+        forecasts for the next {_format_horizon(horizon_s)}:
+{lines}
+
+        Do not change or invent numbers. In 3-5 sentences, explain what these forecasts mean for
+        CO₂ emissions (tons), Waste level (%), and Energy usage (kWh), and give a short actionable summary.
+        End with `End Response`.
+        """
+
+
+def _local_analysis(vector: List[float], verdict: Dict) -> Dict:
+    """Rule-based answer in the shape of process_analyze_response, for readings the LLM is not needed for."""
+    co2, waste, energy = vector
+    fired = verdict["fired"]
+    reasons = [rule.explain(vector[METRIC_FIELDS.index(rule.field)]) for rule in fired]
+    readings = f"CO₂ {co2:.1f} tons, waste {waste:.1f}%, energy {energy:,.0f} kWh"
+    lines = ["GreenForce AI Assistant:"]
+    if fired:
+        lines.append(f"Threshold checks flagged {len(fired)} metric(s) ({readings}):")
+        lines += [f"• {rule.workflow} – {reason}" for rule, reason in zip(fired, reasons)]
+        actions = [rule.action for rule in fired if rule.action]
+        if actions:
+            lines.append("Actions:")
+            lines += [f"• {action}" for action in actions]
+    else:
+        lines.append(f"All metrics are within their configured thresholds ({readings}). No workflow needs to be triggered.")
+        actions = []
+    return {
+        "ai_analysis": format_ai_response("\n".join(lines)),
+        "triggered": {
+            "recommended_workflows": [
+                {"name": rule.workflow, "reason": reason} for rule, reason in zip(fired, reasons)
+            ],
+            "next_actions": actions,
+        },
+    }
+
+
+def _readings(data: dict) -> List[float]:
+    """[co2, waste, energy] as floats; ValueError when one is missing, not numeric, NaN or inf."""
+    try:
+        vector = [float(data.get(field)) for field in METRIC_FIELDS]
+    except (TypeError, ValueError):
+        raise ValueError(f"Metrics must include numeric {', '.join(METRIC_FIELDS)}.")
+    if not all(math.isfinite(value) for value in vector):
+        # NaN fails every threshold comparison and would pass as "within thresholds"
+        raise ValueError("Metrics must be finite numbers.")
+    return vector
+
+
+def check_readings(data: dict):
+    """Raise ValueError for readings /analyze refuses (missing, non-numeric or non-finite values)."""
+    _readings(data)
+
+
+def _prescreen(data: dict):
+    """(vector, verdict) for a metrics dict; ValueError for readings check_readings refuses."""
+    vector = _readings(data)
+    return vector, analysis_rules.evaluate(vector)
+
+
+def analyze_with_watsonx(data: dict) -> str:
+    """
+    Analyze sustainability metrics and suggest workflow actions. The threshold rules
+    answer locally when nothing fires or the readings match a known pattern; only the
+    rest goes to Watsonx.ai (and falls back to the rule-based answer if that fails).
+    Raises ValueError for missing, non-numeric or non-finite readings.
+    """
+    vector, verdict = _prescreen(data)
+    if verdict["local"]:
+        return _local_analysis(vector, verdict)
+
+    # --- Reasoning via Watsonx.ai ---
+    cached = analyze_cache.get(vector, ANALYZE_PROMPT_VERSION)
+    if cached is not None:
+        return cached
+
+    if watsonx_enabled():
+        prompt = _analyze_prompt(*vector)
+
+        def generate():
+            if ANALYZE_BATCH_WINDOW_MS > 0:
+                response = analysis_batcher.submit(prompt)
+            else:
+                with upstream_timer("watsonx", "analyze"):
+                    response = inference_pool.generate(prompt, ANALYZE_PARAMS)
             ai_result = response["results"][0]["generated_text"].strip()
-            return process_analyze_response(ai_result)
+            result = process_analyze_response(ai_result)
+            analyze_cache.put(vector, ANALYZE_PROMPT_VERSION, result)
+            return result
+
+        try:
+            # identical concurrent requests (same cache bucket) share one generate call
+            return analyze_flight.do(analyze_cache.key(vector, ANALYZE_PROMPT_VERSION), generate)
         except Exception as e:
             print("⚠️ Watsonx analysis error:", e)
 
+    return _local_analysis(vector, verdict)
+
+
+FORECAST_LABELS = {"co2_emissions": "CO₂", "waste_level": "Waste", "energy_usage": "Energy"}
+
+
+def _format_horizon(horizon_s: float) -> str:
+    if horizon_s >= 86400:
+        return f"{horizon_s / 86400:g} day(s)"
+    if horizon_s >= 3600:
+        return f"{horizon_s / 3600:g} hour(s)"
+    return f"{horizon_s / 60:g} minute(s)"
+
+
+def _structured_forecast(snapshot: Dict) -> List[Dict]:
+    """Engine snapshot -> [{metric, latest, predicted, lower, upper}] for the selected model."""
+    rows = []
+    for field in snapshot["fields"]:
+        chosen = field["models"][snapshot["model"]]
+        rows.append({
+            "metric": FORECAST_LABELS.get(field["field"], field["field"]),
+            "latest": round(field["latest"], 2),
+            "predicted": round(chosen["predicted"], 2),
+            "lower": round(chosen["lower"], 2),
+            "upper": round(chosen["upper"], 2),
+        })
+    return rows
+
+
+def _plain_summary(structured: List[Dict], horizon_s: float) -> str:
+    """Narration used when watsonx.ai is unavailable."""
+    parts = []
+    for row in structured:
+        change = (row["predicted"] - row["latest"]) / row["latest"] * 100 if row["latest"] else 0.0
+        parts.append(f"{row['metric']} {row['latest']} → {row['predicted']} ({change:+.1f}%)")
+    return f"Forecast for the next {_format_horizon(horizon_s)}: " + "; ".join(parts) + "."
+
+
+def _forecast_context(horizon_s: Optional[float], model: Optional[str]):
+    snapshot = get_forecast(horizon_s, model)
+    if snapshot is None:
+        return None, None, None
+    structured = _structured_forecast(snapshot)
+    # Narrations are reused for the same (quantized) predictions, model and horizon
+    version = f"{FORECAST_PROMPT_VERSION}:{snapshot['model']}:{snapshot['horizon_s']:g}"
+    return snapshot, structured, version
+
+
+def _forecast_payload(snapshot: Dict, structured: List[Dict], summary: str) -> Dict:
     return {
-        "ai_analysis": "Could not generate analysis",
-        "triggered": "Workflows could not be triggered"
+        "forecast": clean_watsonx_output(summary),
+        "structured": structured,
+        "model": snapshot["model"],
+        "horizon_s": snapshot["horizon_s"],
+        "as_of": to_iso(snapshot["as_of"]),
     }
 
 
-def forecast_with_watsonx() -> Dict:
+def forecast_with_watsonx(horizon_s: Optional[float] = None, model: Optional[str] = None) -> Dict:
     """
-    Generate sustainability trend forecast using IBM watsonx.ai.
-    Falls back to local estimation if watsonx.ai is unavailable.
+    Sustainability trend forecast from the local statistical models (see get_forecast).
+    watsonx.ai only narrates the numbers; without it a plain summary is returned.
     """
-    history = get_recent_data(10)
-    if not history:
+    snapshot, structured, version = _forecast_context(horizon_s, model)
+    if snapshot is None:
         return {"forecast": "No data available for forecasting.", "structured": []}
+    predicted = [row["predicted"] for row in structured]
 
-    # --- Compute averages from recent metrics ---
-    avg_co2 = sum(r["co2_emissions"] for r in history) / len(history)
-    avg_waste = sum(r["waste_level"] for r in history) / len(history)
-    avg_energy = sum(r["energy_usage"] for r in history) / len(history)
-
-    # --- Try using watsonx.ai ---
-    client = get_watsonx_client()
-    if client:
-        prompt = f"""
-        You are an AI sustainability analyst. Based on the following 10 most recent sustainability metrics, 
-        predict the trend for CO₂ emissions (tons), Waste level (%), and Energy usage (kWh) for the next 7 days.
-        Provide numeric forecasts and a short actionable summary.
-
-        Historical data:
-        {json.dumps(history, indent=2)}
-        """
+    forecast_summary = forecast_cache.get(predicted, version)
+    if forecast_summary is None and watsonx_enabled():
+        prompt = _forecast_prompt(structured, snapshot["horizon_s"], snapshot["model"])
 
-        forecast_summary = "Actionable summary: Monitor CO₂ and Waste closely; initiate audits if trends exceed +5%."
-        try:
-            model_inference = ModelInference(
-                model_id="ibm/granite-3-3-8b-instruct", api_client=client
-            )
+        def generate():
             generate_params = {
-                GenParams.MAX_NEW_TOKENS: 500
+                GenParams.MAX_NEW_TOKENS: 300
             }
-            response = model_inference.generate(
-                prompt=prompt,
-                params=generate_params
-            )
+            with upstream_timer("watsonx", "forecast"):
+                response = inference_pool.generate(prompt, generate_params)
 
             # 5️⃣ Extract text safely
             if response and "results" in response and len(response["results"]) > 0:
-                forecast_summary = response["results"][0].get("generated_text", "").strip()
+                summary = response["results"][0].get("generated_text", "").strip()
+                forecast_cache.put(predicted, version, summary)
+                return summary
+            return None
+
+        try:
+            forecast_summary = forecast_flight.do(forecast_cache.key(predicted, version), generate)
         except Exception as e:
             print("⚠️ watsonx.ai forecast error:", e)
 
-    # --- Fallback local forecast ---
-    trend_co2 = random.uniform(0.98, 1.05)
-    trend_waste = random.uniform(0.97, 1.04)
-    trend_energy = random.uniform(0.96, 1.03)
+    return _forecast_payload(snapshot, structured, forecast_summary or _plain_summary(structured, snapshot["horizon_s"]))
+
+
+# --- Streaming variants (SSE) ---
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
-    structured = [
-        {
-            "metric": "CO₂",
-            "latest": round(avg_co2, 2),
-            "predicted": round(avg_co2 * trend_co2, 2),
-        },
-        {
-            "metric": "Waste",
-            "latest": round(avg_waste, 2),
-            "predicted": round(avg_waste * trend_waste, 2),
-        },
-        {
-            "metric": "Energy",
-            "latest": round(avg_energy, 2),
-            "predicted": round(avg_energy * trend_energy, 2),
-        },
-    ]
 
-    return {"forecast": clean_watsonx_output(forecast_summary), "structured": structured}
+def _stream_tokens(prompt: str, max_new_tokens: int = 500) -> Iterator[str]:
+    """Text deltas from the streaming generate API, on a pooled model instance."""
+    with upstream_timer("watsonx", "stream"), inference_pool.checkout() as model:
+        yield from model.generate_text_stream(prompt=prompt, params={GenParams.MAX_NEW_TOKENS: max_new_tokens})
+
+
+def stream_analysis(data: dict) -> Iterator[str]:
+    """
+    SSE version of analyze_with_watsonx: "token" events as the model writes, "analysis"
+    (formatted HTML so far) and "json" as soon as they parse, then "result" carrying
+    the same payload /analyze returns. Readings the rules answer locally get "result" only.
+    """
+    vector, verdict = _prescreen(data)
+    if verdict["local"] or not watsonx_enabled():
+        yield _sse("result", _local_analysis(vector, verdict))
+        return
+    cached = analyze_cache.get(vector, ANALYZE_PROMPT_VERSION)
+    if cached is not None:
+        yield _sse("result", cached)
+        return
+
+    parser = AnalyzeStreamParser()
+    try:
+        for delta in _stream_tokens(_analyze_prompt(*vector)):
+            yield _sse("token", {"text": delta})
+            for event, payload in parser.feed(delta):
+                yield _sse(event, payload)
+        result = parser.finish()
+        analyze_cache.put(vector, ANALYZE_PROMPT_VERSION, result)
+    except Exception as e:
+        print("⚠️ Watsonx analysis error:", e)
+        yield _sse("error", {"detail": str(e)})
+        result = _local_analysis(vector, verdict)
+    yield _sse("result", result)
+
+
+def stream_forecast(horizon_s: Optional[float] = None, model: Optional[str] = None) -> Iterator[str]:
+    """SSE version of forecast_with_watsonx: "token" events of the narration, then the usual payload as "result"."""
+    snapshot, structured, version = _forecast_context(horizon_s, model)
+    if snapshot is None:
+        yield _sse("result", {"forecast": "No data available for forecasting.", "structured": []})
+        return
+    predicted = [row["predicted"] for row in structured]
+    summary = forecast_cache.get(predicted, version)
+    if summary is None and watsonx_enabled():
+        parts = []
+        try:
+            prompt = _forecast_prompt(structured, snapshot["horizon_s"], snapshot["model"])
+            for delta in _stream_tokens(prompt, max_new_tokens=300):
+                parts.append(delta)
+                yield _sse("token", {"text": delta})
+            summary = "".join(parts).strip()
+            forecast_cache.put(predicted, version, summary)
+        except Exception as e:
+            print("⚠️ watsonx.ai forecast error:", e)
+            yield _sse("error", {"detail": str(e)})
+            summary = None
+    yield _sse("result", _forecast_payload(snapshot, structured, summary or _plain_summary(structured, snapshot["horizon_s"])))
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+import httpx
+
+from utils.run_tracker import backoff_delays
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transport failures, timeouts, 429 and 5xx are worth another attempt; other 4xx are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, asyncio.TimeoutError))
+
+
+def _is_auth_error(error: Exception) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 401
+
+
+class WorkflowDispatcher:
+    """
+    Fires workflow triggers concurrently through `send(workflow, context)`.
+
+    Triggers with the same dedupe key (workflow name plus the given key, else the
+    context's "site", else a hash of the whole context) collapse while one is in flight and for `cooldown_s` after it
+    finished: callers get that dispatch's outcome, marked `deduplicated`. At most
+    `max_parallel` sends run at once; transient failures are retried up to `retries`
+    times with jittered exponential backoff, and a 401 calls `on_auth_error` (e.g. to
+    drop a cached token) before the retry. Outcomes are never raised, only reported.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, dict], Awaitable[dict]],
+        max_parallel: int = 8,
+        cooldown_s: float = 300.0,
+        retries: int = 3,
+        backoff_initial_s: float = 0.5,
+        backoff_max_s: float = 8.0,
+        on_auth_error: Optional[Callable[[], None]] = None,
+        history: int = 1000,
+    ):
+        self.send = send
+        self.max_parallel = max_parallel
+        self.cooldown_s = cooldown_s
+        self.retries = retries
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        self.on_auth_error = on_auth_error
+        self.history = history
+        self._slots: Optional[asyncio.Semaphore] = None  # created on first use, inside the loop
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._recent: "OrderedDict[Hashable, Dict]" = OrderedDict()  # key -> finished outcome
+        self.sent = 0
+        self.deduplicated = 0
+        self.retried = 0
+
+    @staticmethod
+    def dedupe_key(workflow: str, context: dict, key: Optional[str] = None) -> Hashable:
+        if key is not None:
+            return (workflow, key)
+        context = context or {}
+        if context.get("site"):
+            return (workflow, str(context["site"]))
+        canonical = json.dumps(context, sort_keys=True, default=str)
+        return (workflow, "context:" + hashlib.sha1(canonical.encode()).hexdigest()[:16])
+
+    async def dispatch(self, workflow: str, context: Optional[dict] = None, key: Optional[str] = None) -> Dict:
+        """Trigger one workflow (or join an equivalent recent one) and return its outcome."""
+        context = context or {}
+        dedupe = self.dedupe_key(workflow, context, key)
+        recent = self._recent.get(dedupe)
+        if recent is not None and time.time() - recent["finished"] < self.cooldown_s:
+            self.deduplicated += 1
+            return {**recent, "deduplicated": True}
+        task = self._inflight.get(dedupe)
+        if task is not None:
+            self.deduplicated += 1
+            return {**await asyncio.shield(task), "deduplicated": True}
+        task = self._inflight[dedupe] = asyncio.ensure_future(self._run(workflow, context, dedupe))
+        return await asyncio.shield(task)  # the send outlives a caller that goes away
+
+    async def dispatch_many(self, triggers: List[Dict]) -> List[Dict]:
+        """Dispatch [{"workflow", "context"?, "key"?}, ...] concurrently; outcomes in the same order."""
+        return list(await asyncio.gather(*(
+            self.dispatch(t["workflow"], t.get("context"), t.get("key")) for t in triggers
+        )))
+
+    async def _run(self, workflow: str, context: dict, dedupe: Hashable) -> Dict:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_parallel)
+        outcome = {"workflow": workflow, "key": dedupe[1], "status": "failed", "attempts": 0, "deduplicated": False}
+        delays = backoff_delays(self.backoff_initial_s, self.backoff_max_s)
+        started = time.time()
+        try:
+            while True:
+                outcome["attempts"] += 1
+                try:
+                    async with self._slots:
+                        self.sent += 1
+                        response = await self.send(workflow, context)
+                    outcome.update(status="succeeded", response=response)
+                    break
+                except Exception as e:
+                    auth = _is_auth_error(e)
+                    if auth and self.on_auth_error is not None:
+                        self.on_auth_error()
+                    if outcome["attempts"] > self.retries or not (auth or is_retryable(e)):
+                        outcome["error"] = (str(e) or type(e).__name__).splitlines()[0]
+                        print(f"⚠️ Workflow {workflow} failed after {outcome['attempts']} attempt(s): {outcome['error']}")
+                        break
+                    self.retried += 1
+                    await asyncio.sleep(next(delays))
+        finally:
+            outcome.update(started=started, finished=time.time())
+            self._inflight.pop(dedupe, None)
+            self._remember(dedupe, outcome)
+        return outcome
+
+    def _remember(self, dedupe: Hashable, outcome: Dict):
+        if outcome["status"] != "succeeded":
+            return  # failures do not hold back the next trigger
+        self._recent[dedupe] = outcome
+        self._recent.move_to_end(dedupe)
+        now = time.time()
+        while self._recent and (
+            len(self._recent) > self.history
+            or now - next(iter(self._recent.values()))["finished"] >= self.cooldown_s
+        ):
+            self._recent.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._inflight),
+            "cooling_down": len(self._recent),
+        }